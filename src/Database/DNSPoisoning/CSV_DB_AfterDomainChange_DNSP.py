@@ -1,14 +1,11 @@
-import ast
-import concurrent.futures
-import csv
 import logging
-import multiprocessing
 import os
 import os.path
+import sys
 
-import tqdm
 from ..DBOperations import ADC_db, MongoDBHandler
-from tqdm import tqdm
+from ..ingest_engine import Dataset, ingest
+from ...scripts.result_store import fast_literal_eval
 
 # TestResults
 CM_DNSP_ADC = MongoDBHandler(ADC_db['China-Mobile-DNSPoisoning'])
@@ -17,10 +14,6 @@ CT_DNSP_ADC = MongoDBHandler(ADC_db['China-Telecom-DNSPoisoning'])
 # CompareGroup
 UCD_DNSP_ADC = MongoDBHandler(ADC_db['UCDavis-Server-DNSPoisoning'])
 
-# Optimize worker count based on CPU cores
-CPU_CORES = multiprocessing.cpu_count()
-MAX_WORKERS = max(CPU_CORES * 2, 64)  # Dynamically set workers
-
 if os.name == 'nt':
   AfterDomainChangeFolder = 'E:\\Developer\\SourceRepo\\GFW-Research\\Lib\\AfterDomainChange\\'
 else:
@@ -35,109 +28,65 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # DNS Poisoning results
-def CM_DNSP(folder_location: str) -> list:
+# The normalisers run in parse worker processes, one record (row) at a time
+def CM_DNSP(row: dict, path: str) -> list:
   readingResults = []
-  CM_DNSP_ADC.drop()
-  file_list = os.listdir(folder_location)
-  for file_name in tqdm(file_list, desc='Processing China-Mobile-DNSPoisoning'):
-    if file_name.endswith('.csv'):
-      with open(folder_location + file_name, 'r', encoding='utf-8') as file:
-        csv_reader = csv.reader(file)
-        for row in csv_reader:
-          if row[0] == 'timestamp':
-            continue
-          try:
-            dns_servers = ast.literal_eval(row[2])  # 使用 ast.literal_eval 安全地将字符串转换为列表
-          except (ValueError, SyntaxError):
-            dns_servers = [row[2]]  # 如果转换失败，则将其视为单个 DNS 服务器
-          for dns_server in dns_servers:
-            formatted_document = {
-              'timestamp': row[0],
-              'domain': row[1],
-              'dns_server': dns_server,
-              'ips': row[3] + row[4]
-            }
-            readingResults.append(formatted_document)
-
-  # Data merge and cleanup
-  CM_DNSP_ADC.create_index([('domain', 1), ('dns_server', 1), ('timestamp', 1)], unique=False)  # 创建包含timestamp的复合唯一索引
+  try:
+    dns_servers = fast_literal_eval(row['china_result_ipv4'])  # 使用 fast_literal_eval 安全地将字符串转换为列表
+  except (ValueError, SyntaxError):
+    dns_servers = [row['china_result_ipv4']]  # 如果转换失败，则将其视为单个 DNS 服务器
+  for dns_server in dns_servers:
+    readingResults.append({
+      'timestamp': row['timestamp'],
+      'domain': row['domain'],
+      'dns_server': dns_server,
+      'ips': row['china_result_ipv6'] + row['global_result_ipv4']
+    })
   return readingResults
 
-def CT_DNSP(folder_location: str) -> list:
+def CT_DNSP(row: dict, path: str) -> list:
   readingResults = []
-  CT_DNSP_ADC.drop()
-  file_list = os.listdir(folder_location)
-  for file_name in tqdm(file_list, desc='Processing China-Telecom-DNSPoisoning'):
-    if file_name.endswith('.csv'):
-      with open(folder_location + file_name, 'r', encoding='utf-8') as file:
-        csv_reader = csv.reader(file)
-        for row in csv_reader:
-          if row[0] == 'timestamp':
-            continue
-          try:
-            dns_servers = ast.literal_eval(row[2])  # 使用 ast.literal_eval 安全地将字符串转换为列表
-          except (ValueError, SyntaxError):
-            dns_servers = [row[2]]  # 如果转换失败，则将其视为单个 DNS 服务器
-          for dns_server in dns_servers:
-            determind_poisoned = (row[7].strip().lower() == 'true') and (row[8].strip().lower() == 'true')
-            formatted_document = {
-              "timestamp": row[0],
-              "domain": row[1],
-              "dns_server": dns_server,
-              "ips": row[3] + row[4] + row[5],
-              "is_poisoned": determind_poisoned
-            }
-            readingResults.append(formatted_document)
-
-  # Data merge and cleanup
-  CT_DNSP_ADC.create_index([('domain', 1), ('dns_server', 1), ('timestamp', 1)], unique=False)  # 创建包含timestamp的复合唯一索引
+  try:
+    dns_servers = fast_literal_eval(row['china_result_ipv4'])  # 使用 fast_literal_eval 安全地将字符串转换为列表
+  except (ValueError, SyntaxError):
+    dns_servers = [row['china_result_ipv4']]  # 如果转换失败，则将其视为单个 DNS 服务器
+  determind_poisoned = (row['is_poisoned_ipv4'].strip().lower() == 'true') and (row['is_poisoned_ipv6'].strip().lower() == 'true')
+  for dns_server in dns_servers:
+    readingResults.append({
+      "timestamp": row['timestamp'],
+      "domain": row['domain'],
+      "dns_server": dns_server,
+      "ips": row['china_result_ipv6'] + row['global_result_ipv4'] + row['global_result_ipv6'],
+      "is_poisoned": determind_poisoned
+    })
   return readingResults
 
-def UCD_DNSP(folder_location: str) -> list:
-  CompareGroupResults = []
-  UCD_DNSP_ADC.drop()
-  file_list = os.listdir(folder_location)
-  for file_name in tqdm(file_list, desc='Processing UCDavis-Server-DNSPoisoning'):
-    if file_name.endswith('.csv'):
-      with open(folder_location + file_name, 'r', encoding='utf-8') as file:
-        csv_reader = csv.reader(file)
-        for row in csv_reader:
-          if row[0] == 'timestamp':
-            continue
-          determind_poisoned = (row[7].strip().lower() == 'true') and (row[8].strip().lower() == 'true')
-          formatted_document = {
-            "timestamp": row[0],
-            "domain": row[1],
-            "dns_server": row[2],
-            "ips": row[3] + row[4] + row[5],
-            "is_poisoned": determind_poisoned
-          }
-          CompareGroupResults.append(formatted_document)
-
-  # Data merge and cleanup
-  UCD_DNSP_ADC.create_index([('domain', 1), ('dns_server', 1), ('timestamp', 1)], unique=False)  # 创建包含timestamp的复合唯一索引
-  return CompareGroupResults
-
-
-def insert_to_db(results: list, db_handler: MongoDBHandler):
-  if results:
-    for result in tqdm(results, desc='Inserting to DB'):
-      db_handler.insert_one(result)
-
-def main():
-  with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-    # China Mobile
-    CM_DNSP_results = executor.submit(CM_DNSP, os.path.join(AfterDomainChangeFolder, 'China-Mobile', 'DNSPoisoning/'))
-    # China Telecom
-    CT_DNSP_results = executor.submit(CT_DNSP, os.path.join(AfterDomainChangeFolder, 'China-Telecom', 'DNSPoisoning/'))
-    # Compare Group
-    UCD_DNSP_results = executor.submit(UCD_DNSP, os.path.join(AfterDomainChangeFolder, 'UCDavis-Server', 'DNSPoisoning/'))
-
-    # Insert to DB
-    insert_to_db(CM_DNSP_results.result(), CM_DNSP_ADC)
-    insert_to_db(CT_DNSP_results.result(), CT_DNSP_ADC)
-    insert_to_db(UCD_DNSP_results.result(), UCD_DNSP_ADC)
-
+def UCD_DNSP(row: dict, path: str) -> list:
+  determind_poisoned = (row['is_poisoned_ipv4'].strip().lower() == 'true') and (row['is_poisoned_ipv6'].strip().lower() == 'true')
+  return [{
+    "timestamp": row['timestamp'],
+    "domain": row['domain'],
+    "dns_server": row['china_result_ipv4'],
+    "ips": row['china_result_ipv6'] + row['global_result_ipv4'] + row['global_result_ipv6'],
+    "is_poisoned": determind_poisoned
+  }]
+
+
+def dataset(folder_location: str, normalise, db_handler: MongoDBHandler) -> Dataset:
+  return Dataset(
+    db_handler,
+    folder_location,
+    normalise,
+    layouts=('dns-poisoning',)
+  )
+
+def main(full=False):
+  # China Mobile
+  ingest(dataset(os.path.join(AfterDomainChangeFolder, 'China-Mobile', 'DNSPoisoning/'), CM_DNSP, CM_DNSP_ADC), full)
+  # China Telecom
+  ingest(dataset(os.path.join(AfterDomainChangeFolder, 'China-Telecom', 'DNSPoisoning/'), CT_DNSP, CT_DNSP_ADC), full)
+  # Compare Group
+  ingest(dataset(os.path.join(AfterDomainChangeFolder, 'UCDavis-Server', 'DNSPoisoning/'), UCD_DNSP, UCD_DNSP_ADC), full)
 
 if __name__ == '__main__':
-  main()
+  main(full='--full' in sys.argv)
@@ -1,16 +1,9 @@
-import csv
 import logging
-import multiprocessing
-import os
-import tqdm
-import ast
 import re
+import sys
 from ..DBOperations import BDC_db, MongoDBHandler
-import hashlib
-
-# Constants
-CPU_CORES = multiprocessing.cpu_count()
-MAX_WORKERS = max(CPU_CORES * 2, 64)  # Dynamically set workers
+from ..ingest_engine import Dataset, ingest
+from ...scripts.result_store import fast_literal_eval
 
 CM_DNSP_BDC = MongoDBHandler(BDC_db['China-Mobile-DNSPoisoning'])
 UCD_DNSP_BDC = MongoDBHandler(BDC_db['UCDavis-CompareGroup-DNSPoisoning'])
@@ -26,39 +19,30 @@ def toBoolean(value: str) -> bool:
   return value == 'True'
 
 # DNS Poisoning results
-def BDC_DNSP_Dump(db, folder_location: str) -> list:
-  db.drop()  # Clear the collection before inserting new data
-  file_list = os.listdir(folder_location)
-  counter = 0
-  for file_name in tqdm.tqdm(file_list, desc=f'Processing {db.collection.name} '):
-    if file_name.endswith('.csv'):
-      with open(os.path.join(folder_location, file_name), 'r', encoding='utf-8') as file:
-        csv_reader = csv.reader(file)
-        batch_results = []
-        for row in csv_reader:
-          if row[0] == 'timestamp':
-            continue
-          try:
-            timestamp = row[0]
-            domain = row[1]
-            ipv4_results = set(filter(lambda ip: re.match(r'^\d{1,3}(\.\d{1,3}){3}$', ip), ast.literal_eval(row[2]) + ast.literal_eval(row[4])))
-            ipv6_results = set(filter(lambda ip: len(ip) > 2 and re.match(r'^[0-9a-fA-F:]+$', ip), ast.literal_eval(row[3]) + ast.literal_eval(row[5])))
+def normalise_row(row: dict, path: str) -> list:
+  # Runs in a parse worker process, see ingest_engine.ingest
+  try:
+    ipv4_results = set(filter(lambda ip: re.match(r'^\d{1,3}(\.\d{1,3}){3}$', ip), fast_literal_eval(row['china_result_ipv4']) + fast_literal_eval(row['global_result_ipv4'])))
+    ipv6_results = set(filter(lambda ip: len(ip) > 2 and re.match(r'^[0-9a-fA-F:]+$', ip), fast_literal_eval(row['china_result_ipv6']) + fast_literal_eval(row['global_result_ipv6'])))
+  except Exception as e:
+    logger.error(f"Error processing row: {row}, error: {e}")
+    return []
+  return [{
+    'timestamp': row['timestamp'],
+    'domain': row['domain'],
+    'ips': sorted(ipv4_results.union(ipv6_results)),
+  }]
 
-            result = {
-              "_id": f"{db.collection.name}-{domain}-{timestamp}-{counter}",
-              'timestamp': timestamp,
-              'domain': domain,
-              'ips': list(ipv4_results.union(ipv6_results)),
-            }
-            batch_results.append(result)
-            counter += 1
-          except Exception as e:
-            logger.error(f"Error processing row: {row}, error: {e}")
-    if batch_results:
-      db.insert_many(batch_results)
-  # Create indexes
-  db.create_index([('domain', 1), ('timestamp', 1)], unique=False)
+def BDC_DNSP_Dump(db, folder_location: str, full: bool = False) -> dict:
+  # Only new or changed files, the collection is only dropped for a rebuild
+  return ingest(Dataset(
+    db,
+    folder_location,
+    normalise_row,
+    layouts=('dns-poisoning',)
+  ), full)
 
 if __name__ == '__main__':
-  BDC_DNSP_Dump(CM_DNSP_BDC, "E:\\Developer\\SourceRepo\\GFW-Research\\Lib\\BeforeDomainChange\\DNSPoisoning")
-  BDC_DNSP_Dump(UCD_DNSP_BDC, "E:\\Developer\\SourceRepo\\GFW-Research\\Lib\\BeforeDomainChange\\CompareGroup\\DNSPoisoning")
+  full = '--full' in sys.argv
+  BDC_DNSP_Dump(CM_DNSP_BDC, "E:\\Developer\\SourceRepo\\GFW-Research\\Lib\\BeforeDomainChange\\DNSPoisoning", full)
+  BDC_DNSP_Dump(UCD_DNSP_BDC, "E:\\Developer\\SourceRepo\\GFW-Research\\Lib\\BeforeDomainChange\\CompareGroup\\DNSPoisoning", full)
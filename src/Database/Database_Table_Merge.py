@@ -1,13 +1,19 @@
 import concurrent.futures
 import logging
 import multiprocessing
-import re
-import ast
-from collections import defaultdict
+import shutil
+import sys
+import tempfile
+import zlib
+from collections import Counter, defaultdict
 from itertools import chain
-from threading import Lock
 
 from .DBOperations import ADC_db, BDC_db, Merged_db, MongoDBHandler
+from .merge_pipeline import stage_source
+from .preaggregate import merge_run_files, write_run
+from ..scripts.error_normalizer import TRACEROUTE
+from ..scripts.ip_classify import INTERNAL
+from ..scripts.result_store import fast_literal_eval
 from tqdm import tqdm
 
 # Config Logger
@@ -55,10 +61,106 @@ Merged_db_2024_GFWL = MongoDBHandler(Merged_db["2024_Nov_GFWL"])  # 新增
 
 # Optimize worker count based on CPU cores
 CPU_CORES = multiprocessing.cpu_count()
-MAX_WORKERS = max(CPU_CORES * 2, 512)  # Dynamically set workers
+# Each source collection is read in _id ranges, one worker process per range
+# building its own partial map
+MERGE_PROCESSES = CPU_CORES
+# Keys a worker holds before spilling its partial map to disk as a sorted
+# run. Memory stays around MERGE_PROCESSES times this many keys, however many
+# documents the sources hold; the runs are merged one key at a time
+MAX_PARTIAL_KEYS = 200_000
+# Partial maps are spilled split by a CRC32 of the key (hash() is salted per
+# process), and every shard of every merged collection is reduced and
+# written by its own task
+REDUCE_SHARDS = CPU_CORES
 BATCH_SIZE = 10000  # Increased batch size for more efficient processing
 
 
+def shard_of(sort_key: str, shards: int = REDUCE_SHARDS) -> int:
+  return zlib.crc32(sort_key.encode('utf-8')) % shards
+
+
+def spill_partial(partial: dict, run_dir: str,
+                  shards: int = REDUCE_SHARDS) -> list:
+  """(shard, path) of one sorted run file per shard `partial` has keys in."""
+  # repr() sorts domain and (domain, dns_server) keys alike, and is the same
+  # in every worker process
+  entries = [[] for _ in range(shards)]
+  for key, fields in partial.items():
+    sort_key = repr(key)
+    entries[shard_of(sort_key, shards)].append((sort_key, key, fields))
+  return [(shard,
+           write_run(sorted(shard_entries, key=lambda entry: entry[0]),
+                     run_dir))
+          for shard, shard_entries in enumerate(entries) if shard_entries]
+
+
+def build_partial(source,
+                  query: dict,
+                  merge_function,
+                  use_dns_server: bool,
+                  run_dir: str,
+                  max_keys: int = MAX_PARTIAL_KEYS) -> list:
+  """
+    Partial map of the documents of `source` matching `query`, run in a
+    worker process. Written to `run_dir` as sorted runs per shard, of at most
+    `max_keys` keys per spill; returns their (shard, path) pairs.
+    """
+  partial = {}
+  runs = []
+  for document in source.iter_find(query, no_cursor_timeout=True):
+    merge_function(document, partial, use_dns_server)
+    if len(partial) >= max_keys:
+      runs.extend(spill_partial(partial, run_dir))
+      partial = {}
+  if partial:
+    runs.extend(spill_partial(partial, run_dir))
+  return runs
+
+
+def merged_keys(runs: list):
+  """
+    (key, fields) of every key in the sorted run files `runs`, each exactly
+    once, with the fields of all its partial maps unioned.
+    """
+  current = key = fields = None
+  for sort_key, run_key, run_fields in merge_run_files(runs):
+    if sort_key != current:
+      if fields is not None:
+        yield key, fields
+      current, key, fields = sort_key, run_key, defaultdict(set)
+    for field, values in run_fields.items():
+      fields[field].update(values)
+  if fields is not None:
+    yield key, fields
+
+
+_reducer = None  # The Merger, in each reduce worker process
+
+
+def _init_reducer(merger) -> None:
+  global _reducer
+  _reducer = merger
+
+
+def finalize_shard(runs: list, target_db, is_traceroute: bool,
+                   use_dns_server: bool, shard: int, shards: int) -> tuple:
+  """
+    Merge the run files of one shard and write its documents, run in a
+    worker process. Shards hold disjoint keys; the `_id` counters of shard
+    `shard` are shard, shard + shards, ... so they never collide. Returns
+    the number of documents written and the error codes this shard added
+    to TRACEROUTE.counts, which the parent folds into its own.
+    """
+  before = Counter(TRACEROUTE.counts)
+  written = _reducer._finalize_documents(merged_keys(runs),
+                                         target_db,
+                                         is_traceroute=is_traceroute,
+                                         use_dns_server=use_dns_server,
+                                         first_counter=shard,
+                                         counter_step=shards)
+  return written, TRACEROUTE.counts - before
+
+
 class Merger:
 
   def __init__(
@@ -102,122 +204,134 @@ class Merger:
     self.merged_db_2025_gfwl = merged_db_2025_gfwl  # 新增
     self.merged_db_2024_dns = merged_db_2024_dns  # 新增
     self.merged_db_2024_gfwl = merged_db_2024_gfwl  # 新增
-    self.processed_domains_dnsp = defaultdict(lambda: defaultdict(set))
-    self.processed_domains_dnsp_2024_NOV = defaultdict(
-        lambda: defaultdict(set))
-    self.processed_domains_dnsp_2025 = defaultdict(lambda: defaultdict(set))
-    self.processed_domains_tr = defaultdict(lambda: defaultdict(set))
-    self.processed_domains_tr_2024_NOV = defaultdict(lambda: defaultdict(set))
-    self.processed_domains_tr_2025 = defaultdict(lambda: defaultdict(set))
-    self.lock = Lock()
-
-  def merge_documents(self):
-    with concurrent.futures.ThreadPoolExecutor(
-        max_workers=MAX_WORKERS) as executor:
-      futures = [
-          # DNSPoisoning Constants
-          executor.submit(self._merge_documents,
-                          self.adc_cm_dnsp,
-                          self._merge_adc_cm_dnsp,
-                          self.processed_domains_dnsp,
-                          self.merged_db_dnsp,
-                          use_dns_server=True),
-          executor.submit(self._merge_documents,
-                          self.adc_ct_dnsp,
-                          self._merge_adc_ct_dnsp,
-                          self.processed_domains_dnsp,
-                          self.merged_db_dnsp,
-                          use_dns_server=True),
-          executor.submit(self._merge_documents,
-                          self.bdc_cm_dnsp,
-                          self._merge_bdc_cm_dnsp,
-                          self.processed_domains_dnsp,
-                          self.merged_db_dnsp,
-                          use_dns_server=True),
-
-          # TraceRoute Constants
-          executor.submit(self._merge_documents, self.adc_cm_gfwl,
-                          self._merge_adc_cm_gfwl, self.processed_domains_tr,
-                          self.merged_db_tr),
-          executor.submit(self._merge_documents, self.adc_ct_gfwl,
-                          self._merge_adc_ct_gfwl, self.processed_domains_tr,
-                          self.merged_db_tr),
-          executor.submit(self._merge_documents, self.adc_ct_ipb,
-                          self._merge_adc_ct_ipb, self.processed_domains_tr,
-                          self.merged_db_tr),
-          executor.submit(self._merge_documents, self.bdc_cm_gfwl,
-                          self._merge_bdc_cm_gfwl, self.processed_domains_tr,
-                          self.merged_db_tr),
-          executor.submit(self._merge_documents, self.bdc_ct_ipb,
-                          self._merge_bdc_ct_ipb, self.processed_domains_tr,
-                          self.merged_db_tr),
-          # 2025 Data Constants
-          executor.submit(self._merge_documents,
-                          self.adc_cm_dnsp_2025,
-                          self._merge_adc_cm_dnsp,
-                          self.processed_domains_dnsp_2025,
-                          self.merged_db_2025_dns,
-                          use_dns_server=True),  # 新增
-          executor.submit(self._merge_documents, self.adc_cm_gfwl_2025,
-                          self._merge_adc_cm_gfwl,
-                          self.processed_domains_tr_2025,
-                          self.merged_db_2025_gfwl),  # 新增
-          # 2024 November Data Constants
-          executor.submit(self._merge_documents,
-                          self.adc_cm_dnsp_nov,
-                          self._merge_adc_cm_dnsp_nov,
-                          self.processed_domains_dnsp_2024_NOV,
-                          self.merged_db_2024_dns,
-                          use_dns_server=True),  # 新增
-          executor.submit(self._merge_documents, self.adc_cm_gfwl_nov,
-                          self._merge_adc_cm_gfwl_nov,
-                          self.processed_domains_tr_2024_NOV,
-                          self.merged_db_2024_gfwl),  # 新增
-      ]
-      for future in concurrent.futures.as_completed(futures):
-        try:
-          future.result()
-        except Exception as e:
-          logger.error(f"Error in thread execution: {e}")
-    self._finalize_documents(self.processed_domains_dnsp,
-                             self.merged_db_dnsp,
-                             is_traceroute=False,
-                             use_dns_server=True)
-    self._finalize_documents(self.processed_domains_tr,
-                             self.merged_db_tr,
-                             is_traceroute=True)
-    self._finalize_documents(self.processed_domains_dnsp_2025,
-                             self.merged_db_2025_dns,
-                             is_traceroute=False,
-                             use_dns_server=True)  # 新增
-    self._finalize_documents(self.processed_domains_tr_2025,
-                             self.merged_db_2025_gfwl,
-                             is_traceroute=True)  # 新增
-    self._finalize_documents(self.processed_domains_dnsp_2024_NOV,
-                             self.merged_db_2024_dns,
-                             is_traceroute=False,
-                             use_dns_server=True)  # 新增
-    self._finalize_documents(self.processed_domains_tr_2024_NOV,
-                             self.merged_db_2024_gfwl,
-                             is_traceroute=True)  # 新增
-
-  def _merge_documents(self,
-                       db_handler,
-                       merge_function,
-                       processed_domains,
-                       target_db,
-                       use_dns_server=False):
-    logger.info(f"Merging documents from {db_handler.collection.name}")
+    self._error_code_data = None  # 见 _error_codes
+
+  def merge_documents(self, pushdown: bool = False):
+    """
+        Merge every source into the merged collections. With `pushdown` the
+        union per key of each source is computed on the server first (see
+        merge_pipeline.py), and only those documents are read back.
+        """
+    # (source, merge function, merged collection, use_dns_server)
+    jobs = [
+        # DNSPoisoning Constants
+        (self.adc_cm_dnsp, Merger._merge_adc_cm_dnsp,
+         self.merged_db_dnsp, True),
+        (self.adc_ct_dnsp, Merger._merge_adc_ct_dnsp,
+         self.merged_db_dnsp, True),
+        (self.bdc_cm_dnsp, Merger._merge_bdc_cm_dnsp,
+         self.merged_db_dnsp, True),
+        # TraceRoute Constants
+        (self.adc_cm_gfwl, Merger._merge_adc_cm_gfwl,
+         self.merged_db_tr, False),
+        (self.adc_ct_gfwl, Merger._merge_adc_ct_gfwl,
+         self.merged_db_tr, False),
+        (self.adc_ct_ipb, Merger._merge_adc_ct_ipb, self.merged_db_tr,
+         False),
+        (self.bdc_cm_gfwl, Merger._merge_bdc_cm_gfwl,
+         self.merged_db_tr, False),
+        (self.bdc_ct_ipb, Merger._merge_bdc_ct_ipb, self.merged_db_tr,
+         False),
+        # 2025 Data Constants
+        (self.adc_cm_dnsp_2025, Merger._merge_adc_cm_dnsp,
+         self.merged_db_2025_dns, True),  # 新增
+        (self.adc_cm_gfwl_2025, Merger._merge_adc_cm_gfwl,
+         self.merged_db_2025_gfwl, False),  # 新增
+        # 2024 November Data Constants
+        (self.adc_cm_dnsp_nov, Merger._merge_adc_cm_dnsp_nov,
+         self.merged_db_2024_dns, True),  # 新增
+        (self.adc_cm_gfwl_nov, Merger._merge_adc_cm_gfwl_nov,
+         self.merged_db_2024_gfwl, False),  # 新增
+    ]
+    if pushdown:
+      # Only the unions per key come over the network, not every document
+      with concurrent.futures.ThreadPoolExecutor(
+          max_workers=len(jobs)) as executor:
+        staged = executor.map(
+            lambda job: stage_source(job[0], job[1], job[3]), jobs)
+        jobs = [(staging, ) + job[1:] for staging, job in zip(staged, jobs)]
+    run_dir = tempfile.mkdtemp(prefix='merge-runs-')
     try:
-      for document in tqdm(db_handler.find({}),
-                           desc=f"Merging {db_handler.collection.name}"):
-        merge_function(document, processed_domains, use_dns_server)
-    except Exception as e:
-      logger.error(f"Error in _merge_documents: {e}")
-
-  def _merge_adc_cm_dnsp(self, document, processed_domains, use_dns_server):
-    self._process_document(
-        self._format_document(
+      # Map phase: no shared state, so nothing to lock
+      # (merged collection name, shard) -> sorted run files
+      runs = defaultdict(list)
+      with concurrent.futures.ProcessPoolExecutor(
+          max_workers=MERGE_PROCESSES) as executor:
+        futures = {}
+        for source, merge_function, target_db, use_dns_server in jobs:
+          logger.info(f"Merging documents from {source.collection.name}")
+          for query in source.split_id_ranges(MERGE_PROCESSES):
+            future = executor.submit(build_partial, source, query,
+                                     merge_function, use_dns_server, run_dir)
+            futures[future] = (source, target_db)
+        for future in tqdm(concurrent.futures.as_completed(futures),
+                           total=len(futures),
+                           desc="Merging documents"):
+          source, target_db = futures[future]
+          try:
+            for shard, path in future.result():
+              runs[(target_db.collection.name, shard)].append(path)
+          except Exception as e:
+            # A missing partial would leave the merged collections silently
+            # incomplete, so nothing is written
+            logger.error(
+                f"Error in _merge_documents for {source.collection.name}: {e}"
+            )
+            for pending in futures:
+              pending.cancel()
+            raise
+
+      # Reduce phase: every shard of every merged collection is k-way merged
+      # and written by its own task
+      targets = [
+          (self.merged_db_dnsp, False, True),
+          (self.merged_db_tr, True, False),
+          (self.merged_db_2025_dns, False, True),  # 新增
+          (self.merged_db_2025_gfwl, True, False),  # 新增
+          (self.merged_db_2024_dns, False, True),  # 新增
+          (self.merged_db_2024_gfwl, True, False),  # 新增
+      ]
+      self._error_codes()  # Read once here, the workers get a copy
+      with concurrent.futures.ProcessPoolExecutor(
+          max_workers=MERGE_PROCESSES,
+          initializer=_init_reducer,
+          initargs=(self, )) as executor:
+        futures = {}
+        for target_db, is_traceroute, use_dns_server in targets:
+          for shard in range(REDUCE_SHARDS):
+            shard_runs = runs.get((target_db.collection.name, shard))
+            if shard_runs:
+              future = executor.submit(finalize_shard, shard_runs, target_db,
+                                       is_traceroute, use_dns_server, shard,
+                                       REDUCE_SHARDS)
+              futures[future] = target_db
+        finalized = defaultdict(int)
+        for future in tqdm(concurrent.futures.as_completed(futures),
+                           total=len(futures),
+                           desc="Finalizing documents"):
+          target_db = futures[future]
+          try:
+            written, error_counts = future.result()
+            finalized[target_db.collection.name] += written
+            TRACEROUTE.counts.update(error_counts)
+          except Exception as e:
+            logger.error(f"Error finalizing {target_db.collection.name}: {e}")
+            for pending in futures:
+              pending.cancel()
+            raise
+      for name, count in finalized.items():
+        logger.info(f"Finalized {count} documents into {name}")
+      logger.info(f"Traceroute error codes: {dict(TRACEROUTE.counts)}")
+    finally:
+      shutil.rmtree(run_dir, ignore_errors=True)
+      if pushdown:
+        for staging, *_ in jobs:
+          staging.drop()
+
+  @staticmethod
+  def _merge_adc_cm_dnsp(document, processed_domains, use_dns_server):
+    Merger._process_document(
+        Merger._format_document(
             domain=document.get("domain", ""),
             timestamp=document.get("timestamp", []),
             ips=document.get("ips", []),
@@ -225,9 +339,10 @@ class Merger:
             is_traceroute=False,
         ), processed_domains, use_dns_server)
 
-  def _merge_adc_cm_gfwl(self, document, processed_domains, use_dns_server):
-    self._process_document(
-        self._format_document(
+  @staticmethod
+  def _merge_adc_cm_gfwl(document, processed_domains, use_dns_server):
+    Merger._process_document(
+        Merger._format_document(
             domain=document.get("domain", ""),
             ips=document.get("ips", []),
             error=document.get("error", []),
@@ -235,9 +350,10 @@ class Merger:
             is_traceroute=True,
         ), processed_domains, use_dns_server)
 
-  def _merge_adc_ct_dnsp(self, document, processed_domains, use_dns_server):
-    self._process_document(
-        self._format_document(
+  @staticmethod
+  def _merge_adc_ct_dnsp(document, processed_domains, use_dns_server):
+    Merger._process_document(
+        Merger._format_document(
             domain=document.get("domain", ""),
             timestamp=document.get("timestamp", []),
             ips=document.get("ips", []),
@@ -245,17 +361,19 @@ class Merger:
             is_traceroute=False,
         ), processed_domains, use_dns_server)
 
-  def _merge_adc_ct_gfwl(self, document, processed_domains, use_dns_server):
-    self._process_document(
-        self._format_document(
+  @staticmethod
+  def _merge_adc_ct_gfwl(document, processed_domains, use_dns_server):
+    Merger._process_document(
+        Merger._format_document(
             domain=document.get("domain", ""),
             ips=document.get("results", []),
             is_traceroute=True,
         ), processed_domains, use_dns_server)
 
-  def _merge_adc_ct_ipb(self, document, processed_domains, use_dns_server):
-    self._process_document(
-        self._format_document(
+  @staticmethod
+  def _merge_adc_ct_ipb(document, processed_domains, use_dns_server):
+    Merger._process_document(
+        Merger._format_document(
             domain=document.get("domain", ""),
             timestamp=document.get("timestamp", []),
             ipv4=document.get("IPv4", []),
@@ -264,10 +382,10 @@ class Merger:
             is_traceroute=True,
         ), processed_domains, use_dns_server)
 
-  def _merge_adc_cm_dnsp_nov(self, document, processed_domains,
-                             use_dns_server):
-    self._process_document(
-        self._format_document(
+  @staticmethod
+  def _merge_adc_cm_dnsp_nov(document, processed_domains, use_dns_server):
+    Merger._process_document(
+        Merger._format_document(
             domain=document.get("domain", ""),
             timestamp=document.get("timestamp", []),
             dns_server=document.get("dns_server", "unknown"),
@@ -278,10 +396,10 @@ class Merger:
             is_traceroute=False,
         ), processed_domains, use_dns_server)
 
-  def _merge_adc_cm_gfwl_nov(self, document, processed_domains,
-                             use_dns_server):
-    self._process_document(
-        self._format_document(
+  @staticmethod
+  def _merge_adc_cm_gfwl_nov(document, processed_domains, use_dns_server):
+    Merger._process_document(
+        Merger._format_document(
             domain=document.get("domain", ""),
             error=document.get("Error", []),
             ipv4=document.get("IPv4", []),
@@ -293,9 +411,10 @@ class Merger:
             is_traceroute=True,
         ), processed_domains, use_dns_server)
 
-  def _merge_bdc_cm_dnsp(self, document, processed_domains, use_dns_server):
-    self._process_document(
-        self._format_document(
+  @staticmethod
+  def _merge_bdc_cm_dnsp(document, processed_domains, use_dns_server):
+    Merger._process_document(
+        Merger._format_document(
             domain=document.get("domain", ""),
             timestamp=document.get("timestamp", []),
             ips=document.get("ips", []),
@@ -303,18 +422,20 @@ class Merger:
             is_traceroute=False,
         ), processed_domains, use_dns_server)
 
-  def _merge_bdc_cm_gfwl(self, document, processed_domains, use_dns_server):
-    self._process_document(
-        self._format_document(
+  @staticmethod
+  def _merge_bdc_cm_gfwl(document, processed_domains, use_dns_server):
+    Merger._process_document(
+        Merger._format_document(
             domain=document.get("domain", ""),
             ips=document.get("result", []),
             dns_server=document.get("dns_server", "unknown"),
             is_traceroute=True,
         ), processed_domains, use_dns_server)
 
-  def _merge_bdc_ct_ipb(self, document, processed_domains, use_dns_server):
-    self._process_document(
-        self._format_document(
+  @staticmethod
+  def _merge_bdc_ct_ipb(document, processed_domains, use_dns_server):
+    Merger._process_document(
+        Merger._format_document(
             domain=document.get("domain", ""),
             timestamp=document.get("timestamp", []),
             results_ip=document.get("results_ip", []),
@@ -325,8 +446,8 @@ class Merger:
             is_traceroute=True,
         ), processed_domains, use_dns_server)
 
+  @staticmethod
   def _format_document(
-      self,
       domain,
       timestamp=None,
       ips=None,
@@ -360,7 +481,7 @@ class Merger:
       all_ips = set()
       if isinstance(ips, str):
         try:
-          cleaned_ips = ast.literal_eval(ips)
+          cleaned_ips = fast_literal_eval(ips)
           if isinstance(cleaned_ips, list):
             flat_values = [ip.strip() for ip in cleaned_ips if ip.strip()]
           else:
@@ -372,7 +493,7 @@ class Merger:
         for item in ips:
           if isinstance(item, str):
             try:
-              cleaned_item = ast.literal_eval(item)
+              cleaned_item = fast_literal_eval(item)
               if isinstance(cleaned_item, list):
                 ips = [
                     ip.strip() for ip in cleaned_item
@@ -389,16 +510,8 @@ class Merger:
         flat_values = []
       all_ips.update(flat_values)
       unique_ips = list(all_ips)
-      is_poisoned = False
-      internal_ip_patterns = [
-          r"^10\.", r"^172\.(1[6-9]|2[0-9]|3[0-1])\.", r"^192\.168\.",
-          r"^127\.", r"^0\.", r"^::1", r"^fe80", r"^fc00", r"^fd00"
-      ]
-      for ip in unique_ips:
-        for pattern in internal_ip_patterns:
-          if re.match(pattern, ip):
-            is_poisoned = True
-            break
+      # 含有内网地址的结果视为被污染
+      is_poisoned = INTERNAL.any(unique_ips)
       return {
           "domain": domain,
           "timestamp": timestamp or [],
@@ -410,16 +523,14 @@ class Merger:
           "is_poisoned": is_poisoned or False,
       }
 
-  def _process_document(self,
-                        document,
-                        processed_domains,
-                        use_dns_server=False):
+  @staticmethod
+  def _process_document(document, processed_domains, use_dns_server=False):
     try:
       domain = document["domain"]
       try:
-        dns_servers = ast.literal_eval(
+        dns_servers = fast_literal_eval(
             document.get("dns_server",
-                         "['unknown']"))  # 使用 ast.literal_eval 安全地将字符串转换为列表
+                         "['unknown']"))  # 使用 fast_literal_eval 安全地将字符串转换为列表
       except (ValueError, SyntaxError):
         dns_servers = [document.get("dns_server",
                                     "unknown")]  # 如果转换失败，则将其视为单个 DNS 服务器
@@ -427,37 +538,60 @@ class Merger:
         logger.warning(f"Document with missing domain skipped: {document}")
         return
 
-      with self.lock:
-        for dns_server in dns_servers:
-          key = (domain,
-                 dns_server) if use_dns_server else domain  # 根据Flag使用不同的唯一键
-          for field, value in document.items():
-            if field not in ["domain", "dns_server"]:
-              if isinstance(value, list):
-                flat_values = set(
-                    chain.from_iterable(v if isinstance(v, list) else [v]
-                                        for v in value))
-                flat_values = {v for v in flat_values if v}  # 移除空值
-                processed_domains[key][field].update(flat_values)
-              else:
-                if value:  # 仅添加非空值
-                  processed_domains[key][field].add(value)
+      # processed_domains is a partial map owned by one worker process
+      for dns_server in dns_servers:
+        key = (domain,
+               dns_server) if use_dns_server else domain  # 根据Flag使用不同的唯一键
+        fields = processed_domains.get(key)
+        if fields is None:
+          fields = processed_domains[key] = defaultdict(set)
+        for field, value in document.items():
+          if field not in ["domain", "dns_server"]:
+            if isinstance(value, list):
+              flat_values = set(
+                  chain.from_iterable(v if isinstance(v, list) else [v]
+                                      for v in value))
+              flat_values = {v for v in flat_values if v}  # 移除空值
+              fields[field].update(flat_values)
+            else:
+              if value:  # 仅添加非空值
+                fields[field].add(value)
     except Exception as e:
       logger.error(f"Error processing document: {document}, {e}")
 
+  def _error_codes(self) -> dict:
+    """ERROR_CODES by domain, read once and shared by every finalisation."""
+    if self._error_code_data is None:
+      self._error_code_data = {
+          doc["domain"]: doc
+          for doc in self.error_domain_dsp_adc_cm.iter_find(
+              {}, {
+                  "domain": 1,
+                  "dns_server": 1,
+                  "error_code": 1,
+                  "error_reason": 1
+              })
+      }  # 获取所有错误域名数据
+    return self._error_code_data
+
   def _finalize_documents(self,
                           processed_domains,
                           target_db,
                           is_traceroute=False,
-                          use_dns_server=False):
+                          use_dns_server=False,
+                          first_counter=0,
+                          counter_step=1) -> int:
+    """
+        Write the merged document of every (key, fields) pair that
+        `processed_domains` yields to `target_db`, in insert batches.
+        Returns the number of documents written.
+        """
     batch = []
-    counter = 0  # 自增数字
-    error_code_data = {
-        doc["domain"]: doc
-        for doc in self.error_domain_dsp_adc_cm.find({})
-    }  # 获取所有错误域名数据
+    counter = first_counter  # 自增数字
+    written = 0
+    error_code_data = self._error_codes()
 
-    for key, data in processed_domains.items():
+    for key, data in processed_domains:
       if use_dns_server:
         domain, dns_server = key
         if not dns_server or len(dns_server) <= 1:
@@ -466,7 +600,7 @@ class Merger:
         domain = key
         dns_server = None
 
-      logger.info(
+      logger.debug(
           f"Processing domain: {domain}, target_db: {target_db.collection.name}"
       )
       if target_db.collection.name not in [
@@ -500,55 +634,11 @@ class Merger:
             finalized_document['error'].append('Blocked')
             finalized_document['error_reason'].append(
                 'Internal IP Address Blocked')
-          # 检查特定错误信息
+          # 检查特定错误信息, 见 error_normalizer.py
           for error in data.get('results', []):
-            if error == 'Traceroute timed out':
-              finalized_document['error'].append('Timeout')
-            elif error == 'No Answer':
-              finalized_document['error'].append('NoAnswer')
-            elif error == 'Traceroute Failed':
-              finalized_document['error'].append('Failed')
-            elif error == 'Not Found':
-              finalized_document['error'].append('NotFound')
-            elif error == 'Network Unreachable':
-              finalized_document['error'].append('NetworkUnreachable')
-            elif error == 'Host Unreachable':
-              finalized_document['error'].append('HostUnreachable')
-            elif error == 'Protocol Unreachable':
-              finalized_document['error'].append('ProtocolUnreachable')
-            elif error == 'Port Unreachable':
-              finalized_document['error'].append('PortUnreachable')
-            elif error == 'Fragmentation Needed':
-              finalized_document['error'].append('FragmentationNeeded')
-            elif error == 'Source Route Failed':
-              finalized_document['error'].append('SourceRouteFailed')
-            elif error == 'Destination Network Unknown':
-              finalized_document['error'].append('DestinationNetworkUnknown')
-            elif error == 'Destination Host Unknown':
-              finalized_document['error'].append('DestinationHostUnknown')
-            elif error == 'Source Host Isolated':
-              finalized_document['error'].append('SourceHostIsolated')
-            elif error == 'Communication with Destination Network Administratively Prohibited':
-              finalized_document['error'].append(
-                  'CommunicationWithDestinationNetworkAdministrativelyProhibited'
-              )
-            elif error == 'Communication with Destination Host Administratively Prohibited':
-              finalized_document['error'].append(
-                  'CommunicationWithDestinationHostAdministrativelyProhibited'
-              )
-            elif error == 'Destination Network Unreachable for Type of Service':
-              finalized_document['error'].append(
-                  'DestinationNetworkUnreachableForTypeOfService')
-            elif error == 'Destination Host Unreachable for Type of Service':
-              finalized_document['error'].append(
-                  'DestinationHostUnreachableForTypeOfService')
-            elif error == 'Communication Administratively Prohibited':
-              finalized_document['error'].append(
-                  'CommunicationAdministrativelyProhibited')
-            elif error == 'Host Precedence Violation':
-              finalized_document['error'].append('HostPrecedenceViolation')
-            elif error == 'Precedence cutoff in effect':
-              finalized_document['error'].append('PrecedenceCutoffInEffect')
+            code = TRACEROUTE.classify(error)
+            if code is not None:
+              finalized_document['error'].append(code)
         else:
           finalized_document = {
               "_id":
@@ -566,7 +656,8 @@ class Merger:
           if field not in finalized_document:
             finalized_document[field] = list(value)
         batch.append(finalized_document)
-        counter += 1  # 自增数字增加
+        counter += counter_step  # 自增数字增加
+        written += 1
         if domain in error_code_data:
           error_info = error_code_data[domain]
           finalized_document["dns_server"] = error_info.get("dns_server", [])
@@ -593,13 +684,17 @@ class Merger:
           if field not in finalized_document:
             finalized_document[field] = list(value)
         batch.append(finalized_document)
-        counter += 1
+        counter += counter_step
+        written += 1
 
       if len(batch) >= BATCH_SIZE:
         self._insert_documents(batch, target_db)
         batch = []
     if batch:
       self._insert_documents(batch, target_db)
+    logger.debug(
+        f"Finalized {written} documents into {target_db.collection.name}")
+    return written
 
   def _insert_documents(self, batch, target_db):
     try:
@@ -621,6 +716,9 @@ if __name__ == "__main__":
     Merged_db_2025_GFWL.collection.drop()  # 新增
     Merged_db_2024_DNS.collection.drop()  # 新增
     Merged_db_2024_GFWL.collection.drop()  # 新增
+    for merged in (Merged_db_DNSP, Merged_db_TR, Merged_db_2025_DNS,
+                   Merged_db_2025_GFWL, Merged_db_2024_DNS, Merged_db_2024_GFWL):
+      merged.ensure_indexes()  # 见 index_specs.py
     logger.info("Merged collections cleared")
     merger = Merger(
         ADC_CM_DNSP,
@@ -643,7 +741,8 @@ if __name__ == "__main__":
         Merged_db_2024_DNS,  # 新增
         Merged_db_2024_GFWL,  # 新增
     )
-    merger.merge_documents()
+    merger.merge_documents(pushdown='--pushdown' in sys.argv)
     logger.info("DNSPoisoningMerger completed")
   except Exception as e:
     logger.error(f"Error in DNSPoisoningMerger: {e}")
+    sys.exit(1)
@@ -1,18 +1,17 @@
-import csv
 import logging
-import multiprocessing
 import os
-from concurrent.futures import ThreadPoolExecutor
+import sys
 
 from ..DBOperations import BDC_db, MongoDBHandler
+from ..ingest_engine import Dataset, ingest
 
 # Constants
 if os.name == 'nt':
   BeforeDomainChangeFolder = 'E:\\Developer\\SourceRepo\\GFW-Research\\Lib\\BeforeDomainChange'
 else:
   BeforeDomainChangeFolder = '/Users/silverhand/Developer/SourceRepo/GFW-Research/Lib/BeforeDomainChange/'
-CPU_CORES = multiprocessing.cpu_count()
-MAX_WORKERS = max(CPU_CORES * 2, 64)  # Dynamically set workers
+# One merged document per (domain, dns_server), unique index in index_specs.py
+UNIQUE_KEYS = ('domain', 'dns_server')
 
 # 移除所有现有的处理程序
 for handler in logging.root.handlers[:]:
@@ -26,177 +25,90 @@ logger = logging.getLogger(__name__)
 def toBoolean(value: str) -> bool:
   return value == 'True'
 
-class DataProcessor:
-  def __init__(self, db_handler, folder_location):
-    self.db_handler = db_handler
-    self.folder_location = folder_location
-
-  def process(self):
-    raise NotImplementedError
-
-  def merge_results(self, readingResults, unique_keys):
-    merged_results = {}
-    for result in readingResults:
-      key = tuple(result[k] for k in unique_keys)  # 使用(unique_keys)作为唯一键
-      if key not in merged_results:
-        merged_results[key] = {k: result[k] for k in unique_keys}
-        for k in result:
-          if k not in unique_keys:
-            merged_results[key][k] = []
-      for k in result:
-        if k not in unique_keys and result[k] not in merged_results[key][k]:
-          merged_results[key][k].append(result[k])
-    return list(merged_results.values())
-
-  def process_files(self, file_extension, process_method):
-    readingResults = []
-    for file in os.listdir(self.folder_location):
-      if file.endswith(file_extension):
-        readingResults.extend(process_method(file))
-    return readingResults
-
-class CSVProcessor(DataProcessor):
-  def process_csv(self, file):
-    readingResults = []
-    with open(os.path.join(self.folder_location, file), 'r', encoding='utf-8') as csv_file:
-      csv_reader = csv.reader(csv_file)
-      for row in csv_reader:
-        if row[0] == 'timestamp':
-          continue
-        readingResults.append(self.format_row(row))
-    return readingResults
-
-  def format_row(self, row):
-    raise NotImplementedError
-
-class TextProcessor(DataProcessor):
-  def process_txt(self, file):
-    readingResults = []
-    with open(os.path.join(self.folder_location, file), 'r', encoding='utf-8') as file:
-      lines = file.read().strip().split('\n')
-      for line in lines:
-        readingResults.append(self.format_line(line))
-    return readingResults
-
-  def format_line(self, line):
-    raise NotImplementedError
-
-class CM_GFWL_Processor(TextProcessor):
-  def process(self):
-    self.db_handler.drop()
-    readingResults = self.process_files('.txt', self.process_txt)
-    readingResults = self.merge_results(readingResults, ['domain', 'dns_server'])
-    self.db_handler.create_index([('domain', 1), ('dns_server', 1)], unique=True)  # 创建复合唯一索引
-    return readingResults
-
-  def format_line(self, line):
-    domain, result = line.split(':')
-    result = result.strip()
-    if result.startswith('Possible GFW detection'):
-      result = result.split('(')[1].strip(')')
-    elif result.startswith('No GFW detection'):
-      result = "No GFW detection"
+# The formatters run in parse worker processes, one record at a time
+def split_ips(ips: str):
+  ipv4 = []
+  ipv6 = []
+  for ip in ips.split(','):
+    ip = ip.strip()
+    if ':' in ip:
+      ipv6.append(ip)
     else:
-      result = "Traceroute Failed"
-    return {"domain": domain, "dns_server": "unknown", "result": result}
-
-class CM_IPB_Processor(CSVProcessor, TextProcessor):
-  def process(self):
-    self.db_handler.drop()
-    readingResults = self.process_files('.csv', self.process_csv)
-    readingResults.extend(self.process_files('.txt', self.process_txt))
-    readingResults = self.merge_results(readingResults, ['domain', 'dns_server'])
-    self.db_handler.create_index([('domain', 1), ('dns_server', 1)], unique=True)  # 创建复合唯一索引
-    return readingResults
-
-  def format_row(self, row):
-    ipv4 = []
-    ipv6 = []
-    for ip in row[3].split(','):
-      ip = ip.strip()
-      if ':' in ip:
-        ipv6.append(ip)
-      else:
-        ipv4.append(ip)
-    return {
-      "timestamp": row[0],
-      "domain": row[1],
-      "dns_server": row[2],
-      "IPv4": ipv4,
-      "IPv6": ipv6,
-      "is_accessible": row[6]
-    }
-
-  def format_line(self, line):
-    domain, result = line.split(':')
-    result = result.strip()
+      ipv4.append(ip)
+  return ipv4, ipv6
+
+def format_gfwl_line(record: dict, path: str) -> list:
+  result = record['result']
+  if result.startswith('Possible GFW detection'):
+    result = result.split('(')[1].strip(')')
+  elif result.startswith('No GFW detection'):
+    result = "No GFW detection"
+  else:
+    result = "Traceroute Failed"
+  return [{"domain": record['domain'], "dns_server": "unknown", "result": result}]
+
+def format_ipb_record(record: dict, path: str) -> list:
+  if 'ip' not in record:
+    # problem_domains.txt next to the CSVs
+    result = record['result']
     if result.startswith('No GFW detected'):
       result = result.split('(')[1].strip(')')
     else:
       result = "Not Found"
-    return {"domain": domain, "dns_server": "unknown", "result": result}
-
-class CT_IPB_Processor(CSVProcessor):
-  def process(self):
-    self.db_handler.drop()
-    readingResults = self.process_files('.csv', self.process_csv)
-    readingResults = self.merge_results(readingResults, ['domain', 'dns_server'])
-    for result in readingResults:
-      if 'is_accessible' in result:
-        if 'True' in result['is_accessible'] and 'False' in result['is_accessible']:
-          result['is_accessible'] = 'sometimes'
-        elif 'True' in result['is_accessible']:
-          result['is_accessible'] = 'True'
-        else:
-          result['is_accessible'] = 'False'
-    self.db_handler.create_index([('domain', 1), ('dns_server', 1)], unique=True)  # 创建复合唯一索引
-    return readingResults
-
-  def format_row(self, row):
-    ipv4 = []
-    ipv6 = []
-    for ip in row[3].split(','):
-      ip = ip.strip()
-      if ':' in ip:
-        ipv6.append(ip)
-      else:
-        ipv4.append(ip)
-    return {
-      "timestamp": row[0],
-      "domain": row[1],
-      "IPv4": ipv4,
-      "IPv6": ipv6,
-      "is_accessible": row[6]
-    }
+    return [{"domain": record['domain'], "dns_server": "unknown", "result": result}]
+  ipv4, ipv6 = split_ips(record['ip'])
+  return [{
+    "timestamp": record['timestamp'],
+    "domain": record['domain'],
+    "dns_server": "unknown",
+    "IPv4": ipv4,
+    "IPv6": ipv6,
+    "is_accessible": record['is_accessible']
+  }]
+
+def format_ct_ipb_row(record: dict, path: str) -> list:
+  ipv4, ipv6 = split_ips(record['ip'])
+  return [{
+    "timestamp": record['timestamp'],
+    "domain": record['domain'],
+    "IPv4": ipv4,
+    "IPv6": ipv6,
+    "is_accessible": record['is_accessible']
+  }]
+
+def accessibility(document: dict) -> str:
+  """'True', 'False' or 'sometimes' for a merged China-Telecom IPBlocking document.
+
+  The stored `is_accessible` is the list of every value seen, extended with
+  $addToSet by incremental imports, so the summary is derived when reading.
+  """
+  values = document.get('is_accessible', [])
+  if 'True' in values and 'False' in values:
+    return 'sometimes'
+  return 'True' if 'True' in values else 'False'
+
+def GFWL_Dataset(db_handler, folder_location):
+  return Dataset(db_handler, folder_location, format_gfwl_line, extensions=('.txt',),
+                 layouts=('traceroute-text',), key=UNIQUE_KEYS)
+
+def IPB_Dataset(db_handler, folder_location):
+  return Dataset(db_handler, folder_location, format_ipb_record, extensions=('.csv', '.txt'),
+                 layouts=('ip-blocking', 'traceroute-text'), key=UNIQUE_KEYS)
+
+def CT_IPB_Dataset(db_handler, folder_location):
+  return Dataset(db_handler, folder_location, format_ct_ipb_row, layouts=('ip-blocking',),
+                 key=UNIQUE_KEYS)
 
-class UCD_GFWL_Processor(CM_GFWL_Processor):
-  pass
-
-class UCD_IPB_Processor(CM_IPB_Processor):
-  pass
-
-class insert_into_db:
-  def __init__(self, db_handler, data):
-    self.db_handler = db_handler
-    self.data = data
-
-  def insert(self):
-    self.db_handler.insert_many(self.data)
-
-# Example usage
 if __name__ == "__main__":
-  logger.info("Databases cleaned up")
-  processors = [
-    CM_GFWL_Processor(MongoDBHandler(BDC_db['China-Mobile-GFWLocation']), os.path.join(BeforeDomainChangeFolder, 'GFWLocation/')),
-    CM_IPB_Processor(MongoDBHandler(BDC_db['China-Mobile-IPBlocking']), os.path.join(BeforeDomainChangeFolder, 'IPBlocking/')),
-    CT_IPB_Processor(MongoDBHandler(BDC_db['China-Telecom-IPBlocking']), os.path.join(BeforeDomainChangeFolder, 'Mac', 'IPBlocking')),
-    UCD_GFWL_Processor(MongoDBHandler(BDC_db['UCDavis-CompareGroup-GFWLocation']), os.path.join(BeforeDomainChangeFolder, 'CompareGroup', 'GFWLocation/')),
-    UCD_IPB_Processor(MongoDBHandler(BDC_db['UCDavis-CompareGroup-IPBlocking']), os.path.join(BeforeDomainChangeFolder, 'CompareGroup', 'IPBlocking/'))
+  full = '--full' in sys.argv
+  datasets = [
+    GFWL_Dataset(MongoDBHandler(BDC_db['China-Mobile-GFWLocation']), os.path.join(BeforeDomainChangeFolder, 'GFWLocation/')),
+    IPB_Dataset(MongoDBHandler(BDC_db['China-Mobile-IPBlocking']), os.path.join(BeforeDomainChangeFolder, 'IPBlocking/')),
+    CT_IPB_Dataset(MongoDBHandler(BDC_db['China-Telecom-IPBlocking']), os.path.join(BeforeDomainChangeFolder, 'Mac', 'IPBlocking')),
+    GFWL_Dataset(MongoDBHandler(BDC_db['UCDavis-CompareGroup-GFWLocation']), os.path.join(BeforeDomainChangeFolder, 'CompareGroup', 'GFWLocation/')),
+    IPB_Dataset(MongoDBHandler(BDC_db['UCDavis-CompareGroup-IPBlocking']), os.path.join(BeforeDomainChangeFolder, 'CompareGroup', 'IPBlocking/'))
   ]
-  def process_processor(processor):
-    results = processor.process()
-    insert_into_db(processor.db_handler, results).insert()
-    logger.info(f"Processed {len(results)} records for {processor.__class__.__name__}")
-
-  with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-    executor.map(process_processor, processors)
+  # Each import already parses on every core, run them one after another
+  for dataset in datasets:
+    stats = ingest(dataset, full)
+    logger.info(f"Processed {stats['operations']} records for {dataset.name}")
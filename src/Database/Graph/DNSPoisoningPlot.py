@@ -3,18 +3,26 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from ..DBOperations import Merged_db, MongoDBHandler, ADC_db
+from ...scripts.error_normalizer import ErrorNormalizer
+from ...scripts.ip_classify import PRIVATE
+from ...scripts.result_store import list_result_files, read_results
 from collections import defaultdict, Counter
 import csv
 import os
-from ipaddress import ip_network, ip_address
 import re
 import numpy as np
 import matplotlib.pyplot as plt
 
 
+# Exact labels only: the stored codes are already normalised, and the labels
+# must stay those of plots made from older imports. Counts every label drawn.
+ERROR_LABELS = ErrorNormalizer([("FORMERROR", ["former"]),
+                                ("REFUSED", ["refuse"])],
+                               exact=True)
+
+
 def sanitize_error_code(code):
-  mapping = {"former": "FORMERROR", "refuse": "REFUSED"}
-  new_code = mapping.get(code, code)
+  new_code = ERROR_LABELS.normalize(code, default=code)
   return new_code if new_code.strip() not in ["", "[]", " "] else None
 
 
@@ -102,21 +110,7 @@ def parse_ips(ips_string):
 
 
 def is_private_ip(ip):
-  private_blocks = [
-      ip_network("10.0.0.0/8"),
-      ip_network("172.16.0.0/12"),
-      ip_network("192.168.0.0/16"),
-      ip_network("127.0.0.0/8"),
-      ip_network("169.254.0.0/16"),
-      ip_network("::1/128"),
-      ip_network("fc00::/7"),
-      ip_network("fe80::/10"),
-  ]
-  try:
-    ip_addr = ip_address(ip)
-    return any(ip_addr in block for block in private_blocks)
-  except ValueError:
-    return False
+  return ip in PRIVATE
 
 
 def get_server_location(server):
@@ -320,7 +314,7 @@ def DNSPoisoning_ErrorCode_Distribute(destination_db, output_folder):
   for server in dns_servers:
     provider = ip_to_provider.get(server, 'Unknown Provider')
     error_code_count = Counter()
-    docs = destination_db.find({'dns_server': server})
+    docs = destination_db.iter_find({'dns_server': server})
     domain_record_errors = defaultdict(lambda: defaultdict(set))
     for doc in docs:
       domain = doc.get("domain")
@@ -381,7 +375,7 @@ def DNSPoisoning_ErrorCode_Distribute_ProviderRegion(destination_db,
   print('Plotting error code distribution by provider region...')
   region_to_error_code_count = defaultdict(Counter)
   for server, region in ip_to_region.items():
-    docs = destination_db.find({'dns_server': server})
+    docs = destination_db.iter_find({'dns_server': server})
     domain_record_errors = defaultdict(lambda: defaultdict(set))
     for doc in docs:
       domain = doc.get("domain")
@@ -447,7 +441,7 @@ def DNSPoisoning_ErrorCode_Distribute_ProviderRegion_Aggregate(
   region_to_error_code_count = defaultdict(Counter)
 
   for server, region in ip_to_region.items():
-    docs = destination_db.find({'dns_server': server})
+    docs = destination_db.iter_find({'dns_server': server})
     domain_record_errors = defaultdict(lambda: defaultdict(set))
 
     for doc in docs:
@@ -517,7 +511,7 @@ def distribution_error_code(destination_db, output_folder):
   all_error_codes = set()
   domain_record_errors = defaultdict(lambda: defaultdict(set))
   for server in ip_to_provider.keys():
-    docs = destination_db.find({'dns_server': server})
+    docs = destination_db.iter_find({'dns_server': server})
     for doc in docs:
       domain = doc.get("domain")
       record_type = doc.get("record_type")
@@ -571,6 +565,37 @@ def distribution_error_code(destination_db, output_folder):
   )
 
 
+def DNSPoisoning_ErrorCode_Distribute_Sweeps(sweep_folder, output_folder):
+  """Error code distribution per DNS server read straight from sweep files.
+
+  Counts distinct domains per (server, record type, error code) with one
+  vectorised group-by over the CSV/Parquet sweeps, no MongoDB import needed.
+  """
+  print(f'Plotting error code distribution from sweeps in {sweep_folder}...')
+  table = read_results(list_result_files(sweep_folder),
+                       columns=['domain', 'dns_server', 'record_type',
+                                'error_code'])
+  grouped = table.group_by(['dns_server', 'record_type', 'error_code'
+                           ]).aggregate([('domain', 'count_distinct')])
+  server_error_counts = defaultdict(Counter)
+  for row in grouped.to_pylist():
+    code = sanitize_error_code(row['error_code'] or '')
+    if code:
+      server_error_counts[row['dns_server']][code] += row[
+          'domain_count_distinct']
+  for server, error_code_count in server_error_counts.items():
+    provider = ip_to_provider.get(server, 'Unknown Provider')
+    sanitized_server = server.replace(':', '_').replace('/', '_')
+    output_file = f'{output_folder}/DNSPoisoning_ErrorCode_Distribute_{sanitized_server}_{provider}.png'
+    plot_error_code_distribution_helper(
+        error_code_count,
+        f'Error Code Distribution for DNS Server {server} ({provider})',
+        output_file)
+  print(
+      f'\033[92mError code distribution from sweeps completed for {sweep_folder}.\033[0m\n'
+  )
+
+
 def ensure_folder_exists(folder_path):
   if not os.path.exists(folder_path):
     os.makedirs(folder_path)
@@ -617,6 +642,12 @@ if __name__ == "__main__":
   distribution_error_code(merged_2024_Nov_DNS, f"{output_folder}/2024-11")
   distribution_error_code(adc_2025_Jan_DNS, f"{output_folder}/2025-1")
 
+  sweep_folder = "/home/lhengyi/Developer/GFW-Research/Lib/Data-2025-1/China-Mobile/DNSPoisoning"
+  if os.path.isdir(sweep_folder):
+    ensure_folder_exists(f"{output_folder}/2025-1/SWEEP_DIST")
+    DNSPoisoning_ErrorCode_Distribute_Sweeps(
+        sweep_folder, f"{output_folder}/2025-1/SWEEP_DIST")
+
   print("All tasks completed. Working on get timely trend...")
   # get_timely_trend()
   print("All tasks completed.")
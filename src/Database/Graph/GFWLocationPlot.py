@@ -9,6 +9,7 @@ from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
 import matplotlib.lines as mlines
 from ..DBOperations import Merged_db, MongoDBHandler, ADC_db
+from ...scripts.geoip_lookup import lookup_ips
 
 matplotlib.use('Agg')  # 使用非交互式后端
 
@@ -51,7 +52,7 @@ def ip_hops_core_path(destination_db,
     query = {"ips": {"$exists": True, "$ne": []}}
   if domain:
     query["domain"] = domain
-  cursor = destination_db.find(query, {"ips": 1, "IPv4": 1, "IPv6": 1})
+  cursor = destination_db.iter_find(query, {"ips": 1, "IPv4": 1, "IPv6": 1})
 
   for doc in cursor:
     if destination_db == adc_db_2024_Nov_GFWL or destination_db == adc_db_2025_GFWL or use_ipv4_only:
@@ -218,7 +219,7 @@ def ip_hops_core_path(destination_db,
 def plot_dst_distribution(destination_db, output_folder, use_ipv4_only=False):
   if use_ipv4_only:
     query = {"IPv4": {"$exists": True}}
-    cursor = destination_db.find(query, {"IPv4": 1})
+    cursor = destination_db.iter_find(query, {"IPv4": 1})
   else:
     query = {
         "$or": [{
@@ -235,7 +236,7 @@ def plot_dst_distribution(destination_db, output_folder, use_ipv4_only=False):
             }
         }]
     }
-    cursor = destination_db.find(query, {"ips": 1, "IPv4": 1, "IPv6": 1})
+    cursor = destination_db.iter_find(query, {"ips": 1, "IPv4": 1, "IPv6": 1})
 
   reached_dst = 0
   unreached_dst = 0
@@ -301,7 +302,7 @@ def plot_rst_detect(destination_db, output_folder):
           }
       }]
   }
-  cursor = destination_db.find(query, {"rst_detected": 1, "RST Detected": 1})
+  cursor = destination_db.iter_find(query, {"rst_detected": 1, "RST Detected": 1})
   rst_detected = 0
   not_detected = 0
   occured = 0
@@ -343,6 +344,64 @@ def plot_rst_detect(destination_db, output_folder):
   plt.close()
 
 
+def plot_hop_country_distribution(destination_db,
+                                  output_folder,
+                                  use_ipv4_only=False,
+                                  top_n=15):
+  if use_ipv4_only:
+    cursor = destination_db.iter_find({"IPv4": {"$exists": True}}, {"IPv4": 1})
+  else:
+    cursor = destination_db.iter_find(
+        {"$or": [{
+            "ips": {
+                "$exists": True
+            }
+        }, {
+            "IPv4": {
+                "$exists": True
+            }
+        }]}, {
+            "ips": 1,
+            "IPv4": 1,
+            "IPv6": 1
+        })
+
+  hop_frequency = Counter()
+  for doc in cursor:
+    if use_ipv4_only:
+      ips_strings = doc.get('IPv4', [])
+    else:
+      ips_strings = doc.get('ips', []) or doc.get('IPv4', []) + doc.get(
+          'IPv6', [])
+    for ips_str in ips_strings:
+      separator = ',' if use_ipv4_only else ';'
+      hop_frequency.update(ip.strip() for ip in ips_str.split(separator)
+                           if ip.strip())
+
+  # Every distinct hop is geolocated once, however often it shows up
+  locations = lookup_ips(hop_frequency)
+  country_counts = Counter()
+  for ip, count in hop_frequency.items():
+    location = locations.get(ip)
+    country_counts[location[0] if location and location[0] else 'Unknown'] += count
+
+  if not country_counts:
+    logger.warning("No data to plot for hop country distribution.")
+    return
+  top_countries = country_counts.most_common(top_n)
+  plt.figure(figsize=(12, 6))
+  plt.bar([country for country, _ in top_countries],
+          [count for _, count in top_countries],
+          color='skyblue')
+  plt.xticks(rotation=25)
+  plt.xlabel('Country')
+  plt.ylabel('Number of hops')
+  plt.title(f"Traceroute hops by country (Total: {sum(country_counts.values())})")
+  plt.savefig(f'{output_folder}/Hop_Country_Distribution.png',
+              bbox_inches='tight')
+  plt.close()
+
+
 if __name__ == '__main__':
   if os.name == 'posix':
     output_folder = '/home/lhengyi/Developer/GFW-Research/Pic'
@@ -373,4 +432,12 @@ if __name__ == '__main__':
 
   plot_rst_detect(adc_db_2024_Nov_GFWL, f'{output_folder}/2024-11')
   plot_rst_detect(adc_db_2025_GFWL, f'{output_folder}/2025-1')
+
+  plot_hop_country_distribution(GFWLocation, f'{output_folder}/2024-9')
+  plot_hop_country_distribution(adc_db_2024_Nov_GFWL,
+                                f'{output_folder}/2024-11',
+                                use_ipv4_only=True)
+  plot_hop_country_distribution(adc_db_2025_GFWL,
+                                f'{output_folder}/2025-1',
+                                use_ipv4_only=True)
   logger.info("All done.")
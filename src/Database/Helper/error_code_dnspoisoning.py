@@ -59,6 +59,7 @@ def process_file(filename, error_file_dir):
 def merge_and_insert_error_codes():
     # Drop the db first before inserting
     error_codes.drop()
+    MongoDBHandler(error_codes).ensure_indexes()  # 见 index_specs.py
     if os.name == 'nt':
         error_file_dir = 'E:\\Developer\\SourceRepo\\GFW-Research\\Lib\\AfterDomainChange\\China-Mobile\\Error'
     else:
@@ -82,18 +83,16 @@ def merge_and_insert_error_codes():
                 merged_data[domain]["error_reason"].update(data["error_reason"])
                 merged_data[domain]["record_type"].update(data["record_type"])
 
-    for domain, data in merged_data.items():
-        error_codes.insert_one({
-            "domain": domain,
-            "timestamp": list(data["timestamp"]),
-            "dns_server": list(data["dns_server"]),
-            "error_code": list(data["error_code"]),
-            "error_reason": list(data["error_reason"]),
-            "record_type": list(data["record_type"])
-        })
-
-    # Create an index on the domain field
-    error_codes.create_index("domain")
+    with MongoDBHandler(error_codes).bulk_writer() as writer:
+        for domain, data in merged_data.items():
+            writer.insert_one({
+                "domain": domain,
+                "timestamp": list(data["timestamp"]),
+                "dns_server": list(data["dns_server"]),
+                "error_code": list(data["error_code"]),
+                "error_reason": list(data["error_reason"]),
+                "record_type": list(data["record_type"])
+            })
 
 if __name__ == '__main__':
     merge_and_insert_error_codes()
@@ -0,0 +1,203 @@
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import threading
+
+from pymongo import MongoClient, ReadPreference
+
+logger = logging.getLogger(__name__)
+
+# Settings are read from, in increasing priority: the defaults below, the
+# JSON file named by GFW_MONGO_CONFIG (or mongo_config.json next to this
+# file), the GFW_MONGO_* environment variables, and `configure()`.
+CONFIG_ENV = 'GFW_MONGO_CONFIG'
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(__file__),
+                                   'mongo_config.json')
+# Credentials never live in source: the shared server's URI (with user and
+# password) comes from GFW_MONGO_URI or the config file's "uri" key.
+DEFAULT_URI = 'mongodb://localhost:27017/'
+# The importers run max(CPU_CORES * 2, 64) threads, one connection each is
+# enough; more only adds server side load.
+DEFAULT_POOL_SIZE = max(multiprocessing.cpu_count() * 2, 64)
+DEFAULT_SETTINGS = {
+    # 'pymongo' for a real server (remote or local mongod), 'mongomock' for
+    # an in-process stand-in that needs no server at all.
+    'backend': 'pymongo',
+    'uri': DEFAULT_URI,
+    'max_pool_size': DEFAULT_POOL_SIZE,
+    'compressors': ['zstd', 'snappy', 'zlib'],
+    'read_preference': 'primaryPreferred',
+    'write_concern': 1,
+    'journal': None,
+    'connect_timeout_ms': 20000,
+}
+ENV_SETTINGS = {
+    'GFW_MONGO_BACKEND': ('backend', str),
+    'GFW_MONGO_URI': ('uri', str),
+    'GFW_MONGO_POOL_SIZE': ('max_pool_size', int),
+    'GFW_MONGO_COMPRESSORS': ('compressors', lambda v: v.split(',')),
+    'GFW_MONGO_READ_PREFERENCE': ('read_preference', str),
+    'GFW_MONGO_WRITE_CONCERN': ('write_concern',
+                                lambda v: int(v) if v.isdigit() else v),
+}
+# Python packages pymongo needs for each wire compressor
+COMPRESSOR_MODULES = {'zstd': 'zstandard', 'snappy': 'snappy', 'zlib': 'zlib'}
+
+_overrides = {}
+_client = None
+_client_lock = threading.Lock()
+
+
+def load_settings() -> dict:
+  settings = dict(DEFAULT_SETTINGS)
+  path = os.environ.get(CONFIG_ENV, DEFAULT_CONFIG_PATH)
+  if os.path.exists(path):
+    with open(path, 'r', encoding='utf-8') as config_file:
+      settings.update(json.load(config_file))
+  for variable, (key, convert) in ENV_SETTINGS.items():
+    if os.environ.get(variable):
+      settings[key] = convert(os.environ[variable])
+  settings.update(_overrides)
+  return settings
+
+
+def configure(**settings) -> None:
+  """
+    Override connection settings before the first query, e.g.
+    `configure(max_pool_size=MAX_WORKERS)` in a script with its own thread
+    count, or `configure(backend='mongomock')` for an offline run.
+    """
+  global _client
+  with _client_lock:
+    _overrides.update(settings)
+    if _client is not None:
+      _client.close()
+      _client = None
+
+
+def available_compressors(names: list) -> list:
+  """Drop the wire compressors whose Python package is not installed."""
+  return [
+      name for name in names if name in COMPRESSOR_MODULES
+      and importlib.util.find_spec(COMPRESSOR_MODULES[name]) is not None
+  ]
+
+
+def create_client(settings: dict):
+  if settings['backend'] == 'mongomock':
+    try:
+      import mongomock
+    except ImportError as e:
+      raise ImportError(
+          "backend 'mongomock' needs the mongomock package "
+          "(pip install mongomock, it is in requirements.txt)") from e
+    return mongomock.MongoClient()
+  options = {
+      'maxPoolSize': settings['max_pool_size'],
+      'connectTimeoutMS': settings['connect_timeout_ms'],
+      'read_preference': getattr(ReadPreference,
+                                 _constant_name(settings['read_preference'])),
+      'w': settings['write_concern'],
+  }
+  if settings['journal'] is not None:
+    options['journal'] = settings['journal']
+  compressors = available_compressors(settings['compressors'])
+  if compressors:
+    options['compressors'] = ','.join(compressors)
+  return MongoClient(settings['uri'], **options)
+
+
+def _constant_name(mode: str) -> str:
+  # 'primaryPreferred' -> 'PRIMARY_PREFERRED'
+  return ''.join('_' + c if c.isupper() else c for c in mode).upper()
+
+
+def get_client():
+  """The process-wide client, created on first use."""
+  global _client
+  if _client is None:
+    with _client_lock:
+      if _client is None:
+        settings = load_settings()
+        _client = create_client(settings)
+        logger.info(f"Using {settings['backend']} MongoDB client "
+                    f"(pool size {settings['max_pool_size']})")
+  return _client
+
+
+def _forget_client_after_fork() -> None:
+  # A MongoClient must not be used across fork(): worker processes (the
+  # Merger's, on Linux) open their own on first use. A mongomock client is
+  # kept, its data only exists in the memory the child inherited.
+  global _client, _client_lock
+  _client_lock = threading.Lock()
+  if isinstance(_client, MongoClient):
+    _client = None
+
+
+os.register_at_fork(after_in_child=_forget_client_after_fork)
+
+
+def close_client() -> None:
+  global _client
+  with _client_lock:
+    if _client is not None:
+      _client.close()
+      _client = None
+
+
+class LazyClient:
+  """Stand-in for the old module level MongoClient: `client.SomeDatabase`."""
+
+  def __getattr__(self, name: str) -> 'LazyDatabase':
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return LazyDatabase(name)
+
+  def __getitem__(self, name: str) -> 'LazyDatabase':
+    return LazyDatabase(name)
+
+
+class LazyDatabase:
+  """Database handle that only connects when it is first used."""
+
+  def __init__(self, name: str):
+    self.name = name
+
+  def resolve(self):
+    return get_client()[self.name]
+
+  def __getitem__(self, name: str) -> 'LazyCollection':
+    return LazyCollection(self, name)
+
+  def __getattr__(self, name: str):
+    if name.startswith('__'):
+      raise AttributeError(name)  # Don't connect for copy/pickle probes
+    return getattr(self.resolve(), name)
+
+
+class LazyCollection:
+  """Collection handle that only connects when it is first used.
+
+  Module level MongoDBHandler constants can be built from it without any
+  network traffic; every attribute other than `name` is looked up on the
+  real collection.
+  """
+
+  def __init__(self, database: LazyDatabase, name: str):
+    self.database = database
+    self.name = name
+
+  def resolve(self):
+    return self.database.resolve()[self.name]
+
+  def __getattr__(self, name: str):
+    if name.startswith('__'):
+      raise AttributeError(name)  # Don't connect for copy/pickle probes
+    return getattr(self.resolve(), name)
+
+  def __repr__(self) -> str:
+    return f'LazyCollection({self.database.name!r}, {self.name!r})'
+
@@ -0,0 +1,220 @@
+import argparse
+import logging
+import sys
+
+from .DBOperations import ADC_db, Merged_db, MongoDBHandler, client
+from .index_specs import INDEX_SPECS
+
+logger = logging.getLogger(__name__)
+
+# A plan is slow if the server spent longer than this on it
+SLOW_QUERY_MS = 100
+# or examined this many documents per document returned
+MAX_EXAMINED_RATIO = 10
+
+
+class _Sample:
+
+  def __repr__(self) -> str:
+    return '<sample>'
+
+
+# Replaced by a value of the field taken from the collection itself
+SAMPLE = _Sample()
+
+
+class AuditQuery:
+  """A query one of the scripts issues, as (collection, filter)."""
+
+  def __init__(self, source: str, database, collection: str, query: dict,
+               projection: dict = None):
+    self.source = source
+    self.collection = database[collection]
+    self.query = query
+    self.projection = projection
+
+  def __repr__(self) -> str:
+    return (f'{self.source}: {self.collection.database.name}.'
+            f'{self.collection.name} {self.query}')
+
+
+def _queries(source: str, database, collections: list, query: dict,
+             projection: dict = None) -> list:
+  return [
+      AuditQuery(source, database, collection, query, projection)
+      for collection in collections
+  ]
+
+
+AUDIT_QUERIES = (
+    # Graph/DNSPoisoningPlot.py, once per resolver
+    _queries('DNSPoisoningPlot', ADC_db, [
+        'ERROR_CODES', 'ChinaMobile-DNSPoisoning-2025-January',
+        'China-Mobile-DNSPoisoning', 'China-Telecom-DNSPoisoning',
+        'ChinaMobile-DNSPoisoning-November'
+    ], {'dns_server': SAMPLE}) +
+    _queries('DNSPoisoningPlot', Merged_db, ['2024_Nov_DNS'],
+             {'dns_server': SAMPLE}) +
+    # scripts/CleanUp.py
+    _queries('CleanUp.check_domain', Merged_db,
+             ['CompareGroup', 'DNSPoisoning'], {'domain': SAMPLE},
+             {'ips': 1}) +
+    _queries('CleanUp.cleanNoAnswer', Merged_db,
+             ['DNSPoisoning', '2024_Nov_DNS', '2025_DNS'],
+             {'error_code': 'NoAnswer'}, {'domain': 1}) +
+    _queries('CleanUp.cleanNoAnswer', ADC_db,
+             ['ChinaMobile-DNSPoisoning-2025-January'],
+             {'error_code': 'NoAnswer'}, {'domain': 1}) +
+    _queries('CleanUp.cleanNoAnswer', Merged_db,
+             ['DNSPoisoning', '2024_Nov_DNS', '2025_DNS'], {
+                 'domain': SAMPLE,
+                 'record_type': 'A',
+                 'error_code': 'NoAnswer'
+             }) +
+    _queries('CleanUp.cleanNoAnswer', ADC_db,
+             ['ChinaMobile-DNSPoisoning-2025-January'], {
+                 'domain': SAMPLE,
+                 'record_type': 'A',
+                 'error_code': 'NoAnswer'
+             }) +
+    _queries('CleanUp.delete_domain', Merged_db,
+             ['TraceRouteResult', '2024_Nov_GFWL'], {'domain': SAMPLE}) +
+    _queries('CleanUp.delete_domain', ADC_db,
+             ['ChinaMobile-GFWLocation-2025-January'], {'domain': SAMPLE}) +
+    # Graph/GFWLocationPlot.py, ip_hops_core_path(domain=...)
+    _queries('GFWLocationPlot', Merged_db, ['TraceRouteResult'], {
+        'ips': {
+            '$exists': True,
+            '$ne': []
+        },
+        'domain': SAMPLE
+    }))
+
+
+def sample_query(collection, query: dict) -> dict:
+  """`query` with every SAMPLE replaced by a value stored in `collection`.
+
+  None if the collection has no document with all the sampled fields.
+  """
+  fields = [field for field, value in query.items() if value is SAMPLE]
+  if not fields:
+    return query
+  document = collection.find_one({field: {'$exists': True} for field in fields},
+                                 {field: 1 for field in fields})
+  if document is None:
+    return None
+  query = dict(query)
+  for field in fields:
+    value = document[field]
+    if isinstance(value, list):  # Multikey: match one element
+      if not value:
+        return None
+      value = value[0]
+    query[field] = value
+  return query
+
+
+def plan_stages(plan: dict) -> list:
+  """Stages of a winning plan, outermost first."""
+  plan = plan.get('queryPlan', plan)  # Slot based engine (MongoDB 7+)
+  stages = [plan]
+  for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+    if child:
+      stages.extend(plan_stages(child))
+  return stages
+
+
+def explain(entry: AuditQuery, query: dict) -> dict:
+  collection = entry.collection
+  command = {'find': collection.name, 'filter': query}
+  if entry.projection:
+    command['projection'] = entry.projection
+  return collection.database.command('explain',
+                                     command,
+                                     verbosity='executionStats')
+
+
+def audit_query(entry: AuditQuery,
+                slow_ms: int = SLOW_QUERY_MS,
+                max_ratio: int = MAX_EXAMINED_RATIO) -> dict:
+  """Winning plan of one query and what is wrong with it, if anything."""
+  query = sample_query(entry.collection, entry.query)
+  if query is None:
+    return {'query': entry, 'skipped': 'no document to sample from'}
+  result = explain(entry, query)
+  stages = plan_stages(result['queryPlanner']['winningPlan'])
+  stats = result.get('executionStats', {})
+  examined = stats.get('totalDocsExamined', 0)
+  returned = stats.get('nReturned', 0)
+  millis = stats.get('executionTimeMillis', 0)
+  problems = []
+  if any(stage.get('stage') == 'COLLSCAN' for stage in stages):
+    problems.append('COLLSCAN')
+  if millis >= slow_ms:
+    problems.append(f'slow ({millis} ms)')
+  if examined > max_ratio * max(returned, 1):
+    problems.append(f'examined {examined} for {returned} returned')
+  return {
+      'query': entry,
+      'plan': ' <- '.join(stage.get('stage', '?') for stage in stages),
+      'indexes': [
+          stage['indexName'] for stage in stages if 'indexName' in stage
+      ],
+      'millis': millis,
+      'examined': examined,
+      'returned': returned,
+      'problems': problems,
+  }
+
+
+def apply_index_specs() -> None:
+  """Create every index in index_specs.py, for collections imported earlier."""
+  for (database, collection), _ in INDEX_SPECS.items():
+    names = MongoDBHandler(client[database][collection]).ensure_indexes()
+    logger.info(f'{database}.{collection}: {", ".join(names)}')
+
+
+def audit(queries=AUDIT_QUERIES,
+          slow_ms: int = SLOW_QUERY_MS,
+          max_ratio: int = MAX_EXAMINED_RATIO) -> list:
+  """Explain every query in `queries`, printing one line per query."""
+  results = []
+  for query in queries:
+    try:
+      result = audit_query(query, slow_ms, max_ratio)
+    except Exception as e:
+      logger.error(f'Error explaining {query}: {e}')
+      continue
+    results.append(result)
+    if 'skipped' in result:
+      print(f'SKIP {query} ({result["skipped"]})')
+      continue
+    status = 'FLAG' if result['problems'] else 'OK  '
+    print(f'{status} {query}\n'
+          f'     {result["plan"]} [{", ".join(result["indexes"]) or "-"}] '
+          f'{result["returned"]}/{result["examined"]} returned/examined, '
+          f'{result["millis"]} ms'
+          f'{"; " + "; ".join(result["problems"]) if result["problems"] else ""}')
+  return results
+
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+  parser = argparse.ArgumentParser(
+      description='Flag collection scans and slow plans of the queries the '
+      'merge, cleanup and plotting scripts issue')
+  parser.add_argument('--apply',
+                      action='store_true',
+                      help='create the indexes in index_specs.py first')
+  parser.add_argument('--slow-ms', type=int, default=SLOW_QUERY_MS)
+  parser.add_argument('--max-ratio', type=int, default=MAX_EXAMINED_RATIO)
+  args = parser.parse_args()
+  if args.apply:
+    apply_index_specs()
+  flagged = [
+      result for result in audit(slow_ms=args.slow_ms,
+                                 max_ratio=args.max_ratio)
+      if result.get('problems')
+  ]
+  print(f'{len(flagged)} of {len(AUDIT_QUERIES)} queries flagged')
+  sys.exit(1 if flagged else 0)
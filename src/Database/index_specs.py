@@ -0,0 +1,86 @@
+# Indexes each collection should have, by (database, collection). Every
+# index is (keys, options) as passed to `create_index`. They are created by
+# `MongoDBHandler.ensure_indexes()`, which the importers and the Merger call
+# right after (re)creating a collection, and checked by index_audit.py.
+#
+# Merged documents hold record_type, error_code and dns_server as lists, and
+# MongoDB cannot build a compound index over two array fields of the same
+# document, so merged collections only get single field indexes.
+
+# DNS rows imported from the sweep CSVs, one per domain/resolver/record type
+DNS_ROW_INDEXES = [
+    ([('domain', 1), ('dns_server', 1), ('timestamp', 1)], {}),
+    ([('dns_server', 1)], {}),  # DNSPoisoningPlot, per resolver
+]
+# Rows in result_store format, also cleaned by CleanUp.cleanNoAnswer
+DNS_RESULT_INDEXES = DNS_ROW_INDEXES + [
+    ([('domain', 1), ('record_type', 1), ('error_code', 1)], {}),
+    ([('error_code', 1)], {}),
+]
+BDC_DNS_INDEXES = [
+    ([('domain', 1), ('timestamp', 1)], {}),
+]
+# One merged document per domain (and resolver for the DNS collections)
+MERGED_DNS_INDEXES = [
+    ([('domain', 1)], {}),
+    ([('dns_server', 1)], {}),
+    ([('error_code', 1)], {}),
+]
+# Looked up and deleted by domain (CleanUp, GFWLocationPlot)
+DOMAIN_INDEXES = [
+    ([('domain', 1)], {}),
+]
+UNIQUE_DOMAIN_INDEXES = [
+    ([('domain', 1)], {'unique': True}),
+]
+UNIQUE_DOMAIN_SERVER_INDEXES = [
+    ([('domain', 1), ('dns_server', 1)], {'unique': True}),
+]
+
+INDEX_SPECS = {
+    # AfterDomainChange
+    ('AfterDomainChange', 'China-Mobile-DNSPoisoning'): DNS_ROW_INDEXES,
+    ('AfterDomainChange', 'China-Telecom-DNSPoisoning'): DNS_ROW_INDEXES,
+    ('AfterDomainChange', 'UCDavis-Server-DNSPoisoning'): DNS_ROW_INDEXES,
+    ('AfterDomainChange', 'ChinaMobile-DNSPoisoning-November'):
+    DNS_RESULT_INDEXES,
+    ('AfterDomainChange', 'ChinaMobile-DNSPoisoning-2025-January'):
+    DNS_RESULT_INDEXES,
+    ('AfterDomainChange', 'ERROR_CODES'): MERGED_DNS_INDEXES,
+    ('AfterDomainChange', 'China-Mobile-GFWLocation'): UNIQUE_DOMAIN_INDEXES,
+    ('AfterDomainChange', 'China-Telecom-GFWLocation'): UNIQUE_DOMAIN_INDEXES,
+    ('AfterDomainChange', 'China-Telecom-IPBlocking'): UNIQUE_DOMAIN_INDEXES,
+    ('AfterDomainChange', 'UCDavis-Server-GFWLocation'): UNIQUE_DOMAIN_INDEXES,
+    ('AfterDomainChange', 'UCDavis-Server-IPBlocking'): UNIQUE_DOMAIN_INDEXES,
+    ('AfterDomainChange', 'ChinaMobile-GFWLocation-November'):
+    UNIQUE_DOMAIN_INDEXES,
+    ('AfterDomainChange', 'ChinaMobile-GFWLocation-2025-January'):
+    UNIQUE_DOMAIN_INDEXES,
+    # BeforeDomainChange
+    ('BeforeDomainChange', 'China-Mobile-DNSPoisoning'): BDC_DNS_INDEXES,
+    ('BeforeDomainChange', 'UCDavis-CompareGroup-DNSPoisoning'):
+    BDC_DNS_INDEXES,
+    ('BeforeDomainChange', 'China-Mobile-GFWLocation'):
+    UNIQUE_DOMAIN_SERVER_INDEXES,
+    ('BeforeDomainChange', 'China-Mobile-IPBlocking'):
+    UNIQUE_DOMAIN_SERVER_INDEXES,
+    ('BeforeDomainChange', 'China-Telecom-IPBlocking'):
+    UNIQUE_DOMAIN_SERVER_INDEXES,
+    ('BeforeDomainChange', 'UCDavis-CompareGroup-GFWLocation'):
+    UNIQUE_DOMAIN_SERVER_INDEXES,
+    ('BeforeDomainChange', 'UCDavis-CompareGroup-IPBlocking'):
+    UNIQUE_DOMAIN_SERVER_INDEXES,
+    # MergedDatabase
+    ('MergedDatabase', 'DNSPoisoning'): MERGED_DNS_INDEXES,
+    ('MergedDatabase', '2024_Nov_DNS'): MERGED_DNS_INDEXES,
+    ('MergedDatabase', '2025_DNS'): MERGED_DNS_INDEXES,
+    ('MergedDatabase', 'CompareGroup'): DOMAIN_INDEXES,
+    ('MergedDatabase', 'TraceRouteResult'): DOMAIN_INDEXES,
+    ('MergedDatabase', '2024_Nov_GFWL'): DOMAIN_INDEXES,
+    ('MergedDatabase', '2025_GFWL'): DOMAIN_INDEXES,
+}
+
+
+def index_spec(collection) -> list:
+  """Declared indexes of `collection` (pymongo or lazy), [] if none."""
+  return INDEX_SPECS.get((collection.database.name, collection.name), [])
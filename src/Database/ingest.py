@@ -0,0 +1,157 @@
+import hashlib
+import os
+import threading
+from datetime import datetime
+
+MANIFEST_COLLECTION = 'IngestManifest'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_id(document: dict) -> str:
+  """Deterministic `_id` for a row level document, derived from its fields.
+
+  Importing the same row twice, e.g. from a rotated copy of a results file,
+  yields the same `_id`, so the second insert is a harmless duplicate.
+  """
+  digest = hashlib.blake2b(digest_size=16)
+  for key in sorted(document):
+    if key != '_id':
+      digest.update(f'{key}\x1f{document[key]!r}\x1e'.encode('utf-8'))
+  return digest.hexdigest()
+
+
+def key_id(*values) -> str:
+  """Deterministic `_id` for a document merged from many rows by key."""
+  return hashlib.blake2b('\x1f'.join(map(str, values)).encode('utf-8'),
+                         digest_size=16).hexdigest()
+
+
+def merge_update(document: dict) -> dict:
+  """Upsert update that folds `document` into an existing merged document.
+
+  List fields are added with $addToSet, anything else is $set, so applying
+  the updates of new files to an existing collection gives the same lists
+  as rebuilding it from every file.
+  """
+  add_to_set = {}
+  fields = {}
+  for key, value in document.items():
+    if key == '_id':
+      continue
+    if isinstance(value, list):
+      add_to_set[key] = {'$each': value}
+    else:
+      fields[key] = value
+  update = {}
+  if add_to_set:
+    update['$addToSet'] = add_to_set
+  if fields:
+    update['$set'] = fields
+  return update
+
+
+def file_hash(path: str) -> str:
+  digest = hashlib.sha256()
+  with open(path, 'rb') as file:
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+class IngestManifest:
+  """Which source files have already been imported into a collection.
+
+  Entries (path, size, mtime, sha256, rows) live in the IngestManifest
+  collection of the target database. `pending` returns the files that are
+  new or changed; size and mtime are checked first so unchanged files are
+  never read, and a file whose content was already imported under another
+  name (a rotated `.partN` segment) is skipped by its hash. Entries are only
+  written by `commit`, after the file's documents are in the database, so an
+  interrupted import simply picks the file up again next time.
+  """
+
+  def __init__(self, db_handler):
+    self.collection_name = db_handler.collection.name
+    self.store = db_handler.collection.database[MANIFEST_COLLECTION]
+    self._entries = None
+    self._hashes = None
+    self._staged = {}
+    self._lock = threading.Lock()
+
+  def _load(self) -> dict:
+    if self._entries is None:
+      self._entries = {
+          entry['path']: entry
+          for entry in self.store.find({'collection': self.collection_name})
+      }
+      self._hashes = {entry['sha256'] for entry in self._entries.values()}
+    return self._entries
+
+  def is_empty(self) -> bool:
+    return not self._load()
+
+  def reset(self) -> None:
+    """Forget every file, for a full rebuild of the collection."""
+    self.store.delete_many({'collection': self.collection_name})
+    self._entries = {}
+    self._hashes = set()
+    self._staged = {}
+
+  def pending(self, paths: list) -> list:
+    entries = self._load()
+    changed = []
+    for path in paths:
+      path = os.path.abspath(path)
+      stat = os.stat(path)
+      entry = entries.get(path)
+      if (entry is not None and entry['size'] == stat.st_size
+          and entry['mtime'] == stat.st_mtime):
+        continue
+      sha256 = file_hash(path)
+      staged = {
+          '_id': key_id(self.collection_name, path),
+          'collection': self.collection_name,
+          'path': path,
+          'size': stat.st_size,
+          'mtime': stat.st_mtime,
+          'sha256': sha256,
+      }
+      with self._lock:
+        self._staged[path] = staged
+      if sha256 in self._hashes:
+        self.commit(path)  # Touched or renamed, but nothing new to import
+        continue
+      changed.append(path)
+    return changed
+
+  def commit(self, path: str = None, rows: int = None) -> None:
+    """Record `path` (or every pending file) as imported."""
+    with self._lock:
+      if path is None:
+        staged = list(self._staged.values())
+        self._staged = {}
+      else:
+        entry = self._staged.pop(os.path.abspath(path), None)
+        staged = [entry] if entry is not None else []
+    for entry in staged:
+      entry['ingested_at'] = datetime.now()
+      if rows is not None:
+        entry['rows'] = rows
+      self.store.replace_one({'_id': entry['_id']}, entry, upsert=True)
+      with self._lock:
+        self._entries[entry['path']] = entry
+        self._hashes.add(entry['sha256'])
+
+
+def open_manifest(db_handler, full: bool = False) -> IngestManifest:
+  """Manifest for an import into `db_handler`.
+
+  A full rebuild (forced, or the first import under a manifest, when the
+  existing documents have no deterministic `_id`s yet) drops the collection
+  and forgets every file, so everything is imported again.
+  """
+  manifest = IngestManifest(db_handler)
+  if full or manifest.is_empty():
+    db_handler.drop()
+    manifest.reset()
+  return manifest
@@ -0,0 +1,277 @@
+import ast
+import csv
+import functools
+import logging
+import os
+from collections import Counter
+
+from tqdm import tqdm
+
+from .ingest import content_id, key_id, merge_update, open_manifest
+from .mapped_reader import MappedFile
+from .parallel_parse import (PARSE_WORKERS, iter_csv_range, iter_line_range,
+                             parse_files, read_csv_header)
+from .preaggregate import KeyMerger
+from ..scripts.result_store import CSV_FIELDS, iter_results, normalize_csv_row
+
+logger = logging.getLogger(__name__)
+
+# Layout name -> Layout, tried in registration order by `detect_layout`
+LAYOUTS = {}
+
+
+class Layout:
+  """One on-disk format of result files.
+
+  `detect(path, first_line)` tells whether a file is in this layout from its
+  name and first non-blank line. `read(path, start, end)` yields the records
+  (dicts) of the lines in byte range [start, end), the whole file when `end`
+  is None.
+  """
+
+  def __init__(self, name: str, detect, read):
+    self.name = name
+    self.detect = detect
+    self.read = read
+
+  def __repr__(self) -> str:
+    return f'Layout({self.name!r})'
+
+
+def register_layout(name: str, detect):
+  """Decorator registering a `read(path, start, end)` function as a layout."""
+
+  def register(read):
+    LAYOUTS[name] = Layout(name, detect, read)
+    return read
+
+  return register
+
+
+def first_line(path: str) -> str:
+  if path.endswith('.parquet'):
+    return ''
+  with MappedFile(path) as file:
+    return file.first_line()
+
+
+def header_fields(line: str) -> list:
+  return next(csv.reader([line]), [])
+
+
+def detect_layout(path: str) -> Layout:
+  """The registered layout of `path`, None if no layout matches."""
+  line = first_line(path)
+  for layout in LAYOUTS.values():
+    if layout.detect(path, line):
+      return layout
+  return None
+
+
+def _header_records(path: str, start: int, end: int):
+  # CSV with a header line: every shard reads the header from the file start
+  header = read_csv_header(path)
+  for row in iter_csv_range(path, start, end):
+    if row != header and len(row) >= len(header):
+      yield dict(zip(header, row))
+
+
+@register_layout(
+    'dns-results', lambda path, line: path.endswith('.parquet') or
+    header_fields(line) == CSV_FIELDS)
+def read_dns_results(path: str, start: int, end: int):
+  """DNS poisoning sweeps since 2024-11, result_store CSV or Parquet."""
+  if path.endswith('.parquet'):
+    yield from iter_results(path)
+    return
+  for record in _header_records(path, start, end):
+    yield normalize_csv_row(record)
+
+
+@register_layout(
+    'dns-poisoning', lambda path, line: line.startswith(
+        'timestamp,domain,china_result_ipv4,china_result_ipv6'))
+def read_dns_poisoning(path: str, start: int, end: int):
+  """China vs. global resolver comparison, 9 columns, 2024-08 to 2024-09."""
+  return _header_records(path, start, end)
+
+
+@register_layout(
+    'ip-blocking', lambda path, line: header_fields(line) ==
+    ['timestamp', 'domain', 'ip', 'ip_type', 'port', 'is_accessible'])
+def read_ip_blocking(path: str, start: int, end: int):
+  return _header_records(path, start, end)
+
+
+@register_layout(
+    'gfw-location-csv', lambda path, line: {'Domain', 'RST Detected'} <= set(
+        header_fields(line)))
+def read_gfw_location_csv(path: str, start: int, end: int):
+  """Traceroute sweeps since 2024-11, one DictReader row per hop target."""
+  return _header_records(path, start, end)
+
+
+@register_layout('traceroute-dicts', lambda path, line: line.startswith('{'))
+def read_traceroute_dicts(path: str, start: int, end: int):
+  """One Python dict repr per line, as the 2024-09 traceroute runs wrote."""
+  for line in iter_line_range(path, start, end):
+    line = line.strip()
+    if not line.startswith('{'):
+      continue  # 跳过空行或非字典格式的行
+    try:
+      yield ast.literal_eval(line)
+    except (ValueError, SyntaxError) as e:
+      logger.error(f'Error parsing line in {os.path.basename(path)}: {e} | '
+                   f'Line Content: {line}')
+
+
+@register_layout('traceroute-text', lambda path, line: path.endswith('.txt'))
+def read_traceroute_text(path: str, start: int, end: int):
+  """`domain: result` lines; lines without a result get an empty one."""
+  for line in iter_line_range(path, start, end):
+    if not line.strip():
+      continue
+    parts = line.split(':')
+    yield {
+        'domain': parts[0],
+        'result': parts[1].strip() if len(parts) > 1 else ''
+    }
+
+
+class Dataset:
+  """A collection and the result files imported into it.
+
+  `normalise(record, path)` turns one record into a list of documents; it
+  runs in the parse worker processes, so it must be a module level function.
+  Without `key` every document is inserted as is, under a content `_id`.
+  With `key`, documents sharing the key fields are merged into one, each
+  other field becoming the list of its distinct values (empty values left
+  out if `skip_empty`), except `scalars`, which keep the last value.
+  Merged lists are stored as is, so incremental imports can extend them;
+  summaries over them are derived when reading.
+  """
+
+  def __init__(self,
+               db_handler,
+               folder: str,
+               normalise,
+               extensions: tuple = ('.csv',),
+               layouts: tuple = None,
+               key: tuple = None,
+               scalars: tuple = (),
+               skip_empty: bool = False):
+    self.db_handler = db_handler
+    self.folder = folder
+    self.normalise = normalise
+    self.extensions = extensions
+    self.layouts = layouts
+    self.key = key
+    self.scalars = scalars
+    self.skip_empty = skip_empty
+
+  @property
+  def name(self) -> str:
+    return self.db_handler.collection.name
+
+  def list_files(self) -> list:
+    return sorted(
+        os.path.join(self.folder, file) for file in os.listdir(self.folder)
+        if file.endswith(self.extensions))
+
+
+def parse_shard(normalise, layouts: tuple, with_ids: bool, merge: tuple,
+                path: str, start: int, end: int) -> list:
+  """Documents of one byte range of `path`, run in a parse worker.
+
+  With `merge` (key, scalars, skip_empty) the shard's documents are merged
+  by key before they are sent back, see `KeyMerger.add_merged`.
+  """
+  layout = detect_layout(path)
+  if layout is None or (layouts is not None and layout.name not in layouts):
+    # Left pending in the manifest, a later layout can still pick it up
+    raise ValueError(f'no matching layout (found {layout}, '
+                     f'expected one of {layouts})')
+  documents = []
+  for record in layout.read(path, start, end):
+    documents.extend(normalise(record, path))
+  if with_ids:
+    for document in documents:
+      document['_id'] = content_id(document)  # Re-imports are no-ops
+  if merge is not None:
+    merger = KeyMerger(*merge, max_keys=float('inf'))
+    merger.add(documents)
+    return merger.documents()
+  return documents
+
+
+def ingest(dataset: Dataset,
+           full: bool = False,
+           workers: int = PARSE_WORKERS,
+           on_parsed=None) -> dict:
+  """Import the new or changed files of `dataset`, all of them if `full`.
+
+  Files are detected and parsed in a process pool and written by this
+  process through one BulkWriter. A file is recorded in the manifest once
+  its documents are written; files that failed to parse stay pending.
+  `on_parsed(documents)` sees the documents of every shard before merging.
+  Returns the writer statistics.
+
+  Merged datasets are imported in two phases: every file is merged into one
+  document per key first (`KeyMerger`, spilling to disk if needed), then
+  each document is written exactly once. On a rebuild that is a plain
+  insert; otherwise an upsert with $addToSet, so new files extend the
+  stored lists.
+  """
+  handler = dataset.db_handler
+  manifest = open_manifest(handler, full)
+  # The collection was just dropped, nothing to merge into
+  rebuild = manifest.is_empty()
+  paths = manifest.pending(dataset.list_files())
+  logger.info(f'{dataset.name}: {len(paths)} new or changed files to import')
+  handler.ensure_indexes()  # Declared in index_specs.py
+
+  merger = None
+  merge = None
+  if dataset.key is not None:
+    merger = KeyMerger(dataset.key, dataset.scalars, dataset.skip_empty)
+    if on_parsed is None:
+      # Shards come back merged, far less to pickle and fold in here
+      merge = (dataset.key, dataset.scalars, dataset.skip_empty)
+  shard_parser = functools.partial(parse_shard, dataset.normalise,
+                                   dataset.layouts, dataset.key is None, merge)
+  rows = Counter()
+  finished_paths = []
+  with handler.bulk_writer() as writer:
+    for path, documents, finished in tqdm(parse_files(paths, shard_parser,
+                                                      workers),
+                                          desc=f'Importing {dataset.name}'):
+      if on_parsed is not None:
+        on_parsed(documents)
+      rows[path] += len(documents)
+      if merger is None:
+        for document in documents:
+          writer.insert_one(document)
+        if finished:
+          writer.flush()
+          manifest.commit(path, rows=rows[path])
+        continue
+      if merge is None:
+        merger.add(documents)
+      else:
+        merger.add_merged(documents)
+      if finished:
+        finished_paths.append(path)
+
+    # Merged documents are complete only once every file is read
+    for values, document in merger if merger is not None else ():
+      if rebuild:
+        document['_id'] = key_id(*values)
+        writer.insert_one(document)
+      else:
+        writer.update_one({'_id': key_id(*values)},
+                          merge_update(document),
+                          upsert=True)
+    writer.flush()
+    for path in finished_paths:
+      manifest.commit(path, rows=rows[path])
+    return dict(writer.stats)
@@ -0,0 +1,121 @@
+import logging
+
+from .DBOperations import Merged_db, MongoDBHandler
+
+logger = logging.getLogger(__name__)
+
+# Source fields each Merger._merge_* function reads, besides domain and
+# dns_server. The server only unions their values per key; parsing them
+# (string encoded IP lists, dns_server lists, internal IPs) stays in Python.
+SOURCE_FIELDS = {
+    '_merge_adc_cm_dnsp': ('timestamp', 'ips'),
+    '_merge_adc_ct_dnsp': ('timestamp', 'ips'),
+    '_merge_bdc_cm_dnsp': ('timestamp', 'ips'),
+    '_merge_adc_cm_dnsp_nov': ('timestamp', 'ips', 'error_code',
+                               'error_reason', 'record_type'),
+    '_merge_adc_cm_gfwl': ('ips', 'error', 'mark'),
+    '_merge_adc_ct_gfwl': ('results',),
+    '_merge_adc_ct_ipb': ('timestamp', 'IPv4', 'IPv6', 'is_accessible'),
+    '_merge_adc_cm_gfwl_nov': ('Error', 'IPv4', 'IPv6', 'Invalid IP',
+                               'RST Detected', 'Redirection Detected',
+                               'timestamp'),
+    '_merge_bdc_cm_gfwl': ('result',),
+    '_merge_bdc_ct_ipb': ('timestamp', 'results_ip', 'ip_type', 'port',
+                          'is_accessible'),
+}
+
+
+def as_array(field: str) -> dict:
+  """`field` as an array: arrays as is, null or missing as [], else [value]."""
+  path = f'${field}'
+  return {
+      '$cond': [{
+          '$isArray': path
+      }, path, {
+          '$cond': [{
+              '$gt': [path, None]
+          }, [path], []]
+      }]
+  }
+
+
+def staging_name(source: MongoDBHandler) -> str:
+  collection = source.collection
+  return f'Staging-{collection.database.name}-{collection.name}'
+
+
+def union_pipeline(fields: tuple, use_dns_server: bool, into: str) -> list:
+  """
+    One document per domain (and dns_server) of a source collection, each
+    field the set union of the values of all its documents, written to
+    `into` in Merged_db. The staged documents keep the source field names,
+    so the Merger's _merge_* functions read them like the raw documents.
+    """
+  key = {'domain': '$domain'}
+  if use_dns_server:
+    key['dns_server'] = '$dns_server'
+  project = {'_id': 0, 'domain': 1}
+  if use_dns_server:
+    project['dns_server'] = 1
+  project.update({field: as_array(field) for field in fields})
+  group = {'_id': key}
+  group.update({field: {'$addToSet': f'${field}'} for field in fields})
+  unions = {'_id': 0}
+  unions.update({name: f'$_id.{name}' for name in key})
+  unions.update({
+      field: {
+          '$reduce': {
+              'input': f'${field}',
+              'initialValue': [],
+              'in': {
+                  '$setUnion': ['$$value', '$$this']
+              }
+          }
+      } for field in fields
+  })
+  return [
+      {
+          '$match': {
+              'domain': {
+                  '$nin': [None, '']
+              }
+          }
+      },
+      {
+          '$project': project
+      },
+      {
+          '$group': group
+      },
+      {
+          '$project': unions
+      },
+      {
+          '$merge': {
+              'into': {
+                  'db': Merged_db.name,
+                  'coll': into
+              },
+              'whenMatched': 'replace',
+              'whenNotMatched': 'insert'
+          }
+      },
+  ]
+
+
+def stage_source(source: MongoDBHandler, merge_function,
+                 use_dns_server: bool) -> MongoDBHandler:
+  """
+    Run the union of `source` on the server and return the staging
+    collection holding it, to be merged in place of `source`.
+    """
+  staging = MongoDBHandler(Merged_db[staging_name(source)])
+  staging.drop()
+  fields = SOURCE_FIELDS[merge_function.__name__]
+  logger.info(f"Grouping {source.collection.name} on the server into "
+              f"{staging.collection.name}")
+  # $merge writes on the server, nothing comes back to iterate
+  for _ in source.iter_aggregate(
+      union_pipeline(fields, use_dns_server, staging.collection.name)):
+    pass
+  return staging
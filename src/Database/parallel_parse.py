@@ -0,0 +1,122 @@
+import concurrent.futures
+import csv
+import logging
+import multiprocessing
+import os
+
+from .mapped_reader import MappedFile
+
+logger = logging.getLogger(__name__)
+
+CPU_CORES = multiprocessing.cpu_count()
+# Parsing is CPU bound, one process per core is all that helps
+PARSE_WORKERS = CPU_CORES
+# Files larger than this are split into byte ranges parsed in parallel
+SHARD_SIZE = 32 * 1024 * 1024
+# Shards parsed ahead of the writer, per worker, bounds memory use
+SHARDS_IN_FLIGHT = 2
+# Line based files, safe to split on line boundaries
+SPLITTABLE_EXTENSIONS = ('.csv', '.txt')
+
+
+def split_file(path: str, shard_size: int = SHARD_SIZE) -> list:
+  """Byte ranges [start, end) of `path`, each ending on a line boundary.
+
+  Only valid for files without newlines inside quoted fields, which holds
+  for every CSV and text file the probes write. Other files (Parquet) are a
+  single shard.
+  """
+  size = os.path.getsize(path)
+  if not path.endswith(SPLITTABLE_EXTENSIONS) or size <= shard_size:
+    return [(0, None)]
+  ranges = []
+  start = 0
+  with open(path, 'rb') as file:
+    while start < size:
+      file.seek(min(start + shard_size, size))
+      file.readline()  # Move on to the next line boundary
+      end = min(file.tell(), size)
+      ranges.append((start, end))
+      start = end
+  return ranges
+
+
+def read_csv_header(path: str) -> list:
+  with open(path, 'r', newline='', encoding='utf-8') as file:
+    return next(csv.reader(file), [])
+
+
+def iter_csv_range(path: str, start: int = 0, end: int = None):
+  """csv.reader rows of the lines in byte range [start, end) of `path`."""
+  # Straight out of the map one line at a time, the shard is never copied
+  with MappedFile(path) as mapped:
+    yield from mapped.rows(start, end)
+
+
+def iter_line_range(path: str, start: int = 0, end: int = None):
+  """Lines (without line breaks) in byte range [start, end) of `path`."""
+  with MappedFile(path) as mapped:
+    for line in mapped.lines(start, end):
+      yield line.decode('utf-8').rstrip('\r\n')
+
+
+def _pack(documents: list) -> tuple:
+  # Documents of one shard nearly always share their keys, so send the keys
+  # once and the values as tuples; much less to pickle than a list of dicts.
+  if documents:
+    keys = tuple(documents[0])
+    if all(len(doc) == len(keys) and tuple(doc) == keys for doc in documents):
+      return keys, [tuple(doc.values()) for doc in documents]
+  return None, documents
+
+
+def _unpack(packed: tuple) -> list:
+  keys, rows = packed
+  if keys is None:
+    return rows
+  return [dict(zip(keys, values)) for values in rows]
+
+
+def _parse_shard(parse_shard, path: str, start: int, end: int) -> tuple:
+  return _pack(parse_shard(path, start, end))
+
+
+def parse_files(paths: list,
+                parse_shard,
+                workers: int = PARSE_WORKERS,
+                shard_size: int = SHARD_SIZE):
+  """Parse `paths` in a process pool, yielding (path, documents, finished).
+
+  `parse_shard(path, start, end)` must be a module level function returning
+  the documents for one byte range (see `iter_csv_range`); `end` is None for
+  a whole file. Shards are yielded as they complete, so the caller can feed
+  a single writer while the workers keep parsing. `finished` is True on the
+  last shard of a file, when it is safe to record the file as imported;
+  a file with a shard that failed to parse is logged and never finished.
+  """
+  shards = [(path, start, end) for path in paths
+            for start, end in split_file(path, shard_size)]
+  remaining = {}
+  for path, _, _ in shards:
+    remaining[path] = remaining.get(path, 0) + 1
+  failed = set()
+  shards.reverse()
+  with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+    running = {}
+    while shards or running:
+      while shards and len(running) < workers * SHARDS_IN_FLIGHT:
+        path, start, end = shards.pop()
+        future = executor.submit(_parse_shard, parse_shard, path, start, end)
+        running[future] = path
+      done, _ = concurrent.futures.wait(
+          running, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        path = running.pop(future)
+        remaining[path] -= 1
+        try:
+          documents = _unpack(future.result())
+        except Exception as e:
+          logger.error(f'Error parsing {os.path.basename(path)}: {e}')
+          failed.add(path)
+          documents = []
+        yield path, documents, remaining[path] == 0 and path not in failed
@@ -0,0 +1,180 @@
+import heapq
+import logging
+import pickle
+import tempfile
+
+from .ingest import key_id
+
+logger = logging.getLogger(__name__)
+
+# Keys merged in memory before they are spilled to disk as a sorted run
+MAX_MERGED_KEYS = 1_000_000
+
+
+def _hashable(value):
+  # Distinct values are tracked in dicts, lists (IPv4 lists of the BDC
+  # files) and dicts have to become tuples first
+  if isinstance(value, list):
+    return tuple(_hashable(item) for item in value)
+  if isinstance(value, dict):
+    return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+  return value
+
+
+def _read_run(run):
+  run.seek(0)
+  while True:
+    try:
+      yield pickle.load(run)
+    except EOFError:
+      return
+
+
+def write_run(entries, directory: str) -> str:
+  """Pickle `entries`, (sort key, ...) tuples in sort key order, to a new
+  run file in `directory` and return its path.
+
+  Unlike KeyMerger's runs the file outlives the process that wrote it, so
+  worker processes can hand their runs back by path.
+  """
+  with tempfile.NamedTemporaryFile(dir=directory, suffix='.run',
+                                   delete=False) as run:
+    for entry in entries:
+      pickle.dump(entry, run, protocol=pickle.HIGHEST_PROTOCOL)
+  return run.name
+
+
+def merge_run_files(paths: list):
+  """Entries of every run file in `paths`, k-way merged in sort key order."""
+  runs = [open(path, 'rb') for path in paths]
+  try:
+    yield from heapq.merge(*map(_read_run, runs), key=lambda entry: entry[0])
+  finally:
+    for run in runs:
+      run.close()
+
+
+class KeyMerger:
+  """Set union of documents per key, phase one of a merged import.
+
+  Documents sharing the `key` fields are merged into one, each other field
+  becoming the list of its distinct values in first seen order (empty values
+  left out if `skip_empty`), except `scalars`, which keep the last value.
+  Once `max_keys` keys are held in memory, they are written to a temporary
+  file as a run sorted by `key_id`; iterating the merger then merges the runs
+  k-way, so every key still comes out exactly once, with the same lists as
+  an in-memory merge.
+  """
+
+  def __init__(self,
+               key: tuple,
+               scalars: tuple = (),
+               skip_empty: bool = False,
+               max_keys: int = MAX_MERGED_KEYS):
+    self.key = key
+    self.scalars = scalars
+    self.skip_empty = skip_empty
+    self.max_keys = max_keys
+    # key values -> {field: {hashable value: value} or scalar}
+    self._merged = {}
+    self._runs = []
+
+  def add(self, documents: list) -> None:
+    """Fold single row documents in."""
+    key = self.key
+    for document in documents:
+      values = tuple(document.get(field) for field in key)
+      target = self._merged.get(values)
+      if target is None:
+        target = self._merged[values] = {}
+      for field, value in document.items():
+        if field in key:
+          continue
+        if field in self.scalars:
+          target[field] = value
+          continue
+        distinct = target.setdefault(field, {})
+        if value or not self.skip_empty:
+          distinct.setdefault(_hashable(value), value)
+    self._spill_if_full()
+
+  def add_merged(self, documents: list) -> None:
+    """Fold in documents that are already merged, e.g. by `documents()`."""
+    for document in documents:
+      values = tuple(document.get(field) for field in self.key)
+      target = self._merged.get(values)
+      if target is None:
+        target = self._merged[values] = {}
+      self._fold(target, document)
+    self._spill_if_full()
+
+  def _fold(self, target: dict, document: dict) -> None:
+    for field, value in document.items():
+      if field in self.key:
+        continue
+      if field in self.scalars:
+        target[field] = value
+        continue
+      distinct = target.setdefault(field, {})
+      for item in value:
+        distinct.setdefault(_hashable(item), item)
+
+  def _document(self, values: tuple, target: dict) -> dict:
+    document = dict(zip(self.key, values))
+    for field, value in target.items():
+      document[field] = (value if field in self.scalars else list(
+          value.values()))
+    return document
+
+  def documents(self) -> list:
+    """The merged documents held in memory, and forget them."""
+    documents = [
+        self._document(values, target)
+        for values, target in self._merged.items()
+    ]
+    self._merged = {}
+    return documents
+
+  def _spill_if_full(self) -> None:
+    if len(self._merged) >= self.max_keys:
+      self._spill()
+
+  def _spill(self) -> None:
+    run = tempfile.TemporaryFile()
+    entries = sorted(((key_id(*values), values, target)
+                      for values, target in self._merged.items()),
+                     key=lambda entry: entry[0])
+    for id_, values, target in entries:
+      pickle.dump((id_, values, self._document(values, target)), run,
+                  protocol=pickle.HIGHEST_PROTOCOL)
+    logger.info(f'Spilled {len(entries)} merged keys to disk '
+                f'(run {len(self._runs) + 1})')
+    self._runs.append(run)
+    self._merged = {}
+
+  def __iter__(self):
+    """(key values, merged document) of every key, each exactly once."""
+    if not self._runs:
+      for values, target in self._merged.items():
+        yield values, self._document(values, target)
+      self._merged = {}
+      return
+    if self._merged:
+      self._spill()
+    try:
+      # Runs are sorted by `_id`, equal ids come out in run (file) order,
+      # so scalars still end up with the last value
+      current_id = current_values = target = None
+      for id_, values, document in heapq.merge(*map(_read_run, self._runs),
+                                               key=lambda entry: entry[0]):
+        if id_ != current_id:
+          if target is not None:
+            yield current_values, self._document(current_values, target)
+          current_id, current_values, target = id_, values, {}
+        self._fold(target, document)
+      if target is not None:
+        yield current_values, self._document(current_values, target)
+    finally:
+      for run in self._runs:
+        run.close()
+      self._runs = []
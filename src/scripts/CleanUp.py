@@ -51,12 +51,21 @@ def read_domains(file_path):
   return domains
 
 
+def all_ips_empty(results) -> bool:
+  """True if there is at least one result and none of them has IPs."""
+  found = False
+  for r in results:
+    found = True
+    if r.get('ips') and r['ips'] != '[]':
+      return False
+  return found
+
+
 def check_domain(compare_db, target_db, domain):
-  compare_results = compare_db.find({"domain": domain})
-  target_results = target_db.find({"domain": domain})
   # 如果对比库与目标库的IPS都为空则视为无效域名
-  if compare_results and all([not r['ips'] or r['ips'] == '[]' for r in compare_results]) \
-     and target_results and all([not r['ips'] or r['ips'] == '[]' for r in target_results]):
+  # Streamed, so the first result with IPs ends the check
+  if all_ips_empty(compare_db.iter_find({"domain": domain}, {"ips": 1})) \
+     and all_ips_empty(target_db.iter_find({"domain": domain}, {"ips": 1})):
     with open("InvalidDomains.txt", "a") as file:
       file.write(f"{domain}\n")
     print(f"{domain} is invalid")
@@ -78,6 +87,10 @@ def cleanDomains():
   print(f"Total {len(all_results)} records")
 
   db = MongoDBHandler(Merged_db['CompareGroup'])
+  # check_domain/cleanNoAnswer look up one domain at a time
+  for handler in (db, DNSPoisoning, merged_2024_Nov_DNS, merged_2025_Jan_DNS,
+                  adc_2025_Jan_DNS):
+    handler.ensure_indexes()
   import_to_db(db, all_results)
 
   domains_file_path = os.path.join(os.path.dirname(__file__),
@@ -113,7 +126,9 @@ def cleanNoAnswer(db):
   total_docs = db.count_documents({"error_code": "NoAnswer"})
   processed = 0
   batch_size = 20000
-  cursor = db.find({"error_code": "NoAnswer"}).batch_size(batch_size)
+  cursor = db.iter_find({"error_code": "NoAnswer"}, {"domain": 1},
+                        batch_size=batch_size,
+                        no_cursor_timeout=True)
 
   for result in cursor:
     domain = result["domain"]
@@ -1,4 +1,5 @@
 from ..Database.DBOperations import MongoDBHandler, ADC_db
+from .error_normalizer import DNS, DNS_ERROR_REASONS
 import os
 import re
 
@@ -49,34 +50,9 @@ def parse_txt():
           else:
             record_type = "Unknown"
 
-          # 新增对更多错误类型的判断
-          if "NXDOMAIN" in line or "The DNS query name does not exist" in line:
-            error_code = "NXDOMAIN"
-            error_reason = "Domain does not exist"
-          elif "REFUSED" in line:
-            error_code = "REFUSED"
-            error_reason = "Query refused by server"
-          elif "FORMERR" in line:
-            error_code = "FORMERR"
-            error_reason = "Format error"
-          elif "SERVFAIL" in line:
-            error_code = "SERVFAIL"
-            error_reason = "Server failed to respond"
-          elif "timed out" in line or "The resolution lifetime expired" in line:
-            error_code = "Timed out"
-            error_reason = "The DNS operation timed out"
-          elif "YXDOMAIN" in line:
-            error_code = "YXDOMAIN"
-            error_reason = "Domain exists but should not"
-          elif "YXRRSET" in line:
-            error_code = "YXRRSET"
-            error_reason = "Resource record set exists but should not"
-          elif "NOTIMP" in line:
-            error_code = "NOTIMP"
-            error_reason = "Query not implemented by server"
-          elif "NOTAUTH" in line:
-            error_code = "NOTAUTH"
-            error_reason = "Server not authoritative for zone"
+          # 错误类型判断, 见 error_normalizer.py
+          error_code = DNS.classify(line)
+          error_reason = DNS_ERROR_REASONS.get(error_code)
 
           record = {
               "_id":
@@ -103,6 +79,7 @@ def parse_txt():
             ERROR_CODES.insert_one(record)
     print(f"Finished processing {file_path}")
     print(f"Total records: {ERROR_CODES.count_documents({})}")
+  print(f"Error codes: {dict(DNS.counts)}")
 
 
 if __name__ == "__main__":
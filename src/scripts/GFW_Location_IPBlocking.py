@@ -1,16 +1,20 @@
-import concurrent.futures
+import asyncio
 import csv
 import os
-import re
-import socket
-import subprocess
 from datetime import datetime, timedelta
 from time import sleep
-from ipaddress import ip_address
 from urllib.request import urlretrieve
-import py7zr
-import geoip2.database
-from scapy.all import IP, TCP, sr1, conf
+
+from address_resolver import AddressResolver
+from compressor import BackgroundCompressor, rotate_segments
+from error_normalizer import TRACEROUTE
+from geoip_lookup import GEOIP_DB_PATH, locate
+from rst_probe import RstProber
+from traceroute_engine import TracerouteEngine
+
+RESULTS_FOLDER = "D:\\Developer\\GFW-Research\\src\\Lib\\Data-2025-1\\China-Mobile\\GFWLocation"
+# See compressor.choose_filters
+COMPRESSION_CODEC = 'auto'
 
 
 def get_domains_list() -> list:
@@ -31,8 +35,6 @@ def get_domains_list() -> list:
 
 
 def download_geoip_database() -> None:
-  GEOIP_DB_PATH = os.path.join(os.path.dirname(__file__),
-                               "../Import/GeoLite2-City.mmdb")
   if not os.path.exists(GEOIP_DB_PATH):
     try:
       print("Downloading GeoLite2 City database")
@@ -43,18 +45,6 @@ def download_geoip_database() -> None:
       print(f"Error downloading GeoLite2 City database: {e}")
 
 
-def check_domain_exists(domain: str) -> bool:
-  try:
-    print(f"Checking if {domain} exists")
-    ip_address = socket.gethostbyname(domain)
-    return True
-  except socket.gaierror:
-    return False
-  except Exception as e:
-    print(f"Error checking domain existence: {e}")
-    return False
-
-
 def get_dns_servers() -> list:
   print("读取DNS服务器列表")
   csv_file = "D:\\Developer\\GFW-Research\\src\\Import\\dns_servers.csv"
@@ -72,142 +62,32 @@ def get_dns_servers() -> list:
 
 
 def map_traceroute_error(error: str) -> str:
-  error_mapping = {
-      'Traceroute timed out': 'Timeout',
-      'No Answer': 'NoAnswer',
-      'Traceroute Failed': 'Failed',
-      'Not Found': 'NotFound',
-      'Network Unreachable': 'NetworkUnreachable',
-      'Host Unreachable': 'HostUnreachable',
-      'Protocol Unreachable': 'ProtocolUnreachable',
-      'Port Unreachable': 'PortUnreachable',
-      'Fragmentation Needed': 'FragmentationNeeded',
-      'Source Route Failed': 'SourceRouteFailed',
-      'Destination Network Unknown': 'DestinationNetworkUnknown',
-      'Destination Host Unknown': 'DestinationHostUnknown',
-      'Source Host Isolated': 'SourceHostIsolated',
-      'Communication with Destination Network Administratively Prohibited':
-      'CommunicationWithDestinationNetworkAdministrativelyProhibited',
-      'Communication with Destination Host Administratively Prohibited':
-      'CommunicationWithDestinationHostAdministrativelyProhibited',
-      'Destination Network Unreachable for Type of Service':
-      'DestinationNetworkUnreachableForTypeOfService',
-      'Destination Host Unreachable for Type of Service':
-      'DestinationHostUnreachableForTypeOfService',
-      'Communication Administratively Prohibited':
-      'CommunicationAdministrativelyProhibited',
-      'Host Precedence Violation': 'HostPrecedenceViolation',
-      'Precedence cutoff in effect': 'PrecedenceCutoffInEffect',
-      'Domain does not exist': 'DomainDoesNotExist'
-  }
-  return error_mapping.get(error, 'UnknownError')
-
-
-def traceroute(domain: str, dns_server: str, use_ipv6: bool = False) -> dict:
-  print(f"使用DNS服务器 {dns_server} 进行 traceroute")
+  return TRACEROUTE.classify(error, 'UnknownError')  # 见 error_normalizer.py
+
+
+async def traceroute(engine: TracerouteEngine, prober: RstProber,
+                     domain: str, target: str) -> dict:
+  print(f"Tracerouting to {domain} ({target})")
   try:
-    # 使用指定DNS服务器解析域名
-    resolver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    resolver.settimeout(5)
-    resolver.connect((dns_server, 53))
-    resolver.close()
-    if use_ipv6:
-      print(f"Tracerouting to {domain} using IPv6")
-      command = ['tracert', '-6', domain]
-    else:
-      print(f"Tracerouting to {domain} using IPv4")
-      command = ['tracert', '-4', domain]
-
-    print(f"Running traceroute command: {' '.join(command)}")
-    output = subprocess.check_output(command,
-                                     stderr=subprocess.STDOUT,
-                                     encoding='utf-8',
-                                     timeout=300,
-                                     errors='ignore')
-    lines = output.split('\n')
-
-    ipv4_pattern = r'\b(?:\d{1,3}\.){3}\d{1,3}\b'
-    ipv6_pattern = r'([0-9a-fA-F]{1,4}(?::[0-9a-fA-F]{1,4}){7})'
-
-    ips = {"ipv4": [], "ipv6": []}
-    invalid_ips = []  # Store invalid IPs
-
-    for line in lines:
-      found_ipv4 = re.findall(ipv4_pattern, line)
-      found_ipv6 = re.findall(ipv6_pattern, line)
-      if found_ipv4:
-        for ip in found_ipv4:
-          try:
-            ip_address(ip)
-            ips["ipv4"].append(ip)
-          except ValueError:
-            invalid_ips.append(ip)
-      if found_ipv6 and use_ipv6:
-        ips["ipv6"].extend(found_ipv6)
+    trace = await engine.trace(target)
+    ips = trace["ips"]
 
     print(f"Checking for TCP RST and redirection for {domain}")
-    rst_detected = False
-    redirection_detected = False
-
-    for ip in ips["ipv4"]:
-      try:
-        pkt = IP(dst=ip) / TCP(dport=80, flags="S")
-        resp = sr1(pkt, timeout=2, verbose=0)
-        if resp and resp.haslayer(TCP):
-          if resp[TCP].flags == "RA":
-            rst_detected = True
-          if resp[TCP].flags == "SA" and resp[IP].src != ip:
-            redirection_detected = True
-      except OSError as e:
-        if e.errno == 9:
-          print(f"File descriptor error for {ip}: {e}")
-          break  # 退出循环以避免进一步的文件描述符错误
-        else:
-          print(f"Error checking TCP RST and redirection for {ip}: {e}")
-      except Exception as e:
-        print(f"Error checking TCP RST and redirection for {ip}: {e}")
-      finally:
-        # 确保清理所有打开的文件描述符
-        conf.L3socket().close()
+    # All hops are probed at once, answers for known hops come from the cache
+    rst_detected, redirection_detected = await prober.check(ips["ipv4"])
 
     # 添加错误映射
-    errors = []
-    for ip in invalid_ips:
-      mapped_error = map_traceroute_error(ip)  # 假设ip包含错误信息
-      errors.append(mapped_error)
+    errors = [map_traceroute_error(error) for error in trace["errors"]]
 
     return {
         "ips": ips,
+        "hops": trace["hops"],
         "rst_detected": rst_detected,
         "redirection_detected": redirection_detected,
-        "invalid_ips": invalid_ips,
+        "invalid_ips": [],
         "errors": errors
     }
 
-  except subprocess.CalledProcessError as e:
-    print(f"Error running traceroute for {domain}: {e}")
-    return {
-        "ips": {
-            "ipv4": [],
-            "ipv6": []
-        },
-        "rst_detected": False,
-        "redirection_detected": False,
-        "invalid_ips": [],
-        "error": str(e)
-    }
-  except subprocess.TimeoutExpired:
-    print(f"Traceroute command timed out for {domain}")
-    return {
-        "ips": {
-            "ipv4": [],
-            "ipv6": []
-        },
-        "rst_detected": False,
-        "redirection_detected": False,
-        "invalid_ips": [],
-        "error": "Traceroute timed out"
-    }
   except Exception as e:
     print(f"Error during traceroute for {domain}: {e}")
     return {
@@ -222,34 +102,13 @@ def traceroute(domain: str, dns_server: str, use_ipv6: bool = False) -> dict:
     }
 
 
-def check_domain_ipv6_support(domain: str) -> bool:
-  try:
-    print(f"Checking if {domain} supports IPv6")
-    ipv6_address = socket.getaddrinfo(domain, None, socket.AF_INET6)
-    if (ipv6_address[0][3] == ''):
-      print(f"{domain} does not support IPv6")
-      return False
-    else:
-      print(f"{domain} supports IPv6")
-      return True
-  except socket.gaierror:
-    return False
-  except Exception as e:
-    print(f"Error checking IPv6 support for {domain}: {e}")
-    return False
-
-
 def lookup_ip(ip: str) -> str:
   try:
     print(f"Looking up IP address {ip}")
-    with geoip2.database.Reader("../Import/GeoLite2-City.mmdb") as reader:
-      response = reader.city(ip)
-      country = response.country.name
-      region = response.subdivisions.most_specific.name if response.subdivisions else "Unknown"
-      city = response.city.name if response.city.name else "Unknown"
-      return f"{country}, {region}, {city}"
-  except geoip2.errors.AddressNotFoundError:
-    return "IP address not found in local database"
+    location = locate(ip)  # Shared mmap reader, cached per IP
+    if location is None:
+      return "IP address not found in local database"
+    return ", ".join(str(part) for part in location)
   except Exception as e:
     return f"Local IP lookup failed: {str(e)}"
 
@@ -270,62 +129,101 @@ def ip_lookup(ips: dict) -> dict:
   return result
 
 
-def process_domain(domain: str, dns_servers: list) -> list:
+def choose_target(addresses: dict) -> str:
+  # Prefer IPv6 when the resolver returned any AAAA record, as before
+  if addresses["ipv6"]:
+    return addresses["ipv6"][0]
+  if addresses["ipv4"]:
+    return addresses["ipv4"][0]
+  return None
+
+
+async def process_domain(engine: TracerouteEngine, prober: RstProber,
+                         resolver: AddressResolver, domain: str,
+                         dns_servers: list) -> list:
   results = []
   try:
-    exist = check_domain_exists(domain)
-    if exist:
-      for dns in dns_servers:
-        result = check_domain_ipv6_support(domain)
-        if result:
-          traceroute_output = traceroute(domain, dns, use_ipv6=True)
-        else:
-          traceroute_output = traceroute(domain, dns, use_ipv6=False)
-        results.append({
-            "domain":
-            domain,
-            "dns_server":
-            dns,
-            "ips":
-            traceroute_output.get("ips", {}),
-            "invalid_ips":
-            traceroute_output.get("invalid_ips", []),
-            "rst_detected":
-            traceroute_output.get("rst_detected", False),
-            "redirection_detected":
-            traceroute_output.get("redirection_detected", False),
-            "error":
-            traceroute_output.get("error", "")
-        })
-    else:
-      results.append({"domain": domain, "error": "Domain does not exist"})
+    # 使用每个DNS服务器解析域名, 每个服务器只解析一次
+    print(f"Resolving {domain} through {len(dns_servers)} DNS servers")
+    resolved = await asyncio.gather(
+        *(resolver.resolve(domain, dns) for dns in dns_servers))
+    targets = {
+        dns: choose_target(addresses)
+        for dns, addresses in zip(dns_servers, resolved)
+    }
+    if not any(targets.values()):
+      return [{
+          "domain": domain,
+          "error": "Domain does not exist",
+          "errors": [map_traceroute_error("Domain does not exist")]
+      }]
+
+    # Servers that agree on the address share a single traceroute
+    unique_targets = list(dict.fromkeys(t for t in targets.values() if t))
+    traces = await asyncio.gather(
+        *(traceroute(engine, prober, domain, target)
+          for target in unique_targets))
+    traceroute_outputs = dict(zip(unique_targets, traces))
+
+    for dns, addresses in zip(dns_servers, resolved):
+      if targets[dns] is None:
+        # This server gave no address at all, record why
+        traceroute_output = {
+            "errors": list(dict.fromkeys(addresses["errors"].values()))
+        }
+      else:
+        traceroute_output = traceroute_outputs[targets[dns]]
+      results.append({
+          "domain":
+          domain,
+          "dns_server":
+          dns,
+          "ips":
+          traceroute_output.get("ips", {}),
+          "hops":
+          traceroute_output.get("hops", []),
+          "invalid_ips":
+          traceroute_output.get("invalid_ips", []),
+          "rst_detected":
+          traceroute_output.get("rst_detected", False),
+          "redirection_detected":
+          traceroute_output.get("redirection_detected", False),
+          "error":
+          traceroute_output.get("error", ""),
+          "errors":
+          traceroute_output.get("errors", [])
+      })
   except Exception as e:
     print(f"处理域名 {domain} 时发生错误: {e}")
     results.append({"domain": domain, "error": str(e)})
   return results
 
 
-def process_domains_concurrently(domains: list, dns_servers: list) -> list:
+async def process_domains_concurrently(domains: list, dns_servers: list,
+                                       resolver: AddressResolver) -> list:
   print("Processing domains concurrently")
   results = []
-  max_workers = 128
+  engine = TracerouteEngine()
+  # One prober per round, so RST verdicts are cached for exactly one round
+  prober = RstProber()
   try:
-    with concurrent.futures.ThreadPoolExecutor(
-        max_workers=max_workers) as executor:
-      futures = [
-          executor.submit(process_domain, domain, dns_servers)
-          for domain in domains
-      ]
-      for future in concurrent.futures.as_completed(futures):
-        results.extend(future.result())
+    for future in asyncio.as_completed([
+        process_domain(engine, prober, resolver, domain, dns_servers)
+        for domain in domains
+    ]):
+      results.extend(await future)
   except Exception as e:
     print(f"Error processing domains concurrently: {e}")
+  finally:
+    resolver.close()  # Sockets belong to this round's loop, answers are kept
+    prober.close()
+    engine.close()
   return results
 
 
 def save_to_file(results: list, date_str: str) -> None:
   filename = f'GFW_Location_results_{date_str}.csv'
-  folder_path = "D:\\Developer\\GFW-Research\\src\\Lib\\Data-2025-1\\China-Mobile\\GFWLocation"
+  folder_path = RESULTS_FOLDER
   os.makedirs(folder_path, exist_ok=True)
   filepath = os.path.join(folder_path, filename)
   print(f"Saving results to file at {filepath}")
@@ -335,7 +233,7 @@ def save_to_file(results: list, date_str: str) -> None:
       if f.tell() == 0:  # Check if file is empty to write header
         writer.writerow([
             "Domain", "DNS Server", "IPv4", "IPv6", "RST Detected",
-            "Redirection Detected", "Invalid IP", "Error"
+            "Redirection Detected", "Invalid IP", "Error", "Hop RTT"
         ])
       for result in results:
         writer.writerow([
@@ -346,13 +244,16 @@ def save_to_file(results: list, date_str: str) -> None:
             result.get("rst_detected", ""),
             result.get("redirection_detected", ""),
             ", ".join(result.get("invalid_ips", [])),
-            "; ".join(result.get("errors", []))  # 修改此行以包含映射后的错误
+            "; ".join(result.get("errors", [])),  # 修改此行以包含映射后的错误
+            # Per-hop RTT in ms, in the same order as the hops after the target
+            ", ".join(str(hop["rtt"]) for hop in result.get("hops", []))
         ])
   except Exception as e:
     print(f"Error saving results to file: {e}")
 
 
 if __name__ == "__main__":
+  compressor = BackgroundCompressor(COMPRESSION_CODEC)
   try:
     start_time = datetime.now().replace(hour=0,
                                         minute=0,
@@ -361,13 +262,16 @@ if __name__ == "__main__":
     end_time = start_time + timedelta(days=7)
     download_geoip_database()
     dns_servers = get_dns_servers()  # 获取DNS服务器列表
+    # A/AAAA answers are cached by TTL across rounds
+    resolver = AddressResolver()
 
     all_results = []
     date_str = datetime.now().strftime("%Y%m%d")
 
     while datetime.now() < end_time:
       domains = get_domains_list()
-      results = process_domains_concurrently(domains, dns_servers)
+      results = asyncio.run(
+          process_domains_concurrently(domains, dns_servers, resolver))
       all_results.extend(results)
 
       if len(all_results) >= 1500:
@@ -380,24 +284,18 @@ if __name__ == "__main__":
 
       print("Results saved to file at " +
             datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-      # After all domains are processed, compress the CSV file
-      folder_path = '../Lib/Data-2025-1/China-Mobile/GFWLocation'
-      filename = f'GFW_Location_Results_{datetime.now().strftime("%Y_%m_%d")}.csv'
-      filepath = f"{folder_path}/{filename}"
-      compressed_filepath = f"{folder_path}/{filename}.7z"
-      try:
-        with py7zr.SevenZipFile(compressed_filepath,
-                                'w',
-                                filters=[{
-                                    'id': py7zr.FILTER_LZMA2,
-                                    'preset': 9
-                                }]) as archive:
-          archive.write(filepath, arcname=filename)
-        print(f"CSV file compressed to {compressed_filepath}")
-      except Exception as e:
-        print(f"Error compressing CSV file: {e}")
+      # After all domains are processed, close off the finished CSV as a
+      # numbered segment and compress it without pausing the probing
+      if all_results:
+        save_to_file(all_results, date_str)
+        all_results = []
+      for segment in rotate_segments(RESULTS_FOLDER,
+                                     'GFW_Location_results_*.csv'):
+        compressor.submit(segment)
       sleep(3600)  # Wait for 1 hour before the next check
     if all_results:
       save_to_file(all_results, date_str)
   except Exception as e:
     print(f"Error in main execution: {e}")
+  finally:
+    compressor.close()  # Let pending archives finish
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from dns_engine import DNSEngine
+
+DNS_TIMEOUT = 5
+# Answers are kept for their TTL, clamped to these bounds (in seconds).
+MIN_CACHE_TTL = 30
+MAX_CACHE_TTL = 24 * 3600
+# Definite negative answers carry no usable TTL here, keep them briefly.
+NEGATIVE_CACHE_TTL = 300
+NEGATIVE_ERRORS = ('NXDOMAIN', 'NoAnswer')
+FAMILIES = (('A', 'ipv4'), ('AAAA', 'ipv6'))
+
+
+class AddressResolver:
+  """A/AAAA lookups through each configured resolver, cached by TTL.
+
+  Every (domain, resolver, record type) is asked at most once while its
+  answer is fresh, and concurrent callers share the query already in
+  flight. Timeouts and other failures are not cached. The cache outlives
+  the event loop, so one resolver can be kept across sweep rounds as long as
+  `close` is called before each loop goes away.
+  """
+
+  def __init__(self, timeout: float = DNS_TIMEOUT):
+    self.engine = DNSEngine(timeout)
+    self._cache = {}
+    self._inflight = {}
+
+  def _fresh(self, key: tuple) -> dict:
+    entry = self._cache.get(key)
+    if entry is None:
+      return None
+    expires, result = entry
+    if expires < time.monotonic():
+      del self._cache[key]
+      return None
+    return result
+
+  def _store(self, key: tuple, result: dict) -> None:
+    if result['answers']:
+      ttl = min(max(result['ttl'] or 0, MIN_CACHE_TTL), MAX_CACHE_TTL)
+    elif result['error_code'] in NEGATIVE_ERRORS:
+      ttl = NEGATIVE_CACHE_TTL
+    else:
+      return
+    self._cache[key] = (time.monotonic() + ttl, result)
+
+  async def lookup(self, domain: str, dns_server: str,
+                   record_type: str) -> dict:
+    """DNSEngine.query result for one record type, from cache if fresh."""
+    key = (domain, dns_server, record_type)
+    result = self._fresh(key)
+    if result is not None:
+      return result
+    task = self._inflight.get(key)
+    if task is None:
+      task = asyncio.ensure_future(
+          self.engine.query(domain, dns_server, record_type))
+      self._inflight[key] = task
+      try:
+        result = await task
+      finally:
+        self._inflight.pop(key, None)
+      self._store(key, result)
+      return result
+    return await asyncio.shield(task)
+
+  async def resolve(self, domain: str, dns_server: str) -> dict:
+    """Addresses of `domain` according to `dns_server`.
+
+    Returns {'ipv4': [...], 'ipv6': [...], 'errors': {record_type: code}}.
+    """
+    results = await asyncio.gather(*(self.lookup(domain, dns_server, rtype)
+                                     for rtype, _ in FAMILIES))
+    addresses = {'ipv4': [], 'ipv6': [], 'errors': {}}
+    for (rtype, family), result in zip(FAMILIES, results):
+      addresses[family] = result['answers']
+      if result['error_code']:
+        addresses['errors'][rtype] = result['error_code']
+    return addresses
+
+  def close(self) -> None:
+    """Close the sockets of the current event loop, keeping the cache."""
+    for task in self._inflight.values():
+      task.cancel()
+    self._inflight.clear()
+    self.engine.close()
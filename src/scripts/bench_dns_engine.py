@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import struct
+import time
+
+import dns.asyncresolver
+
+from dns_engine import DNSEngine
+
+STUB_HOST = '127.0.0.1'
+
+
+class StubDNSServer(asyncio.DatagramProtocol):
+  """Local authoritative stub used as the benchmark target.
+
+  Names starting with `nx` get NXDOMAIN, `servfail` gets SERVFAIL and every
+  other query is answered with a fixed A record. Replies are built straight
+  from the query bytes so the stub itself never becomes the bottleneck, and
+  are held back for `latency` seconds to stand in for the network round trip.
+  """
+
+  ANSWER = (b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, 300, 4) +
+            bytes([10, 0, 0, 1]))
+
+  def __init__(self, latency: float = 0.0):
+    self.latency = latency
+
+  def connection_made(self, transport):
+    self.transport = transport
+
+  def datagram_received(self, data, addr):
+    # Walk the question name to find where the question section ends, which
+    # also drops any EDNS OPT record the client put in the additional section.
+    end = 12
+    while data[end]:
+      end += data[end] + 1
+    end += 5
+    label = data[13:13 + data[12]]
+    if label.startswith(b'nx'):
+      flags, answer = 0x8183, b''
+    elif label.startswith(b'servfail'):
+      flags, answer = 0x8182, b''
+    else:
+      flags, answer = 0x8180, self.ANSWER
+    response = (data[:2] +
+                struct.pack('!HHHHH', flags, 1, 1 if answer else 0, 0, 0) +
+                data[12:end] + answer)
+    if self.latency:
+      asyncio.get_running_loop().call_later(self.latency,
+                                            self.transport.sendto, response,
+                                            addr)
+    else:
+      self.transport.sendto(response, addr)
+
+
+def serve_stub(latency: float, ready) -> None:
+  # Runs in its own process so the stub does not share a CPU with the prober.
+  async def serve():
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: StubDNSServer(latency), local_addr=(STUB_HOST, 0))
+    transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    ready.put(transport.get_extra_info('sockname')[1])
+    await asyncio.Event().wait()
+
+  asyncio.run(serve())
+
+
+def build_workload(count: int) -> list:
+  names = []
+  for i in range(count):
+    if i % 10 == 0:
+      names.append(f'nx{i}.example.com')
+    elif i % 25 == 0:
+      names.append(f'servfail{i}.example.com')
+    else:
+      names.append(f'host{i}.example.com')
+  return names
+
+
+async def run_legacy(names: list, port: int, concurrency: int) -> dict:
+  # The pre-engine implementation: a fresh Resolver for every query.
+  semaphore = asyncio.Semaphore(concurrency)
+  errors = {}
+
+  async def one(name):
+    async with semaphore:
+      resolver = dns.asyncresolver.Resolver(configure=False)
+      resolver.nameservers = [STUB_HOST]
+      resolver.port = port
+      resolver.timeout = 5
+      resolver.lifetime = 10
+      try:
+        await resolver.resolve(name, 'A')
+      except Exception as e:
+        errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+  await asyncio.gather(*(one(name) for name in names))
+  return errors
+
+
+async def run_engine(names: list, port: int, concurrency: int) -> dict:
+  engine = DNSEngine(timeout=5, port=port)
+  semaphore = asyncio.Semaphore(concurrency)
+  errors = {}
+
+  async def one(name):
+    async with semaphore:
+      result = await engine.query(name, STUB_HOST, 'A')
+      if result['error_code']:
+        errors[result['error_code']] = errors.get(result['error_code'],
+                                                  0) + 1
+
+  try:
+    await asyncio.gather(*(one(name) for name in names))
+  finally:
+    engine.close()
+  return errors
+
+
+async def main(count: int, legacy_concurrency: int, engine_concurrency: int,
+               latency: float) -> None:
+  ready = multiprocessing.Queue()
+  stub = multiprocessing.Process(target=serve_stub,
+                                 args=(latency, ready),
+                                 daemon=True)
+  stub.start()
+  port = ready.get()
+  names = build_workload(count)
+  try:
+    for label, runner, concurrency in (
+        ('legacy resolver', run_legacy, legacy_concurrency),
+        ('engine', run_engine, engine_concurrency)):
+      start = time.perf_counter()
+      errors = await runner(names, port, concurrency)
+      elapsed = time.perf_counter() - start
+      print(f"{label:>16}: {count / elapsed:10.0f} queries/s "
+            f"({elapsed:.2f}s, concurrency {concurrency}) errors={errors}")
+  finally:
+    stub.terminate()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Benchmark the DNS engine against a local stub server')
+  parser.add_argument('--queries', type=int, default=20000)
+  parser.add_argument('--legacy-concurrency', type=int, default=128)
+  parser.add_argument('--engine-concurrency', type=int, default=2048)
+  parser.add_argument('--latency',
+                      type=float,
+                      default=0.05,
+                      help='Simulated resolver round trip in seconds')
+  args = parser.parse_args()
+  asyncio.run(
+      main(args.queries, args.legacy_concurrency, args.engine_concurrency,
+           args.latency))
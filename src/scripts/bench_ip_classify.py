@@ -0,0 +1,137 @@
+import argparse
+import csv
+import os
+import re
+import time
+from ipaddress import ip_address, ip_network
+
+import numpy as np
+
+from ip_classify import INTERNAL, PRIVATE
+from result_store import fast_literal_eval
+
+DEFAULT_LIB = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                           '..', 'Lib')
+IP_CELL = re.compile(r'^[0-9A-Fa-f:.]+$')
+
+# The checks ip_classify replaced, kept here as the reference results
+MERGER_PATTERNS = [
+    r"^10\.", r"^172\.(1[6-9]|2[0-9]|3[0-1])\.", r"^192\.168\.", r"^127\.",
+    r"^0\.", r"^::1", r"^fe80", r"^fc00", r"^fd00"
+]
+
+
+def merger_regex_internal(ip: str) -> bool:
+  """Merger._format_document before ip_classify, for one address."""
+  for pattern in MERGER_PATTERNS:
+    if re.match(pattern, ip):
+      return True
+  return False
+
+
+def plot_ip_network_private(ip: str) -> bool:
+  """DNSPoisoningPlot.is_private_ip before ip_classify."""
+  private_blocks = [
+      ip_network("10.0.0.0/8"),
+      ip_network("172.16.0.0/12"),
+      ip_network("192.168.0.0/16"),
+      ip_network("127.0.0.0/8"),
+      ip_network("169.254.0.0/16"),
+      ip_network("::1/128"),
+      ip_network("fc00::/7"),
+      ip_network("fe80::/10"),
+  ]
+  try:
+    ip_addr = ip_address(ip)
+    return any(ip_addr in block for block in private_blocks)
+  except ValueError:
+    return False
+
+
+def collect_addresses(lib_folder: str, limit: int) -> list:
+  """IP addresses in the result CSVs under `lib_folder`, duplicates kept."""
+  addresses = []
+  for root, _, files in os.walk(lib_folder):
+    for name in sorted(files):
+      if not name.endswith('.csv'):
+        continue
+      with open(os.path.join(root, name), 'r', newline='',
+                encoding='utf-8') as file:
+        for row in csv.reader(file):
+          for cell in row:
+            if cell.startswith('['):
+              try:
+                values = fast_literal_eval(cell)
+              except (ValueError, SyntaxError):
+                continue
+              addresses.extend(value for value in values
+                               if isinstance(value, str)
+                               and IP_CELL.match(value))
+            elif IP_CELL.match(cell) and ('.' in cell or ':' in cell):
+              addresses.append(cell)
+          if len(addresses) >= limit:
+            return addresses[:limit]
+  return addresses
+
+
+def best_time(function, rounds: int) -> tuple:
+  best = float('inf')
+  for _ in range(rounds):
+    start = time.perf_counter()
+    result = function()
+    best = min(best, time.perf_counter() - start)
+  return best, result
+
+
+def compare(label: str, addresses: list, reference, network_set,
+            rounds: int) -> None:
+  print(f'{label}:')
+  candidates = (
+      ('previous', lambda: [reference(ip) for ip in addresses]),
+      ('NetworkSet, one by one',
+       lambda: [ip in network_set for ip in addresses]),
+      ('NetworkSet.contains_many',
+       lambda: network_set.contains_many(addresses).tolist()),
+  )
+  results = {}
+  for name, function in candidates:
+    seconds, results[name] = best_time(function, rounds)
+    print(f'  {name:>24}: {len(addresses) / seconds:12.0f} addresses/s '
+          f'({seconds:.3f}s)')
+    results[name + ' seconds'] = seconds
+  expected = results['previous']
+  for name in ('NetworkSet, one by one', 'NetworkSet.contains_many'):
+    mismatches = sorted({
+        ip for ip, a, b in zip(addresses, expected, results[name]) if a != b
+    })
+    speedup = results['previous seconds'] / results[name + ' seconds']
+    examples = f' e.g. {", ".join(mismatches[:5])}' if mismatches else ''
+    print(f'  {name}: {speedup:.1f}x, {len(mismatches)} differing '
+          f'addresses{examples}')
+
+
+def main(lib_folder: str, limit: int, rounds: int) -> None:
+  addresses = collect_addresses(lib_folder, limit)
+  if not addresses:
+    print(f'No addresses found under {lib_folder}')
+    return
+  distinct = len(set(addresses))
+  print(f'{len(addresses)} addresses ({distinct} distinct) from {lib_folder}, '
+        f'{int(np.count_nonzero(INTERNAL.contains_many(addresses)))} internal')
+  compare('Merger is_poisoned (INTERNAL)', addresses, merger_regex_internal,
+          INTERNAL, rounds)
+  compare('DNSPoisoningPlot.is_private_ip (PRIVATE)', addresses,
+          plot_ip_network_private, PRIVATE, rounds)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Benchmark ip_classify against the regex and ipaddress '
+      'checks it replaced')
+  parser.add_argument('--lib',
+                      default=DEFAULT_LIB,
+                      help='Folder of result CSVs')
+  parser.add_argument('--addresses', type=int, default=200000)
+  parser.add_argument('--rounds', type=int, default=3)
+  args = parser.parse_args()
+  main(args.lib, args.addresses, args.rounds)
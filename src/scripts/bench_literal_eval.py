@@ -0,0 +1,72 @@
+import argparse
+import ast
+import csv
+import os
+import time
+
+from result_store import fast_literal_eval
+
+DEFAULT_LIB = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                           '..', 'Lib')
+
+
+def collect_cells(lib_folder: str, limit: int) -> list:
+  """List valued cells (`[...]`) of the CSV files under `lib_folder`."""
+  cells = []
+  for root, _, files in os.walk(lib_folder):
+    for name in sorted(files):
+      if not name.endswith('.csv'):
+        continue
+      with open(os.path.join(root, name), 'r', newline='',
+                encoding='utf-8') as file:
+        for row in csv.reader(file):
+          cells.extend(cell for cell in row if cell.startswith('['))
+          if len(cells) >= limit:
+            return cells[:limit]
+  return cells
+
+
+def decode_all(decode, cells: list) -> list:
+  results = []
+  for cell in cells:
+    try:
+      results.append(decode(cell))
+    except (ValueError, SyntaxError):
+      results.append(None)
+  return results
+
+
+def main(lib_folder: str, limit: int, rounds: int) -> None:
+  cells = collect_cells(lib_folder, limit)
+  if not cells:
+    print(f'No list cells found under {lib_folder}')
+    return
+  megabytes = sum(map(len, cells)) / 1e6
+  print(f'{len(cells)} list cells ({megabytes:.1f} MB) from {lib_folder}')
+  timings = {}
+  for label, decode in (('ast.literal_eval', ast.literal_eval),
+                        ('fast_literal_eval', fast_literal_eval)):
+    best = float('inf')
+    for _ in range(rounds):
+      start = time.perf_counter()
+      results = decode_all(decode, cells)
+      best = min(best, time.perf_counter() - start)
+    timings[label] = (best, results)
+    print(f'{label:>18}: {len(cells) / best:12.0f} cells/s ({best:.2f}s)')
+  expected = timings['ast.literal_eval'][1]
+  actual = timings['fast_literal_eval'][1]
+  mismatches = sum(a != b for a, b in zip(expected, actual))
+  speedup = timings['ast.literal_eval'][0] / timings['fast_literal_eval'][0]
+  print(f'speedup {speedup:.1f}x, {mismatches} mismatching results')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Benchmark fast_literal_eval against ast.literal_eval')
+  parser.add_argument('--lib',
+                      default=DEFAULT_LIB,
+                      help='Folder of result CSVs')
+  parser.add_argument('--cells', type=int, default=100000)
+  parser.add_argument('--rounds', type=int, default=3)
+  args = parser.parse_args()
+  main(args.lib, args.cells, args.rounds)
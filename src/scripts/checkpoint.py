@@ -0,0 +1,121 @@
+import os
+from datetime import datetime, timedelta
+
+# Record tags, one per line, tab separated:
+#   S <started>                          sweep started
+#   R <round>                            round started
+#   D <round> <domain> <server> <type>   probe result is on disk
+#   C <round> <finished>                 round finished
+SEPARATOR = '\t'
+
+
+class SweepCheckpoint:
+  """Append-only log of the probes a long running sweep has finished.
+
+  Results are only recorded after they have been written to the results
+  file, so anything in the log is safe to skip after a restart and anything
+  missing from it is simply probed again. The log is rewritten (atomically)
+  on load and at every round boundary, which keeps it to at most one round
+  of entries. With a `duration`, a log whose sweep has already run its full
+  window is discarded on load and a new sweep starts.
+  """
+
+  def __init__(self, path: str, duration: timedelta = None):
+    self.path = path
+    self.duration = duration
+    self.started = None
+    self.round = 0
+    self.round_finished = None
+    self.completed = set()
+    self._file = None
+
+  def __contains__(self, item: tuple) -> bool:
+    return item in self.completed
+
+  def load(self) -> 'SweepCheckpoint':
+    if os.path.exists(self.path):
+      with open(self.path, 'r', encoding='utf-8') as log:
+        for line in log:
+          self._replay(line.rstrip('\n').split(SEPARATOR))
+    if (self.started is not None and self.duration is not None and
+        self.started + self.duration <= datetime.now()):
+      print(f"Previous sweep started {self.started} is over, starting a new one")
+      self.started = None
+      self.round = 0
+      self.round_finished = None
+      self.completed = set()
+    if self.started is None:
+      self.started = datetime.now()
+    # Rewriting drops any torn last line before new records are appended.
+    self._rewrite()
+    self._file = open(self.path, 'a', encoding='utf-8')
+    return self
+
+  def _replay(self, fields: list) -> None:
+    # A crash can leave a torn last line behind, which is just ignored.
+    try:
+      tag = fields[0]
+      if tag == 'S':
+        self.started = datetime.fromisoformat(fields[1])
+      elif tag == 'R':
+        self.round = int(fields[1])
+        self.round_finished = None
+        self.completed = set()
+      elif tag == 'D' and len(fields) == 5 and int(fields[1]) == self.round:
+        self.completed.add((fields[2], fields[3], fields[4]))
+      elif tag == 'C' and int(fields[1]) == self.round:
+        self.round_finished = datetime.fromisoformat(fields[2])
+    except (IndexError, ValueError):
+      pass
+
+  def _rewrite(self) -> None:
+    lines = [f'S{SEPARATOR}{self.started.isoformat()}',
+             f'R{SEPARATOR}{self.round}']
+    lines.extend(
+        SEPARATOR.join(('D', str(self.round)) + item)
+        for item in self.completed)
+    if self.round_finished is not None:
+      lines.append(f'C{SEPARATOR}{self.round}{SEPARATOR}'
+                   f'{self.round_finished.isoformat()}')
+    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+    temp_path = f'{self.path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as log:
+      log.write('\n'.join(lines) + '\n')
+      log.flush()
+      os.fsync(log.fileno())
+    os.replace(temp_path, self.path)
+
+  def _append(self, lines: list) -> None:
+    self._file.write(''.join(line + '\n' for line in lines))
+    self._file.flush()
+    os.fsync(self._file.fileno())
+
+  def record(self, results: list) -> None:
+    """Mark results that are already on disk as done for this round."""
+    lines = []
+    for result in results:
+      item = (result['domain'], result['dns_server'], result['record_type'])
+      self.completed.add(item)
+      lines.append(SEPARATOR.join(('D', str(self.round)) + item))
+    if lines:
+      self._append(lines)
+
+  def finish_round(self) -> None:
+    self.round_finished = datetime.now()
+    self._append([
+        f'C{SEPARATOR}{self.round}{SEPARATOR}{self.round_finished.isoformat()}'
+    ])
+
+  def start_round(self) -> None:
+    """Begin the next round, dropping the finished round's entries."""
+    self.round += 1
+    self.round_finished = None
+    self.completed = set()
+    self._file.close()
+    self._rewrite()
+    self._file = open(self.path, 'a', encoding='utf-8')
+
+  def close(self) -> None:
+    if self._file is not None:
+      self._file.close()
+      self._file = None
@@ -3,104 +3,100 @@ import csv
 import os
 from datetime import datetime, timedelta
 
-import dns.asyncresolver
+from dns_engine import DNSEngine
 from get_dns_servers import get_dns_servers
+from rate_control import MAX_WINDOW, RateController
+from result_store import ParquetResultWriter
 import py7zr
 
-# Timeout for connection attempts (in seconds)
+# Upper bound on the per-resolver adaptive timeout (in seconds)
 TIMEOUT = 30
-BATCH_SIZE = 128
-CONCURRENT_TASKS = 128
+QUEUE_SIZE = 512  # Work items buffered ahead of each resolver's workers
+CONCURRENT_TASKS = 2048  # Ceiling across all resolvers
 WRITE_THRESHOLD = 2500
+# 'parquet' appends typed row groups through result_store (needs pyarrow),
+# 'csv' keeps the original flat file format
+RESULT_FORMAT = 'csv'
 
 
-async def query_dns(domain: str, dns_server: str, record_type: str) -> dict:
-  resolver = dns.asyncresolver.Resolver()
-  resolver.nameservers = [dns_server]
-  resolver.timeout = TIMEOUT
-  resolver.lifetime = TIMEOUT + 5
+def read_domains(file_path: str):
+  with open(file_path, 'r') as file:
+    for row in csv.reader(file):
+      if row:
+        yield row[0].strip()
 
-  answers = []
-  error_code = None
-  error_reason = None
 
-  try:
-    print(f"Querying {domain} on {dns_server} for {record_type}")
-    answers = await resolver.resolve(domain, record_type)
-  except dns.resolver.Timeout:
-    error_code = 'Timeout'
-    error_reason = f"Timeout occurred for domain: {domain} on server: {dns_server}"
-  except dns.resolver.NoAnswer:
-    error_code = 'NoAnswer'
-    error_reason = f"No answer for domain: {domain} on server: {dns_server}"
-  except dns.resolver.NXDOMAIN:
-    error_code = 'NXDOMAIN'
-    error_reason = f"Non-existent domain: {domain} on server: {dns_server}"
-  except dns.resolver.YXDOMAIN:
-    error_code = 'YXDOMAIN'
-    error_reason = f"Domain name should not exist: {domain} on server: {dns_server}"
-  except dns.resolver.NoNameservers:
-    error_code = 'NoNameservers'
-    error_reason = f"No nameservers for domain: {domain} on server: {dns_server}"
-  except dns.resolver.ServFail:
-    error_code = 'ServFail'
-    error_reason = f"Server failure for domain: {domain} on server: {dns_server}"
-  except dns.resolver.Refused:
-    error_code = 'REFUSED'
-    error_reason = f"Server refused to answer for domain: {domain} on server: {dns_server}"
-  except dns.resolver.FormErr:
-    error_code = 'FORMERR'
-    error_reason = f"Format error for domain: {domain} on server: {dns_server}"
-  except Exception as e:
-    error_code = 'UnknownError'
-    error_reason = f"Unexpected error querying {domain} on {dns_server}: {e}"
-  else:
-    for rdata in answers:
-      print(f"Record: {rdata}")
-
-  return {
-      'domain': domain,
-      'dns_server': dns_server,
-      'record_type': record_type,
-      'answers': [answer.to_text() for answer in answers],
-      'error_code': error_code,
-      'error_reason': error_reason
-  }
-
-
-async def check_poisoning(domains: list, ipv4_dns_servers: list,
-                          ipv6_dns_servers: list) -> list:
-  results = []
-  semaphore = asyncio.Semaphore(CONCURRENT_TASKS)
-
-  async def sem_query_dns(domain, dns_server, record_type):
-    async with semaphore:
-      return await query_dns(domain, dns_server, record_type)
-
-  tasks = [
-      sem_query_dns(domain, dns_server, 'A') for domain in domains
+def generate_work_items(domains, dns_server: str, record_type: str):
+  for domain in domains:
+    yield domain, dns_server, record_type
+
+
+def build_lanes(file_path: str, ipv4_dns_servers: list,
+                ipv6_dns_servers: list) -> list:
+  # One lazily read pass over the domain file per resolver, so a fast resolver
+  # is never held back by a slow one and memory stays flat
+  return [
+      generate_work_items(read_domains(file_path), dns_server, 'A')
       for dns_server in ipv4_dns_servers
   ] + [
-      sem_query_dns(domain, dns_server, 'AAAA') for domain in domains
+      generate_work_items(read_domains(file_path), dns_server, 'AAAA')
       for dns_server in ipv6_dns_servers
   ]
 
-  for future in asyncio.as_completed(tasks):
-    try:
-      dns_results = await future
-      results.append(dns_results)
-    except Exception as e:
-      error_folder_path = '/home/lhengyi/Developer/GFW-Research/Lib/CompareGroup/Error'
-      os.makedirs(error_folder_path, exist_ok=True)
-      error_filename = f"ErrorDomains_{datetime.now().strftime('%Y_%m_%d')}.txt"
-      error_filepath = os.path.join(error_folder_path, error_filename)
-      with open(error_filepath, "a") as error_file:
-        error_file.write(f"Error querying domain with server: {e}\n")
 
-  return results
-
-
-def save_results(results: list, is_first_write=False) -> None:
+def log_query_error(error: Exception) -> None:
+  error_folder_path = '/home/lhengyi/Developer/GFW-Research/Lib/CompareGroup/Error'
+  os.makedirs(error_folder_path, exist_ok=True)
+  error_filename = f"ErrorDomains_{datetime.now().strftime('%Y_%m_%d')}.txt"
+  error_filepath = os.path.join(error_folder_path, error_filename)
+  with open(error_filepath, "a") as error_file:
+    error_file.write(f"Error querying domain with server: {error}\n")
+
+
+async def check_poisoning(engine: DNSEngine, controller: RateController,
+                          lanes: list, handle_result) -> int:
+  """Probe every resolver lane through its own bounded queue.
+
+  Each lane is drained by up to MAX_WINDOW workers, but the resolver's
+  RateController budget decides how many of them have a query in flight, so
+  a slow or rate-limiting resolver only ever ties up its own workers.
+  Each result is passed to `handle_result` as soon as it arrives.
+  """
+  completed = 0
+
+  async def run_lane(work_items):
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    async def produce():
+      for item in work_items:
+        await queue.put(item)
+      for _ in range(MAX_WINDOW):
+        await queue.put(None)  # One stop marker per worker
+
+    async def consume():
+      nonlocal completed
+      while True:
+        item = await queue.get()
+        if item is None:
+          return
+        try:
+          handle_result(await controller.query(engine, *item))
+          completed += 1
+        except Exception as e:
+          log_query_error(e)
+
+    await asyncio.gather(produce(), *(consume() for _ in range(MAX_WINDOW)))
+
+  await asyncio.gather(*(run_lane(work_items) for work_items in lanes))
+  return completed
+
+
+def save_results(results: list,
+                 is_first_write=False,
+                 result_writer=None) -> None:
+  if result_writer is not None:
+    result_writer.write(results)
+    return
   filename = f'DNS_Checking_Result_{datetime.now().strftime("%Y_%m_%d")}.csv'
   folder_path = '/home/lhengyi/Developer/GFW-Research/Lib/CompareGroup/DNSPoisoning'
   os.makedirs(folder_path, exist_ok=True)
@@ -138,6 +134,8 @@ def save_results(results: list, is_first_write=False) -> None:
 
 
 async def main():
+  engine = None
+  result_writer = None
   try:
     ipv4_dns_servers, ipv6_dns_servers = get_dns_servers()
     file_path = os.path.join(
@@ -145,52 +143,64 @@ async def main():
         '/home/lhengyi/Developer/GFW-Research/src/Import/domains_list.csv'
     )
 
-    with open(file_path, 'r') as file:
-      reader = csv.reader(file)
-      domains = [row[0].strip() for row in reader]
-
-    print(f"Checking {len(domains)} domains for DNS poisoning")
-
     is_first_write = True  # Initialize is_first_write
+    engine = DNSEngine(TIMEOUT)  # One socket per resolver for the whole run
+    controller = RateController(TIMEOUT, CONCURRENT_TASKS)
+    if RESULT_FORMAT == 'parquet':
+      result_writer = ParquetResultWriter(
+          '/home/lhengyi/Developer/GFW-Research/Lib/CompareGroup/DNSPoisoning')
     all_results = []  # Collect all results here
-    for i in range(0, len(domains), BATCH_SIZE):
-      batch = domains[i:i + BATCH_SIZE]
-      results = await check_poisoning(batch, ipv4_dns_servers,
-                                      ipv6_dns_servers)
-      all_results.extend(results)  # Append batch results to all_results
 
+    def collect(result):
+      nonlocal is_first_write
+      all_results.append(result)
       if len(all_results) >= WRITE_THRESHOLD:
-        save_results(all_results, is_first_write=is_first_write)
+        save_results(all_results,
+                     is_first_write=is_first_write,
+                     result_writer=result_writer)
         is_first_write = False  # After the first write, always append
         all_results.clear(
         )  # Clear results after saving to prepare for the next batch
 
+    lanes = build_lanes(file_path, ipv4_dns_servers, ipv6_dns_servers)
+    completed = await check_poisoning(engine, controller, lanes, collect)
+    print(f"Checked {completed} queries for DNS poisoning")
+    for budget in controller.summary():
+      print(budget)
     print(f"All batches completed at {datetime.now()}")
 
     # Save remaining results to CSV after all batches are processed
     if all_results:
-      save_results(all_results, is_first_write=is_first_write)
+      save_results(all_results,
+                   is_first_write=is_first_write,
+                   result_writer=result_writer)
       is_first_write = False  # After the first write, always append
       all_results.clear()  # Clear results after saving
-      # After all domains are processed, compress the CSV file
-      folder_path = '/home/lhengyi/Developer/GFW-Research/Lib/Data-CompareGroup/DNSPoisoning'
-      filename = f'DNS_Checking_Result_{datetime.now().strftime("%Y_%m_%d")}.csv'
-      filepath = f"{folder_path}/{filename}"
-      compressed_filepath = f"{folder_path}/{filename}.7z"
-      try:
-        with py7zr.SevenZipFile(compressed_filepath,
-                                'w',
-                                filters=[{
-                                    'id': py7zr.FILTER_LZMA2,
-                                    'preset': 9
-                                }]) as archive:
-          archive.write(filepath, arcname=filename)
-        print(f"CSV file compressed to {compressed_filepath}")
-      except Exception as e:
-        print(f"Error compressing CSV file: {e}")
+      if result_writer is None:
+        # After all domains are processed, compress the CSV file
+        folder_path = '/home/lhengyi/Developer/GFW-Research/Lib/Data-CompareGroup/DNSPoisoning'
+        filename = f'DNS_Checking_Result_{datetime.now().strftime("%Y_%m_%d")}.csv'
+        filepath = f"{folder_path}/{filename}"
+        compressed_filepath = f"{folder_path}/{filename}.7z"
+        try:
+          with py7zr.SevenZipFile(compressed_filepath,
+                                  'w',
+                                  filters=[{
+                                      'id': py7zr.FILTER_LZMA2,
+                                      'preset': 9
+                                  }]) as archive:
+            archive.write(filepath, arcname=filename)
+          print(f"CSV file compressed to {compressed_filepath}")
+        except Exception as e:
+          print(f"Error compressing CSV file: {e}")
       await asyncio.sleep(3600)  # Wait for 1 hour before the next check
   except Exception as e:
     print(f"Error in main execution: {e}")
+  finally:
+    if engine is not None:
+      engine.close()
+    if result_writer is not None:
+      result_writer.close()
 
 
 if __name__ == "__main__":
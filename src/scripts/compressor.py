@@ -0,0 +1,97 @@
+import glob
+import multiprocessing
+import os
+
+import py7zr
+
+# Files up to this size get LZMA2 preset 9, larger ones a cheaper preset so a
+# single archive never takes longer than the pause between two rounds.
+LZMA_PRESETS = [(64 * 1024 * 1024, 9), (512 * 1024 * 1024, 6), (None, 3)]
+ZSTD_LEVEL = 3
+
+
+def choose_filters(size: int, codec: str = 'lzma') -> list:
+  """py7zr filter chain for a file of `size` bytes.
+
+  'lzma' scales the preset down with the size, 'zstd' trades ratio for
+  several times the speed, and 'auto' uses LZMA for small files and zstd
+  once a file no longer fits the smallest LZMA bucket.
+  """
+  if codec == 'auto':
+    codec = 'lzma' if size <= LZMA_PRESETS[0][0] else 'zstd'
+  if codec == 'zstd':
+    return [{'id': py7zr.FILTER_ZSTD, 'level': ZSTD_LEVEL}]
+  for limit, preset in LZMA_PRESETS:
+    if limit is None or size <= limit:
+      return [{'id': py7zr.FILTER_LZMA2, 'preset': preset}]
+
+
+def compress_file(filepath: str, codec: str = 'lzma') -> str:
+  compressed_filepath = f"{filepath}.7z"
+  temp_filepath = f"{compressed_filepath}.tmp"
+  filters = choose_filters(os.path.getsize(filepath), codec)
+  with py7zr.SevenZipFile(temp_filepath, 'w', filters=filters) as archive:
+    archive.write(filepath, arcname=os.path.basename(filepath))
+  # Never leave a half written archive under the final name
+  os.replace(temp_filepath, compressed_filepath)
+  return compressed_filepath
+
+
+def _compress_worker(queue, codec: str) -> None:
+  if hasattr(os, 'nice'):
+    os.nice(10)  # Stay out of the way of the probing process
+  while True:
+    filepath = queue.get()
+    if filepath is None:
+      return
+    try:
+      print(f"CSV file compressed to {compress_file(filepath, codec)}")
+    except Exception as e:
+      print(f"Error compressing CSV file {filepath}: {e}")
+
+
+def rotate_segment(filepath: str) -> str:
+  """Rename a finished results file to the next free `.partN` name.
+
+  The prober keeps appending to the unnumbered file, so only renamed
+  segments are ever handed to the compressor.
+  """
+  root, ext = os.path.splitext(filepath)
+  part = 1
+  while os.path.exists(f"{root}.part{part}{ext}"):
+    part += 1
+  segment = f"{root}.part{part}{ext}"
+  os.replace(filepath, segment)
+  return segment
+
+
+def rotate_segments(folder_path: str, pattern: str) -> list:
+  """Rotate every active file in `folder_path` matching `pattern`."""
+  segments = []
+  for filepath in sorted(glob.glob(os.path.join(folder_path, pattern))):
+    if '.part' not in os.path.basename(filepath):
+      segments.append(rotate_segment(filepath))
+  return segments
+
+
+class BackgroundCompressor:
+  """Compress finished result segments in a separate worker process.
+
+  `submit` only puts a path on a queue, so neither the event loop nor the
+  probing threads wait for py7zr. `close` waits for the queue to drain.
+  """
+
+  def __init__(self, codec: str = 'lzma'):
+    self.codec = codec
+    self._queue = multiprocessing.Queue()
+    self._process = multiprocessing.Process(target=_compress_worker,
+                                            args=(self._queue, codec),
+                                            daemon=True)
+    self._process.start()
+
+  def submit(self, filepath: str) -> None:
+    self._queue.put(filepath)
+
+  def close(self) -> None:
+    self._queue.put(None)
+    self._process.join()
@@ -0,0 +1,327 @@
+import asyncio
+import random
+import socket
+import struct
+
+import dns.asyncquery
+import dns.exception
+import dns.ipv6
+import dns.message
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+
+# Transaction IDs are 16 bit, so one socket can never have more than this
+# many queries outstanding against the same resolver.
+MAX_PENDING_PER_SERVER = 60000
+# Large enough to absorb a burst of replies to thousands of queries.
+SOCKET_RECEIVE_BUFFER = 4 * 1024 * 1024
+# Longest CNAME chain followed before giving up, same bound as dnspython.
+MAX_CHAIN = 16
+
+HEADER = struct.Struct('!HHHHHH')
+RR_FIXED = struct.Struct('!HHIH')
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+TYPE_CNAME = 5
+ADDRESS_FORMATTERS = {
+    dns.rdatatype.A: lambda rdata: socket.inet_ntop(socket.AF_INET, rdata),
+    dns.rdatatype.AAAA: dns.ipv6.inet_ntoa,
+}
+
+# The labels the dnspython resolver gave each rcode. With a single
+# nameserver it raised NoNameservers for every other rcode, SERVFAIL, REFUSED
+# and FORMERR included, so those stay 'NoNameservers' (the rcode is kept in
+# the reason) and the results line up with every earlier sweep.
+RCODE_ERRORS = {
+    dns.rcode.NXDOMAIN: ('NXDOMAIN', 'Non-existent domain'),
+    dns.rcode.YXDOMAIN: ('YXDOMAIN', 'Domain name should not exist'),
+}
+
+
+def _read_name(data: bytes, offset: int) -> tuple:
+  """Decode a possibly compressed owner name into lowercase wire labels."""
+  labels = []
+  end = None
+  for _ in range(128):
+    length = data[offset]
+    if length == 0:
+      return b'.'.join(labels).lower(), offset + 1 if end is None else end
+    if length & 0xC0 == 0xC0:
+      if end is None:
+        end = offset + 2
+      offset = ((length & 0x3F) << 8) | data[offset + 1]
+    else:
+      labels.append(data[offset + 1:offset + 1 + length])
+      offset += length + 1
+  raise ValueError('Compression loop in DNS name')
+
+
+def parse_response(data: bytes, rdtype: int) -> tuple:
+  """Pull (rcode, flags, answers, ttl) out of a raw A/AAAA response.
+
+  Follows the CNAME chain from the question name the way
+  `dns.message.Message.resolve_chaining` does, but without building a full
+  message object. Raises ValueError for anything it does not understand so
+  the caller can fall back to dnspython.
+  """
+  if rdtype not in ADDRESS_FORMATTERS:
+    raise ValueError('Unsupported record type')
+  _, flags, qdcount, ancount, _, _ = HEADER.unpack_from(data)
+  if qdcount != 1:
+    raise ValueError('Unexpected question count')
+  qname, offset = _read_name(data, 12)
+  offset += 4
+  records = []
+  for _ in range(ancount):
+    owner, offset = _read_name(data, offset)
+    rtype, _, ttl, rdlength = RR_FIXED.unpack_from(data, offset)
+    offset += RR_FIXED.size
+    if offset + rdlength > len(data):
+      raise ValueError('Truncated resource record')
+    records.append((owner, rtype, ttl, offset, rdlength))
+    offset += rdlength
+
+  name = qname
+  chain_ttl = None
+  for _ in range(MAX_CHAIN):
+    matches = [r for r in records if r[0] == name and r[1] == rdtype]
+    if matches:
+      format_rdata = ADDRESS_FORMATTERS[rdtype]
+      answers = [format_rdata(data[r[3]:r[3] + r[4]]) for r in matches]
+      ttl = min(r[2] for r in matches)
+      if chain_ttl is not None:
+        ttl = min(ttl, chain_ttl)
+      return flags & 0xF, flags, answers, ttl
+    cname = next((r for r in records if r[0] == name and r[1] == TYPE_CNAME),
+                 None)
+    if cname is None:
+      break
+    chain_ttl = cname[2] if chain_ttl is None else min(chain_ttl, cname[2])
+    name, _ = _read_name(data, cname[3])
+  return flags & 0xF, flags, [], None
+
+
+def render_query(domain: str, record_type: str) -> bytes:
+  """Render a recursive query for `domain` with a zero transaction ID.
+
+  Plain ASCII names are encoded directly, which is several times cheaper than
+  going through `dns.message.make_query`. Anything else is left to dnspython.
+  """
+  rdtype = dns.rdatatype.from_text(record_type)
+  labels = domain.rstrip('.').split('.')
+  if domain.isascii() and all(0 < len(label) < 64 for label in labels):
+    qname = b''.join(
+        bytes([len(label)]) + label.encode() for label in labels) + b'\0'
+    if len(qname) <= 255:
+      return (HEADER.pack(0, FLAG_RD, 1, 0, 0, 0) + qname +
+              struct.pack('!HH', rdtype, dns.rdataclass.IN))
+  query = dns.message.make_query(domain, rdtype)
+  query.id = 0
+  return query.to_wire()
+
+
+def parse_message(response: dns.message.Message) -> tuple:
+  """Slow path of `parse_response` for messages dnspython has parsed."""
+  answers = []
+  ttl = None
+  if response.rcode() == dns.rcode.NOERROR:
+    chain = response.resolve_chaining()
+    if chain.answer is not None:
+      answers = [rdata.to_text() for rdata in chain.answer]
+      ttl = chain.minimum_ttl
+  return response.rcode(), response.flags, answers, ttl
+
+
+class _ResolverProtocol(asyncio.DatagramProtocol):
+  """UDP endpoint shared by every query sent to one resolver.
+
+  Replies are matched back to their query by DNS transaction ID and question,
+  so a single socket can carry thousands of in-flight queries.
+  """
+
+  def __init__(self):
+    self.transport = None
+    self.pending = {}
+
+  def connection_made(self, transport):
+    self.transport = transport
+
+  def datagram_received(self, data, addr):
+    if len(data) < 12:
+      return  # Shorter than a DNS header
+    entry = self.pending.get(int.from_bytes(data[:2], 'big'))
+    if entry is None:
+      return  # Late reply for a query that already timed out
+    question, future = entry
+    if future.done() or not data[2] & 0x80:
+      return
+    # The question is echoed back verbatim (modulo case), anything else is a
+    # reply to a different query that happened to reuse the ID.
+    if data[12:12 + len(question)].lower() != question:
+      return
+    future.set_result(data)
+
+  def error_received(self, exc):
+    # ICMP errors on a connected UDP socket carry no transaction ID, so every
+    # outstanding query on this socket is failed with the same error.
+    for _, future in self.pending.values():
+      if not future.done():
+        future.set_exception(exc)
+
+  def connection_lost(self, exc):
+    for _, future in self.pending.values():
+      if not future.done():
+        future.set_exception(exc or ConnectionError('Socket closed'))
+    self.pending.clear()
+
+
+class ResolverChannel:
+  """One long-lived UDP socket to a single resolver."""
+
+  def __init__(self, server: str, port: int = 53):
+    self.server = server
+    self.port = port
+    self.protocol = None
+    self._slots = asyncio.Semaphore(MAX_PENDING_PER_SERVER)
+    self._lock = asyncio.Lock()
+
+  async def _ensure_open(self) -> _ResolverProtocol:
+    protocol = self.protocol
+    if protocol is not None and not protocol.transport.is_closing():
+      return protocol
+    async with self._lock:
+      if self.protocol is None or self.protocol.transport.is_closing():
+        loop = asyncio.get_running_loop()
+        transport, self.protocol = await loop.create_datagram_endpoint(
+            _ResolverProtocol, remote_addr=(self.server, self.port))
+        sock = transport.get_extra_info('socket')
+        try:
+          sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                          SOCKET_RECEIVE_BUFFER)
+        except OSError:
+          pass  # Keep the system default if the limit is lower
+      return self.protocol
+
+  def _allocate_id(self, protocol: _ResolverProtocol) -> int:
+    while True:
+      query_id = random.getrandbits(16)
+      if query_id not in protocol.pending:
+        return query_id
+
+  async def exchange(self, wire: bytes, timeout: float) -> bytes:
+    async with self._slots:
+      protocol = await self._ensure_open()
+      query_id = self._allocate_id(protocol)
+      future = asyncio.get_running_loop().create_future()
+      protocol.pending[query_id] = (wire[12:].lower(), future)
+      try:
+        # Only the transaction ID differs between queries for the same
+        # question, so patch it into the pre-rendered wire.
+        protocol.transport.sendto(query_id.to_bytes(2, 'big') + wire[2:])
+        return await asyncio.wait_for(future, timeout)
+      finally:
+        protocol.pending.pop(query_id, None)
+
+  def close(self) -> None:
+    if self.protocol is not None and self.protocol.transport is not None:
+      self.protocol.transport.close()
+    self.protocol = None
+
+
+class DNSEngine:
+  """Pool of resolver channels used by the DNS poisoning prober.
+
+  `query` returns the same result dict as the old per-query Resolver based
+  implementation, including its error taxonomy, but reuses one socket per
+  resolver instead of building a new resolver for every lookup.
+  """
+
+  def __init__(self, timeout: float, port: int = 53):
+    self.timeout = timeout
+    self.port = port
+    self.channels = {}
+    self._questions = {}
+
+  def channel(self, dns_server: str) -> ResolverChannel:
+    channel = self.channels.get(dns_server)
+    if channel is None:
+      channel = ResolverChannel(dns_server, self.port)
+      self.channels[dns_server] = channel
+    return channel
+
+  def _question(self, domain: str, record_type: str) -> bytes:
+    # The same question goes to every resolver, so render it only once.
+    key = (domain, record_type)
+    wire = self._questions.get(key)
+    if wire is None:
+      wire = render_query(domain, record_type)
+      self._questions[key] = wire
+    return wire
+
+  async def _exchange(self, domain: str, record_type: str, dns_server: str,
+                      timeout: float) -> tuple:
+    wire = self._question(domain, record_type)
+    data = await self.channel(dns_server).exchange(wire, timeout)
+    try:
+      parsed = parse_response(data, dns.rdatatype.from_text(record_type))
+    except (ValueError, IndexError, struct.error):
+      parsed = parse_message(dns.message.from_wire(data))
+    if parsed[1] & FLAG_TC:
+      # Truncated over UDP, retry the same question over TCP like the stub
+      # resolver would.
+      query = dns.message.make_query(domain, record_type)
+      response = await dns.asyncquery.tcp(query,
+                                          dns_server,
+                                          timeout=timeout,
+                                          port=self.port)
+      parsed = parse_message(response)
+    return parsed
+
+  async def query(self,
+                  domain: str,
+                  dns_server: str,
+                  record_type: str,
+                  timeout: float = None) -> dict:
+    timeout = self.timeout if timeout is None else timeout
+    answers = []
+    ttl = None
+    error_code = None
+    error_reason = None
+
+    try:
+      rcode, _, answers, ttl = await self._exchange(domain, record_type,
+                                                    dns_server, timeout)
+      if rcode == dns.rcode.NOERROR:
+        if not answers:
+          error_code = 'NoAnswer'
+          error_reason = f"No answer for domain: {domain} on server: {dns_server}"
+      elif rcode in RCODE_ERRORS:
+        error_code, reason = RCODE_ERRORS[rcode]
+        error_reason = f"{reason} for domain: {domain} on server: {dns_server}"
+      else:
+        error_code = 'NoNameservers'
+        error_reason = (f"No nameservers for domain: {domain} on server: "
+                        f"{dns_server} ({dns.rcode.to_text(rcode)})")
+    except (asyncio.TimeoutError, dns.exception.Timeout):
+      error_code = 'Timeout'
+      error_reason = f"Timeout occurred for domain: {domain} on server: {dns_server}"
+    except Exception as e:
+      error_code = 'UnknownError'
+      error_reason = f"Unexpected error querying {domain} on {dns_server}: {e}"
+
+    return {
+        'domain': domain,
+        'dns_server': dns_server,
+        'record_type': record_type,
+        'answers': answers,
+        'ttl': ttl,
+        'error_code': error_code,
+        'error_reason': error_reason
+    }
+
+  def close(self) -> None:
+    for channel in self.channels.values():
+      channel.close()
+    self.channels.clear()
+    self._questions.clear()
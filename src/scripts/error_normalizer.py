@@ -0,0 +1,123 @@
+from collections import Counter
+
+# Traceroute messages (Windows tracert wording, also what traceroute_engine
+# reports) and their canonical error codes
+TRACEROUTE_ERRORS = {
+    'Traceroute timed out': 'Timeout',
+    'No Answer': 'NoAnswer',
+    'Traceroute Failed': 'Failed',
+    'Not Found': 'NotFound',
+    'Network Unreachable': 'NetworkUnreachable',
+    'Host Unreachable': 'HostUnreachable',
+    'Protocol Unreachable': 'ProtocolUnreachable',
+    'Port Unreachable': 'PortUnreachable',
+    'Fragmentation Needed': 'FragmentationNeeded',
+    'Source Route Failed': 'SourceRouteFailed',
+    'Destination Network Unknown': 'DestinationNetworkUnknown',
+    'Destination Host Unknown': 'DestinationHostUnknown',
+    'Source Host Isolated': 'SourceHostIsolated',
+    'Communication with Destination Network Administratively Prohibited':
+    'CommunicationWithDestinationNetworkAdministrativelyProhibited',
+    'Communication with Destination Host Administratively Prohibited':
+    'CommunicationWithDestinationHostAdministrativelyProhibited',
+    'Destination Network Unreachable for Type of Service':
+    'DestinationNetworkUnreachableForTypeOfService',
+    'Destination Host Unreachable for Type of Service':
+    'DestinationHostUnreachableForTypeOfService',
+    'Communication Administratively Prohibited':
+    'CommunicationAdministrativelyProhibited',
+    'Host Precedence Violation': 'HostPrecedenceViolation',
+    'Precedence cutoff in effect': 'PrecedenceCutoffInEffect',
+    'Domain does not exist': 'DomainDoesNotExist',
+}
+
+# dnspython error lines: (code, reason, substrings that identify it). When a
+# line contains several, the rule listed first wins.
+DNS_ERROR_RULES = (
+    ('NXDOMAIN', 'Domain does not exist',
+     ('NXDOMAIN', 'The DNS query name does not exist')),
+    ('REFUSED', 'Query refused by server', ('REFUSED', )),
+    ('FORMERR', 'Format error', ('FORMERR', )),
+    ('SERVFAIL', 'Server failed to respond', ('SERVFAIL', )),
+    ('Timed out', 'The DNS operation timed out',
+     ('timed out', 'The resolution lifetime expired')),
+    ('YXDOMAIN', 'Domain exists but should not', ('YXDOMAIN', )),
+    ('YXRRSET', 'Resource record set exists but should not', ('YXRRSET', )),
+    ('NOTIMP', 'Query not implemented by server', ('NOTIMP', )),
+    ('NOTAUTH', 'Server not authoritative for zone', ('NOTAUTH', )),
+)
+DNS_ERROR_REASONS = {code: reason for code, reason, _ in DNS_ERROR_RULES}
+
+
+class ErrorNormalizer:
+  """
+    Raw error message -> canonical error code, counting every code returned.
+
+    `rules` is a sequence of (code, messages). With `exact`, a message must
+    equal one of `messages` (one dict lookup). Otherwise it may contain one
+    anywhere, and the first rule (in `rules` order) with a match wins. That
+    is a plain `in` per (message, text) pair in one table loop: for a dozen
+    literals CPython's substring search beats one regex alternation of them
+    several times over, and an alternation would return the leftmost match
+    rather than the first rule.
+
+    `classify(message, default)` takes strings only; `normalize` also
+    accepts anything else. Both tally the codes they return in `counts`.
+    """
+
+  def __init__(self, rules, default=None, exact: bool = False):
+    self.default = default
+    self.exact = exact
+    self.counts = Counter()
+    self._rules = [(code, tuple(messages)) for code, messages in rules]
+    if exact:
+      self._lookup = {
+          message: code
+          for code, messages in self._rules for message in messages
+      }
+    else:
+      self._lookup = {code: code for code, _ in self._rules}
+    # Flattened in rule order for the scan
+    self._texts = tuple(
+        (text, code) for code, texts in self._rules for text in texts)
+
+  def __repr__(self) -> str:
+    return f'ErrorNormalizer({len(self._rules)} codes, default={self.default!r})'
+
+  def classify(self, message: str, default=None, code=None):
+    """
+      Canonical code of `message`, `default` if none. A `code` the caller
+      already extracted (say the word after "answered") is looked up first,
+      the rules only run when it is unknown.
+      """
+    found = self._lookup.get(code if code is not None else message)
+    if found is None and not self.exact:
+      for text, rule_code in self._texts:
+        if text in message:
+          found = rule_code
+          break
+    if found is None:
+      found = default
+    if found is not None:
+      self.counts[found] += 1
+    return found
+
+  def normalize(self, message, default=...):
+    """Canonical code of `message`, `default` (the normalizer's) if none."""
+    if default is ...:
+      default = self.default
+    if not isinstance(message, str):
+      if default is not None:
+        self.counts[default] += 1
+      return default
+    return self.classify(message, default)
+
+  __call__ = normalize
+
+
+TRACEROUTE = ErrorNormalizer(
+    [(code, [message]) for message, code in TRACEROUTE_ERRORS.items()],
+    default='UnknownError',
+    exact=True)
+DNS = ErrorNormalizer([(code, messages)
+                       for code, _, messages in DNS_ERROR_RULES])
@@ -0,0 +1,68 @@
+import functools
+import os
+import threading
+
+import geoip2.database
+import geoip2.errors
+
+GEOIP_DB_PATH = os.path.join(os.path.dirname(__file__),
+                             "../Import/GeoLite2-City.mmdb")
+# Distinct hop IPs seen in a sweep comfortably fit, at ~200 bytes an entry.
+CACHE_SIZE = 262144
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def get_reader(path: str = GEOIP_DB_PATH) -> geoip2.database.Reader:
+  """Process-wide GeoLite2 reader, memory-mapped and opened only once."""
+  global _reader
+  if _reader is None:
+    with _reader_lock:
+      if _reader is None:
+        _reader = geoip2.database.Reader(path,
+                                         mode=geoip2.database.MODE_MMAP)
+  return _reader
+
+
+def close_reader() -> None:
+  global _reader
+  with _reader_lock:
+    if _reader is not None:
+      _reader.close()
+      _reader = None
+  locate.cache_clear()
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def locate(ip: str) -> tuple:
+  """(country, region, city) for `ip`, or None if it is not in the database.
+
+  Raises ValueError for strings that are not IP addresses; those are not
+  cached.
+  """
+  try:
+    response = get_reader().city(ip)
+  except geoip2.errors.AddressNotFoundError:
+    return None
+  country = response.country.name
+  region = response.subdivisions.most_specific.name if response.subdivisions else "Unknown"
+  city = response.city.name if response.city.name else "Unknown"
+  return country, region, city
+
+
+def lookup_ips(ips) -> dict:
+  """Geolocate many IPs at once, looking each distinct address up once.
+
+  Returns {ip: (country, region, city) or None}. Invalid addresses map to
+  None as well, so one bad hop does not fail the whole batch.
+  """
+  locations = {}
+  for ip in ips:
+    if ip in locations:
+      continue
+    try:
+      locations[ip] = locate(ip)
+    except ValueError:
+      locations[ip] = None
+  return locations
@@ -0,0 +1,177 @@
+import bisect
+import ipaddress
+import socket
+
+import numpy as np
+
+# Addresses a resolver inside China must not answer with: the Merger marks a
+# result poisoned when any of its IPs is in one of these.
+INTERNAL_NETWORKS = (
+    '10.0.0.0/8',
+    '172.16.0.0/12',
+    '192.168.0.0/16',
+    '127.0.0.0/8',
+    '0.0.0.0/8',
+    '::1/128',
+    'fe80::/10',
+    'fc00::/7',
+)
+# Private, loopback and link local, as the plots count them inaccessible
+PRIVATE_NETWORKS = (
+    '10.0.0.0/8',
+    '172.16.0.0/12',
+    '192.168.0.0/16',
+    '127.0.0.0/8',
+    '169.254.0.0/16',
+    '::1/128',
+    'fc00::/7',
+    'fe80::/10',
+)
+# Not routable on the public internet (RFC 6890 special purpose, multicast
+# and reserved space); a DNS answer in here is never a real server.
+BOGON_NETWORKS = (
+    '0.0.0.0/8',
+    '10.0.0.0/8',
+    '100.64.0.0/10',
+    '127.0.0.0/8',
+    '169.254.0.0/16',
+    '172.16.0.0/12',
+    '192.0.0.0/24',
+    '192.0.2.0/24',
+    '192.168.0.0/16',
+    '198.18.0.0/15',
+    '198.51.100.0/24',
+    '203.0.113.0/24',
+    '224.0.0.0/4',
+    '240.0.0.0/4',
+    '::/128',
+    '::1/128',
+    '::ffff:0:0/96',
+    '100::/64',
+    '2001:db8::/32',
+    'fc00::/7',
+    'fe80::/10',
+    'ff00::/8',
+)
+
+_V4_SIZE = 4
+_V6_SIZE = 16
+_LOW_64 = (1 << 64) - 1
+
+
+def _pack(address) -> bytes:
+  """Packed bytes of an IPv4 or IPv6 address string, b'' if invalid."""
+  if not isinstance(address, str):
+    return b''
+  address = address.strip()
+  family = socket.AF_INET6 if ':' in address else socket.AF_INET
+  try:
+    return socket.inet_pton(family, address)
+  except (OSError, ValueError):
+    return b''
+
+
+def pack_addresses(addresses) -> tuple:
+  """
+    Integer arrays of `addresses` (strings): (versions, ipv4, ipv6_high,
+    ipv6_low). versions is 4, 6 or 0 for an invalid address; ipv4 holds
+    uint32 values, the IPv6 halves uint64 values; unused slots are 0.
+    """
+  packed = [_pack(address) for address in addresses]
+  sizes = np.fromiter((len(data) for data in packed), dtype=np.uint8,
+                      count=len(packed))
+  versions = np.where(sizes == _V4_SIZE, 4,
+                      np.where(sizes == _V6_SIZE, 6, 0)).astype(np.uint8)
+  ipv4 = np.zeros(len(packed), dtype=np.uint32)
+  v4_index = np.flatnonzero(versions == 4)
+  if len(v4_index):
+    ipv4[v4_index] = np.frombuffer(
+        b''.join(packed[i] for i in v4_index), dtype='>u4')
+  high = np.zeros(len(packed), dtype=np.uint64)
+  low = np.zeros(len(packed), dtype=np.uint64)
+  v6_index = np.flatnonzero(versions == 6)
+  if len(v6_index):
+    halves = np.frombuffer(b''.join(packed[i] for i in v6_index),
+                           dtype='>u8').reshape(-1, 2)
+    high[v6_index] = halves[:, 0]
+    low[v6_index] = halves[:, 1]
+  return versions, ipv4, high, low
+
+
+class NetworkSet:
+  """
+    Membership test for a fixed set of networks, built once.
+
+    IPv4 networks become merged, sorted [first, last] uint32 ranges,
+    searched with bisect (one address) or np.searchsorted (an array).
+    IPv6 networks are kept as 128-bit (value, mask) prefixes, split into
+    uint64 halves for the array version.
+    """
+
+  def __init__(self, networks):
+    networks = [ipaddress.ip_network(network) for network in networks]
+    ranges = sorted((int(network.network_address),
+                     int(network.broadcast_address))
+                    for network in networks if network.version == 4)
+    merged = []
+    for first, last in ranges:
+      if merged and first <= merged[-1][1] + 1:
+        merged[-1][1] = max(merged[-1][1], last)
+      else:
+        merged.append([first, last])
+    self.networks = tuple(str(network) for network in networks)
+    self._v4_first = [first for first, _ in merged]
+    self._v4_last = [last for _, last in merged]
+    self._v4_first_array = np.array(self._v4_first, dtype=np.uint32)
+    self._v4_last_array = np.array(self._v4_last, dtype=np.uint32)
+    self._v6 = [(int(network.network_address), int(network.netmask))
+                for network in networks if network.version == 6]
+    self._v6_arrays = [
+        (np.uint64(value >> 64), np.uint64(value & _LOW_64),
+         np.uint64(mask >> 64), np.uint64(mask & _LOW_64))
+        for value, mask in self._v6
+    ]
+
+  def __repr__(self) -> str:
+    return f'NetworkSet({self.networks!r})'
+
+  def __contains__(self, address) -> bool:
+    packed = _pack(address)
+    if len(packed) == _V4_SIZE:
+      value = int.from_bytes(packed, 'big')
+      index = bisect.bisect_right(self._v4_first, value) - 1
+      return index >= 0 and value <= self._v4_last[index]
+    if len(packed) == _V6_SIZE:
+      value = int.from_bytes(packed, 'big')
+      return any(value & mask == network for network, mask in self._v6)
+    return False  # Not an IP address
+
+  def any(self, addresses) -> bool:
+    """True if any of `addresses` is in the set."""
+    return any(address in self for address in addresses)
+
+  def contains_many(self, addresses) -> np.ndarray:
+    """Boolean array, for every address (string) whether it is in the set."""
+    versions, ipv4, high, low = pack_addresses(addresses)
+    result = np.zeros(len(versions), dtype=bool)
+    v4 = versions == 4
+    if len(self._v4_first_array) and v4.any():
+      values = ipv4[v4]
+      index = np.searchsorted(self._v4_first_array, values, side='right') - 1
+      found = index >= 0
+      found[found] = values[found] <= self._v4_last_array[index[found]]
+      result[v4] = found
+    v6 = versions == 6
+    if self._v6_arrays and v6.any():
+      v6_high, v6_low = high[v6], low[v6]
+      found = np.zeros(len(v6_high), dtype=bool)
+      for value_high, value_low, mask_high, mask_low in self._v6_arrays:
+        found |= ((v6_high & mask_high) == value_high) & (
+            (v6_low & mask_low) == value_low)
+      result[v6] = found
+    return result
+
+
+INTERNAL = NetworkSet(INTERNAL_NETWORKS)
+PRIVATE = NetworkSet(PRIVATE_NETWORKS)
+BOGON = NetworkSet(BOGON_NETWORKS)
@@ -0,0 +1,194 @@
+import asyncio
+import collections
+import time
+
+# Congestion window bounds, in queries in flight against one resolver.
+INITIAL_WINDOW = 16
+MIN_WINDOW = 1
+MAX_WINDOW = 256
+# Token bucket refill rate bounds, in queries per second to one resolver.
+INITIAL_RATE = 100.0
+MIN_RATE = 1.0
+MAX_RATE = 2000.0
+# Queries per second added to the rate for every window's worth of replies.
+RATE_STEP = 10.0
+# Multiplicative decrease applied to both window and rate on congestion.
+BACKOFF = 0.5
+# Smoothed timeout rate above which timeouts are treated as congestion rather
+# than as the occasional dropped (or censored) query.
+TIMEOUT_RATE_THRESHOLD = 0.05
+TIMEOUT_RATE_GAIN = 0.05
+# Adaptive timeout never drops below this many seconds.
+MIN_TIMEOUT = 2.0
+
+
+class ResolverBudget:
+  """Token bucket, AIMD window and RTT estimate for a single resolver.
+
+  The window grows by one query per round trip while replies come back and
+  is halved (at most once per round trip) when the smoothed timeout rate
+  crosses TIMEOUT_RATE_THRESHOLD. The token bucket rate follows the same
+  AIMD rule. The timeout is the usual SRTT + 4 * RTTVAR estimate, clamped to
+  [MIN_TIMEOUT, max_timeout].
+  """
+
+  def __init__(self, max_timeout: float):
+    self.max_timeout = max_timeout
+    self.window = float(INITIAL_WINDOW)
+    self.rate = INITIAL_RATE
+    self.tokens = float(INITIAL_WINDOW)
+    self.in_flight = 0
+    self.srtt = None
+    self.rttvar = None
+    self.timeout_rate = 0.0
+    self.sent = 0
+    self.timeouts = 0
+    self._refilled = time.monotonic()
+    self._last_backoff = 0.0
+    self._waiters = collections.deque()
+
+  @property
+  def timeout(self) -> float:
+    if self.srtt is None:
+      return self.max_timeout
+    rto = self.srtt + 4 * self.rttvar
+    return min(max(rto, MIN_TIMEOUT), self.max_timeout)
+
+  def _refill(self) -> None:
+    now = time.monotonic()
+    self.tokens = min(self.tokens + (now - self._refilled) * self.rate,
+                      max(self.window, 1.0))
+    self._refilled = now
+
+  async def acquire(self) -> None:
+    while self.in_flight >= int(self.window):
+      waiter = asyncio.get_running_loop().create_future()
+      self._waiters.append(waiter)
+      try:
+        await waiter
+      finally:
+        if waiter in self._waiters:
+          self._waiters.remove(waiter)
+    self._refill()
+    while self.tokens < 1:
+      await asyncio.sleep((1 - self.tokens) / self.rate)
+      self._refill()
+    self.tokens -= 1
+    self.in_flight += 1
+    self.sent += 1
+
+  def release(self, rtt: float = None, timed_out: bool = False) -> None:
+    self.in_flight -= 1
+    self.timeout_rate += TIMEOUT_RATE_GAIN * (float(timed_out) -
+                                              self.timeout_rate)
+    if timed_out:
+      self.timeouts += 1
+      self._back_off()
+    elif rtt is not None:
+      self._sample(rtt)
+      self.window = min(self.window + 1 / self.window, MAX_WINDOW)
+      self.rate = min(self.rate + RATE_STEP / self.window, MAX_RATE)
+    self._wake()
+
+  def abandon(self) -> None:
+    """Free the slot of a timed out attempt that is about to be retried.
+
+    Only the query's final outcome feeds the timeout rate, so one censored
+    domain counts as one timeout however many attempts it took.
+    """
+    self.in_flight -= 1
+    self._wake()
+
+  def _sample(self, rtt: float) -> None:
+    if self.srtt is None:
+      self.srtt = rtt
+      self.rttvar = rtt / 2
+    else:
+      self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+      self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+  def _back_off(self) -> None:
+    if self.timeout_rate < TIMEOUT_RATE_THRESHOLD:
+      return
+    # One window of queries timing out together is a single congestion event.
+    now = time.monotonic()
+    if now - self._last_backoff < (self.srtt or self.max_timeout):
+      return
+    self._last_backoff = now
+    self.window = max(self.window * BACKOFF, MIN_WINDOW)
+    self.rate = max(self.rate * BACKOFF, MIN_RATE)
+
+  def _wake(self) -> None:
+    free = int(self.window) - self.in_flight
+    while free > 0 and self._waiters:
+      waiter = self._waiters.popleft()
+      if not waiter.done():
+        waiter.set_result(None)
+        free -= 1
+
+
+class RateController:
+  """Per-resolver budgets plus a global ceiling on queries in flight."""
+
+  def __init__(self, max_timeout: float, max_in_flight: int):
+    self.max_timeout = max_timeout
+    self.budgets = {}
+    self._slots = asyncio.Semaphore(max_in_flight)
+
+  def budget(self, dns_server: str) -> ResolverBudget:
+    budget = self.budgets.get(dns_server)
+    if budget is None:
+      budget = ResolverBudget(self.max_timeout)
+      self.budgets[dns_server] = budget
+    return budget
+
+  async def query(self, engine, domain: str, dns_server: str,
+                  record_type: str) -> dict:
+    """Query through `engine` within the resolver's budget.
+
+    A query that hits the adaptive timeout is retried with twice the timeout
+    before it is recorded as a Timeout, so a tight estimate never shows up as
+    a censorship signal in the results. All attempts together never take
+    longer than max_timeout, the cost of a blackholed query before, and only
+    the final timeout counts towards the resolver's timeout rate.
+    """
+    budget = self.budget(dns_server)
+    timeout = budget.timeout
+    deadline = time.monotonic() + self.max_timeout
+    while True:
+      await budget.acquire()
+      result = None
+      retry = False
+      try:
+        async with self._slots:
+          start = time.monotonic()
+          timeout = min(timeout, max(deadline - start, 0))
+          result = await engine.query(domain,
+                                      dns_server,
+                                      record_type,
+                                      timeout=timeout)
+        error_code = result['error_code']
+        retry = (error_code == 'Timeout' and
+                 deadline - time.monotonic() >= MIN_TIMEOUT)
+      finally:
+        error_code = result['error_code'] if result else None
+        if retry:
+          budget.abandon()
+        elif error_code in ('Timeout', 'UnknownError') or result is None:
+          budget.release(timed_out=error_code == 'Timeout')
+        else:
+          budget.release(time.monotonic() - start)
+      if not retry:
+        return result
+      timeout *= 2
+
+  def summary(self) -> list:
+    return [{
+        'dns_server': dns_server,
+        'window': round(budget.window, 1),
+        'rate': round(budget.rate, 1),
+        'srtt': round(budget.srtt, 3) if budget.srtt is not None else None,
+        'timeout': round(budget.timeout, 2),
+        'sent': budget.sent,
+        'timeouts': budget.timeouts
+    } for dns_server, budget in self.budgets.items()]
@@ -0,0 +1,212 @@
+import ast
+import csv
+import os
+from datetime import datetime
+
+try:
+  import pyarrow as pa
+  import pyarrow.compute as pc
+  import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional, CSV keeps working without it
+  pa = None
+  pc = None
+  pq = None
+
+CSV_FIELDS = [
+    "timestamp", "domain", "dns_server", "record_type", "answers",
+    "error_code", "error_reason"
+]
+RESULT_EXTENSIONS = ('.csv', '.parquet')
+
+if pa is not None:
+  # Servers, record types and error codes repeat on nearly every row, so
+  # they are stored dictionary encoded.
+  RESULT_SCHEMA = pa.schema([
+      ('timestamp', pa.timestamp('us')),
+      ('domain', pa.string()),
+      ('dns_server', pa.dictionary(pa.int32(), pa.string())),
+      ('record_type', pa.dictionary(pa.int8(), pa.string())),
+      ('answers', pa.list_(pa.string())),
+      ('error_code', pa.dictionary(pa.int8(), pa.string())),
+      ('error_reason', pa.string()),
+  ])
+else:
+  RESULT_SCHEMA = None
+
+
+def parquet_available() -> bool:
+  return pa is not None
+
+
+def _require_pyarrow() -> None:
+  if pa is None:
+    raise ImportError('pyarrow is required for Parquet results, '
+                      'install it with `pip install pyarrow`')
+
+
+class ParquetResultWriter:
+  """Append DNS poisoning results to a daily Parquet file.
+
+  Every `write` call becomes one row group, stamped with a single timestamp
+  for the whole batch. Parquet files cannot be reopened for appending, so a
+  restart on the same day continues in a new `.partN` file next to the old
+  one. `list_result_files` and `read_results` treat them as one day.
+  """
+
+  def __init__(self, folder_path: str, prefix: str = 'DNS_Checking_Result'):
+    _require_pyarrow()
+    self.folder_path = folder_path
+    self.prefix = prefix
+    self.filepath = None
+    self._writer = None
+    self._day = None
+
+  def _path_for(self, day: str) -> str:
+    filepath = os.path.join(self.folder_path, f'{self.prefix}_{day}.parquet')
+    part = 1
+    while os.path.exists(filepath):
+      filepath = os.path.join(self.folder_path,
+                              f'{self.prefix}_{day}.part{part}.parquet')
+      part += 1
+    return filepath
+
+  def _open(self, now: datetime) -> None:
+    day = now.strftime("%Y_%m_%d")
+    if self._writer is not None and day == self._day:
+      return
+    self.close()
+    os.makedirs(self.folder_path, exist_ok=True)
+    self._day = day
+    self.filepath = self._path_for(day)
+    self._writer = pq.ParquetWriter(self.filepath,
+                                    RESULT_SCHEMA,
+                                    compression='zstd')
+
+  def write(self, results: list) -> None:
+    if not results:
+      return
+    now = datetime.now()
+    self._open(now)
+    columns = {
+        'timestamp': [now] * len(results),
+        'domain': [row['domain'] for row in results],
+        'dns_server': [row['dns_server'] for row in results],
+        'record_type': [row['record_type'] for row in results],
+        'answers': [row['answers'] for row in results],
+        'error_code': [row['error_code'] for row in results],
+        'error_reason': [row['error_reason'] for row in results],
+    }
+    self._writer.write_table(pa.table(columns, schema=RESULT_SCHEMA))
+
+  def close(self) -> None:
+    if self._writer is not None:
+      self._writer.close()
+      self._writer = None
+
+
+def list_result_files(folder_path: str) -> list:
+  return sorted(
+      os.path.join(folder_path, file) for file in os.listdir(folder_path)
+      if file.endswith(RESULT_EXTENSIONS))
+
+
+def fast_literal_eval(text: str):
+  """Drop-in `ast.literal_eval` for the list cells of the result CSVs.
+
+  Lists of plain strings as str(list) prints them, `['1.2.3.4', '::1']`, are
+  split directly, about ten times faster than parsing them. Anything else
+  (escapes, double quoted items, other spacing, non-list values) goes to
+  `ast.literal_eval`, with the same result and the same exceptions.
+  """
+  if not isinstance(text, str):
+    return ast.literal_eval(text)
+  if text.startswith("['") and text.endswith("']") and '\\' not in text:
+    inner = text[2:-2]
+    items = inner.split("', '")
+    # Any other quote means an item was not a plain single quoted string
+    if inner.count("'") == 2 * (len(items) - 1):
+      return items
+  elif text == '[]':
+    return []
+  return ast.literal_eval(text)
+
+
+def parse_answers(value) -> list:
+  """Turn a CSV `answers` cell (a Python list repr) back into a list."""
+  if isinstance(value, list):
+    return value
+  if not value:
+    return []
+  try:
+    answers = fast_literal_eval(value)
+  except (ValueError, SyntaxError):
+    return [value]
+  return answers if isinstance(answers, list) else [str(answers)]
+
+
+def read_results(paths, columns: list = None):
+  """Load result files into one pyarrow Table for vectorised analysis.
+
+  Parquet files are read column by column without touching Python objects.
+  CSV files from older sweeps are parsed row by row and converted to the same
+  schema, so callers do not need to care which format a sweep was written in.
+  """
+  _require_pyarrow()
+  if isinstance(paths, str):
+    paths = [paths]
+  tables = []
+  for path in paths:
+    if path.endswith('.parquet'):
+      tables.append(pq.read_table(path, columns=columns))
+    else:
+      tables.append(_read_csv_table(path, columns))
+  if not tables:
+    schema = RESULT_SCHEMA if columns is None else pa.schema(
+        [RESULT_SCHEMA.field(c) for c in columns])
+    return schema.empty_table()
+  return pa.concat_tables(tables).unify_dictionaries()
+
+
+def _read_csv_table(path: str, columns: list = None):
+  rows = {field: [] for field in CSV_FIELDS}
+  for row in _iter_csv_rows(path):
+    for field in CSV_FIELDS:
+      rows[field].append(row[field])
+  rows['timestamp'] = [
+      datetime.fromisoformat(ts) if ts else None for ts in rows['timestamp']
+  ]
+  table = pa.table(rows, schema=RESULT_SCHEMA)
+  return table.select(columns) if columns is not None else table
+
+
+def normalize_csv_row(row: dict) -> dict:
+  """Bring a CSV DictReader row to the shape `iter_results` yields."""
+  row['answers'] = parse_answers(row.get('answers'))
+  for field in ('error_code', 'error_reason'):
+    row[field] = row.get(field) or None
+  return row
+
+
+def _iter_csv_rows(path: str):
+  with open(path, 'r', newline='', encoding='utf-8') as csvfile:
+    for row in csv.DictReader(csvfile):
+      yield normalize_csv_row(row)
+
+
+def iter_results(path: str, batch_size: int = 65536):
+  """Yield result rows as dicts, with `answers` already a list.
+
+  Row-oriented counterpart of `read_results` for importers that build one
+  document per row. Timestamps are returned as ISO strings, as in the CSV.
+  """
+  if not path.endswith('.parquet'):
+    yield from _iter_csv_rows(path)
+    return
+  _require_pyarrow()
+  parquet_file = pq.ParquetFile(path)
+  for batch in parquet_file.iter_batches(batch_size=batch_size):
+    timestamps = pc.strftime(batch.column('timestamp'),
+                             format='%Y-%m-%dT%H:%M:%S').to_pylist()
+    for timestamp, row in zip(timestamps, batch.to_pylist()):
+      row['timestamp'] = timestamp
+      yield row
@@ -0,0 +1,179 @@
+import asyncio
+import itertools
+import random
+import socket
+import struct
+
+PROBE_PORT = 80
+# Shared deadline for one batch of SYNs (in seconds), as sr1(timeout=2).
+PROBE_TIMEOUT = 2.0
+# Source ports for the SYNs, outside the usual Linux ephemeral range so the
+# kernel does not hand the same port to a real connection.
+SOURCE_PORTS = range(20000, 32000)
+TCP_HEADER = struct.Struct('!HHIIBBHHH')
+PSEUDO_HEADER = struct.Struct('!4s4sBBH')
+
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+
+def _checksum(data: bytes) -> int:
+  if len(data) % 2:
+    data += b'\0'
+  total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+  while total >> 16:
+    total = (total & 0xFFFF) + (total >> 16)
+  return ~total & 0xFFFF
+
+
+def build_syn(source: str, destination: str, source_port: int,
+              seq: int) -> bytes:
+  """TCP SYN header to `destination`:PROBE_PORT, checksummed for raw send."""
+  header = TCP_HEADER.pack(source_port, PROBE_PORT, seq, 0, 5 << 4, TCP_SYN,
+                           64240, 0, 0)
+  pseudo = PSEUDO_HEADER.pack(socket.inet_aton(source),
+                              socket.inet_aton(destination), 0,
+                              socket.IPPROTO_TCP, len(header))
+  return header[:16] + struct.pack('!H', _checksum(pseudo + header)) + header[18:]
+
+
+class RstProber:
+  """Send SYNs to many IPv4 addresses from one raw socket.
+
+  All addresses of a batch are probed at once and share one deadline, so a
+  traceroute with twenty hops costs one PROBE_TIMEOUT instead of twenty.
+  Replies are matched by our source port and the acknowledged sequence
+  number, which also catches a SYN-ACK coming back from a different address
+  than the one probed. Verdicts are cached per address for the lifetime of
+  the prober, which is one sweep round.
+
+  Linux only, the raw TCP socket needs root or CAP_NET_RAW.
+  """
+
+  def __init__(self, timeout: float = PROBE_TIMEOUT):
+    self.timeout = timeout
+    self._socket = None
+    self._ports = itertools.cycle(SOURCE_PORTS)
+    self._pending = {}
+    self._verdicts = {}
+    self._inflight = {}
+
+  def _open(self) -> socket.socket:
+    if self._socket is None:
+      sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
+      sock.setblocking(False)
+      asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable,
+                                            sock)
+      self._socket = sock
+    return self._socket
+
+  def _on_readable(self, sock: socket.socket) -> None:
+    while True:
+      try:
+        data = sock.recv(65535)
+      except (BlockingIOError, InterruptedError):
+        return
+      except OSError:
+        return
+      try:
+        self._on_segment(data)
+      except (IndexError, struct.error):
+        continue  # Truncated packet
+
+  def _on_segment(self, data: bytes) -> None:
+    responder = socket.inet_ntoa(data[12:16])
+    tcp = data[(data[0] & 0x0F) * 4:]
+    source_port, destination_port, _, ack, _, flags, _, _, _ = TCP_HEADER.unpack(
+        tcp[:TCP_HEADER.size])
+    if source_port != PROBE_PORT:
+      return
+    pending = self._pending.get(destination_port)
+    if pending is None:
+      return
+    ip, seq, future = pending
+    if ack != (seq + 1) & 0xFFFFFFFF or future.done():
+      return  # Not an answer to our SYN
+    rst_detected = bool(flags & TCP_RST)
+    syn_ack = flags & (TCP_SYN | TCP_ACK) == TCP_SYN | TCP_ACK
+    future.set_result((rst_detected, syn_ack and responder != ip))
+
+  def _send(self, sock: socket.socket, ip: str, future) -> int:
+    route = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+      route.connect((ip, PROBE_PORT))  # Only picks the source address
+      source = route.getsockname()[0]
+    finally:
+      route.close()
+    port = next(self._ports)
+    while port in self._pending:
+      port = next(self._ports)
+    seq = random.getrandbits(32)
+    self._pending[port] = (ip, seq, future)
+    try:
+      sock.sendto(build_syn(source, ip, port, seq), (ip, 0))
+    except OSError:
+      del self._pending[port]
+      raise
+    return port
+
+  async def probe(self, ips: list) -> dict:
+    """{ip: (rst_detected, redirection_detected)} for every IPv4 in `ips`.
+
+    Addresses that did not answer before the deadline count as neither.
+    Addresses that could not be probed at all are left out.
+    """
+    loop = asyncio.get_running_loop()
+    sock = self._open()
+    waiting = {}
+    ports = []
+    for ip in dict.fromkeys(ips):
+      if ip in self._verdicts:
+        continue
+      future = self._inflight.get(ip)
+      if future is None:
+        future = loop.create_future()
+        try:
+          ports.append(self._send(sock, ip, future))
+        except OSError as e:
+          print(f"Error checking TCP RST and redirection for {ip}: {e}")
+          continue
+        self._inflight[ip] = future
+      waiting[ip] = future
+    try:
+      if waiting:
+        await asyncio.wait(set(waiting.values()), timeout=self.timeout)
+    finally:
+      for port in ports:
+        ip, _, future = self._pending.pop(port)
+        self._verdicts[ip] = future.result() if future.done() else (False,
+                                                                    False)
+        self._inflight.pop(ip, None)
+        if not future.done():
+          future.set_result(self._verdicts[ip])
+    # A future shared with another call may resolve before that call has
+    # filled in _verdicts, so read answers from the futures themselves.
+    verdicts = {}
+    for ip in dict.fromkeys(ips):
+      future = waiting.get(ip)
+      if future is not None:
+        if future.done():
+          verdicts[ip] = future.result()
+      elif ip in self._verdicts:
+        verdicts[ip] = self._verdicts[ip]
+    return verdicts
+
+  async def check(self, ips: list) -> tuple:
+    """(rst_detected, redirection_detected) over all of `ips`."""
+    verdicts = (await self.probe(ips)).values()
+    return (any(rst for rst, _ in verdicts),
+            any(redirected for _, redirected in verdicts))
+
+  def close(self) -> None:
+    if self._socket is not None:
+      try:
+        asyncio.get_running_loop().remove_reader(self._socket.fileno())
+      except RuntimeError:
+        pass  # Event loop already gone
+      self._socket.close()
+      self._socket = None
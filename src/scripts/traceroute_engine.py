@@ -0,0 +1,298 @@
+import asyncio
+import socket
+import struct
+import time
+
+BASE_PORT = 33434  # Classic traceroute destination port
+MAX_HOPS = 30
+PROBES_PER_HOP = 2
+# How long to wait for the reply to a probe (in seconds).
+PROBE_TIMEOUT = 3.0
+MAX_CONCURRENT_TRACES = 512
+# Routers rate-limit the ICMP errors they send back, often to a handful per
+# second per source, so probes are paced instead of sent in one burst: one
+# TTL at a time per trace with a gap in between, at most a few TTLs of a
+# trace awaiting replies, and a cap on probes per second over all traces.
+PROBE_INTERVAL = 0.05  # Gap between two TTLs of one trace (in seconds)
+MAX_OUTSTANDING_HOPS = 4
+PROBES_PER_SECOND = 1000
+UDP_HEADER = struct.Struct('!HHHH')
+
+ICMP_DEST_UNREACH = 3
+ICMP_TIME_EXCEEDED = 11
+ICMP_PORT_UNREACH = 3
+ICMP6_DEST_UNREACH = 1
+ICMP6_TIME_EXCEEDED = 3
+ICMP6_PORT_UNREACH = 4
+
+# Destination Unreachable codes, worded like the Windows tracert messages
+# error_normalizer.TRACEROUTE_ERRORS already understands.
+UNREACHABLE_REASONS = {
+    0: 'Network Unreachable',
+    1: 'Host Unreachable',
+    2: 'Protocol Unreachable',
+    4: 'Fragmentation Needed',
+    5: 'Source Route Failed',
+    6: 'Destination Network Unknown',
+    7: 'Destination Host Unknown',
+    8: 'Source Host Isolated',
+    9: 'Communication with Destination Network Administratively Prohibited',
+    10: 'Communication with Destination Host Administratively Prohibited',
+    11: 'Destination Network Unreachable for Type of Service',
+    12: 'Destination Host Unreachable for Type of Service',
+    13: 'Communication Administratively Prohibited',
+    14: 'Host Precedence Violation',
+    15: 'Precedence cutoff in effect',
+}
+ICMP6_UNREACHABLE_REASONS = {
+    0: 'Network Unreachable',
+    1: 'Communication Administratively Prohibited',
+    2: 'Source Route Failed',
+    3: 'Host Unreachable',
+    5: 'Communication Administratively Prohibited',
+    6: 'Communication Administratively Prohibited',
+}
+
+
+class _Trace:
+  """Probes and replies for one running traceroute."""
+
+  def __init__(self, destination: str, max_hops: int):
+    self.destination = destination
+    self.max_hops = max_hops
+    self.sent = {}
+    self.hops = {}
+    self.final_ttl = None
+    self.reached = False
+    self.errors = []
+    self.done = asyncio.Event()
+    self.answered = asyncio.Event()
+
+  def record(self, ttl: int, probe: int, responder: str, received: float,
+             final: bool, error: str = None) -> None:
+    sent = self.sent.get((ttl, probe))
+    if sent is None or ttl in self.hops:
+      return  # Unknown probe, or the other probe for this hop won
+    self.hops[ttl] = (responder, (received - sent) * 1000)
+    self.answered.set()
+    if final and (self.final_ttl is None or ttl < self.final_ttl):
+      self.final_ttl = ttl
+      self.reached = error is None
+      if error is not None and error not in self.errors:
+        self.errors.append(error)
+    last = self.final_ttl or self.max_hops
+    if all(hop in self.hops for hop in range(1, last + 1)):
+      self.done.set()
+
+  def outstanding(self, now: float, timeout: float) -> int:
+    """TTLs sent less than `timeout` ago that no hop has answered yet."""
+    return sum(1 for (ttl, probe), sent in self.sent.items()
+               if probe == 0 and ttl not in self.hops and now - sent < timeout)
+
+  def result(self, family: int) -> dict:
+    last = self.final_ttl or self.max_hops
+    hops = [{
+        'ttl': ttl,
+        'ip': self.hops[ttl][0],
+        'rtt': round(self.hops[ttl][1], 3)
+    } for ttl in range(1, last + 1) if ttl in self.hops]
+    # Same layout as the scraped tracert output: the target first, then every
+    # hop that answered, in TTL order.
+    addresses = [self.destination] + [hop['ip'] for hop in hops]
+    ips = {'ipv4': [], 'ipv6': []}
+    ips['ipv6' if family == socket.AF_INET6 else 'ipv4'] = addresses
+    return {
+        'ips': ips,
+        'hops': hops,
+        'reached': self.reached,
+        'errors': self.errors
+    }
+
+
+class _Pacer:
+  """Spaces sends at least 1 / `rate` seconds apart, across all callers."""
+
+  def __init__(self, rate: float):
+    self.interval = 1 / rate
+    self._next = 0.0
+
+  async def wait(self) -> None:
+    now = time.monotonic()
+    slot = max(self._next, now)
+    self._next = slot + self.interval  # Reserved before sleeping
+    if slot > now:
+      await asyncio.sleep(slot - now)
+
+
+class TracerouteEngine:
+  """Paris-style UDP traceroute for many targets on one event loop.
+
+  Every trace sends its TTL-limited probes from its own UDP socket to a
+  fixed destination port, so the flow tuple never changes between hops and
+  load balancers keep the probes on one path. The TTL is carried in the UDP
+  length. Probes are paced (see PROBE_INTERVAL) so rate-limited routers do
+  not show up as silent hops, and no TTL past the destination is probed once
+  it has answered. ICMP Time Exceeded and Destination Unreachable replies are
+  read from one raw socket per address family and matched to their trace by
+  the quoted destination address, source port and length.
+
+  Linux only, and the raw ICMP sockets need root or CAP_NET_RAW.
+  """
+
+  def __init__(self,
+               max_hops: int = MAX_HOPS,
+               timeout: float = PROBE_TIMEOUT,
+               max_concurrent: int = MAX_CONCURRENT_TRACES,
+               interval: float = PROBE_INTERVAL,
+               max_outstanding: int = MAX_OUTSTANDING_HOPS,
+               probes_per_second: float = PROBES_PER_SECOND):
+    self.max_hops = max_hops
+    self.timeout = timeout
+    self.interval = interval
+    self.max_outstanding = max_outstanding
+    self._pacer = _Pacer(probes_per_second)
+    self._receivers = {}
+    self._traces = {}
+    self._slots = asyncio.Semaphore(max_concurrent)
+
+  def _receiver(self, family: int) -> socket.socket:
+    sock = self._receivers.get(family)
+    if sock is None:
+      protocol = (socket.IPPROTO_ICMPV6
+                  if family == socket.AF_INET6 else socket.IPPROTO_ICMP)
+      sock = socket.socket(family, socket.SOCK_RAW, protocol)
+      sock.setblocking(False)
+      asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable,
+                                            family, sock)
+      self._receivers[family] = sock
+    return sock
+
+  def _on_readable(self, family: int, sock: socket.socket) -> None:
+    while True:
+      try:
+        data, address = sock.recvfrom(65535)
+      except (BlockingIOError, InterruptedError):
+        return
+      except OSError:
+        return
+      try:
+        self._on_icmp(family, data, address[0], time.monotonic())
+      except (IndexError, struct.error):
+        continue  # Truncated or unrelated ICMP message
+
+  def _on_icmp(self, family: int, data: bytes, responder: str,
+               received: float) -> None:
+    if family == socket.AF_INET:
+      icmp = data[(data[0] & 0x0F) * 4:]  # IPv4 raw sockets keep the header
+      icmp_type, code = icmp[0], icmp[1]
+      if icmp_type == ICMP_TIME_EXCEEDED:
+        final, error = False, None
+      elif icmp_type == ICMP_DEST_UNREACH:
+        final = True
+        error = None if code == ICMP_PORT_UNREACH else UNREACHABLE_REASONS.get(
+            code, 'Destination Unreachable')
+      else:
+        return
+      quoted = icmp[8:]
+      if quoted[9] != socket.IPPROTO_UDP:
+        return
+      destination = socket.inet_ntop(socket.AF_INET, quoted[16:20])
+      udp = quoted[(quoted[0] & 0x0F) * 4:][:UDP_HEADER.size]
+    else:
+      icmp_type, code = data[0], data[1]
+      if icmp_type == ICMP6_TIME_EXCEEDED:
+        final, error = False, None
+      elif icmp_type == ICMP6_DEST_UNREACH:
+        final = True
+        error = None if code == ICMP6_PORT_UNREACH else ICMP6_UNREACHABLE_REASONS.get(
+            code, 'Destination Unreachable')
+      else:
+        return
+      quoted = data[8:]
+      if quoted[6] != socket.IPPROTO_UDP:
+        return  # Extension headers are not used by our probes
+      destination = socket.inet_ntop(socket.AF_INET6, quoted[24:40])
+      udp = quoted[40:40 + UDP_HEADER.size]
+    source_port, _, length, _ = UDP_HEADER.unpack(udp)
+    trace = self._traces.get((destination, source_port))
+    if trace is None:
+      return
+    probe, ttl = divmod(length - UDP_HEADER.size, self.max_hops + 1)
+    trace.record(ttl, probe, responder, received, final, error)
+
+  def _open_probe_socket(self, family: int) -> socket.socket:
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.bind(('::' if family == socket.AF_INET6 else '0.0.0.0', 0))
+    return sock
+
+  async def _wait_for_window(self, trace: _Trace) -> None:
+    while trace.outstanding(time.monotonic(),
+                            self.timeout) >= self.max_outstanding:
+      trace.answered.clear()
+      try:
+        await asyncio.wait_for(trace.answered.wait(), self.interval)
+      except asyncio.TimeoutError:
+        pass  # Check again, the oldest probe may have expired
+
+  async def _send_probes(self, family: int, sock: socket.socket,
+                         trace: _Trace) -> None:
+    if family == socket.AF_INET6:
+      level, option = socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS
+    else:
+      level, option = socket.IPPROTO_IP, socket.IP_TTL
+    for ttl in range(1, self.max_hops + 1):
+      if ttl > 1:
+        await asyncio.sleep(self.interval)
+        await self._wait_for_window(trace)
+      if trace.final_ttl is not None and ttl > trace.final_ttl:
+        return  # The destination (or an unreachable) already answered
+      sock.setsockopt(level, option, ttl)
+      for probe in range(PROBES_PER_HOP):
+        await self._pacer.wait()
+        trace.sent[(ttl, probe)] = time.monotonic()
+        try:
+          # Payload length encodes (probe, ttl); ports stay fixed.
+          sock.sendto(bytes(probe * (self.max_hops + 1) + ttl),
+                      (trace.destination, BASE_PORT))
+        except OSError:
+          if ttl == 1 and probe == 0:
+            raise
+          return  # e.g. EHOSTUNREACH once the route is known to be gone
+
+  async def trace(self, destination: str) -> dict:
+    """Trace the path to an IPv4 or IPv6 address.
+
+    Returns {'ips', 'hops', 'reached', 'errors'}, where 'ips' has the same
+    {'ipv4': [...], 'ipv6': [...]} layout as GFW_Location_IPBlocking.traceroute
+    and 'hops' adds the TTL and RTT (ms) of every hop that answered.
+    """
+    family = socket.AF_INET6 if ':' in destination else socket.AF_INET
+    destination = socket.inet_ntop(family,
+                                   socket.inet_pton(family, destination))
+    async with self._slots:
+      self._receiver(family)
+      trace = _Trace(destination, self.max_hops)
+      sock = self._open_probe_socket(family)
+      key = (destination, sock.getsockname()[1])
+      self._traces[key] = trace
+      try:
+        await self._send_probes(family, sock, trace)
+        try:
+          # Counted from the last probe sent
+          await asyncio.wait_for(trace.done.wait(), self.timeout)
+        except asyncio.TimeoutError:
+          pass  # Hops that never answered are simply left out
+      finally:
+        self._traces.pop(key, None)
+        sock.close()
+      return trace.result(family)
+
+  def close(self) -> None:
+    for sock in self._receivers.values():
+      try:
+        asyncio.get_running_loop().remove_reader(sock.fileno())
+      except RuntimeError:
+        pass  # Event loop already gone
+      sock.close()
+    self._receivers.clear()